@@ -1,4 +1,5 @@
 # 配置项（API key/路径等）
+import json
 import os
 from dotenv import load_dotenv
 
@@ -7,6 +8,28 @@ load_dotenv()
 class Config:
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     DATABASE_PATH = os.getenv("DATABASE_PATH", "data/memory.db")
+    EPISODIC_LOG_PATH = os.getenv("EPISODIC_LOG_PATH", "data/episodic_memory.jsonl")
+    SHORT_TERM_CAPACITY = int(os.getenv("SHORT_TERM_CAPACITY", "100"))
+    CONSOLIDATION_BATCH_SIZE = int(os.getenv("CONSOLIDATION_BATCH_SIZE", "50"))
+    SHORT_TERM_MAX_AGE = float(os.getenv("SHORT_TERM_MAX_AGE", "3600"))
+    CONSOLIDATION_QUEUE_SIZE = int(os.getenv("CONSOLIDATION_QUEUE_SIZE", "8"))
+    DEDUP_SIMILARITY_THRESHOLD = float(os.getenv("DEDUP_SIMILARITY_THRESHOLD", "0.95"))  # 余弦相似度不低于该值视为重复
+    DEDUP_LSH_BITS = int(os.getenv("DEDUP_LSH_BITS", "16"))  # 每张LSH表的随机超平面数（桶签名位数）
+    DEDUP_LSH_TABLES = int(os.getenv("DEDUP_LSH_TABLES", "4"))  # LSH表数，越多召回越高
+    DEDUP_BLOCK_SIZE = int(os.getenv("DEDUP_BLOCK_SIZE", "8192"))  # 分块读取向量的行数
+    MEMORY_MAX_PER_USER = int(os.getenv("MEMORY_MAX_PER_USER", "10000"))  # 每个用户最多保留的记忆数，0 表示不限
+    MEMORY_MAX_ENTRIES = int(os.getenv("MEMORY_MAX_ENTRIES", "0"))  # 全部记忆的总上限，0 表示不限
+    MEMORY_TTL_BY_TYPE = json.loads(os.getenv("MEMORY_TTL_BY_TYPE", "{}"))  # 按记忆类型的存活时间（秒），如 {"query": 2592000}
+    MEMORY_DECAY_HALF_LIFE = float(os.getenv("MEMORY_DECAY_HALF_LIFE", "604800"))  # 保留分数随闲置时间衰减的半衰期（秒）
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))  # 每个嵌入请求最多的文本数
+    EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "100000"))  # 每个嵌入请求最多的token数（估算）
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.db")  # 多进程共享的嵌入缓存文件
+    EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "50000"))  # 进程内 LRU 最多保留的向量数
+    EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))  # 同时进行的嵌入请求数
+    EMBEDDING_ENGINE = os.getenv("EMBEDDING_ENGINE", "auto").lower()  # openai / local / auto（有 API key 时用 openai，否则用本地嵌入）
+    # 本地嵌入的向量维度，默认与向量库维度（EMBEDDING_DIMENSION，见 config/vector_db_config.py）一致
+    # 不导入 config 包：python app/main.py 启动时 app/ 在 sys.path 最前，config 会解析为本文件
+    LOCAL_EMBEDDING_DIMENSION = int(os.getenv("LOCAL_EMBEDDING_DIMENSION", os.getenv("EMBEDDING_DIMENSION", "768")))
     LOGS_PATH = os.getenv("LOGS_PATH", "data/logs")
     MODEL_NAME = os.getenv("MODEL_NAME", "gpt-3.5-turbo")
     OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/chat")
\ No newline at end of file
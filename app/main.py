@@ -1,4 +1,5 @@
 # Flask应用入口
+import os
 import sys
 from pathlib import Path
 # 添加app目录到Python路径
@@ -29,6 +30,15 @@ def serve_chat():
 app.register_blueprint(query_bp)
 app.register_blueprint(train_bp, url_prefix='/api/v1')
 
+def preload_vector_store():
+    """启动时加载一次FAISS索引，后续请求共享该实例"""
+    from core.memory.faiss_vector_store import get_vector_store
+    get_vector_store()
+
+# 作为 WSGI 模块导入时（如 gunicorn）立即加载；gunicorn --preload 时由 master 持有写入锁，worker 的写入转发给它
+if __name__ != '__main__':
+    preload_vector_store()
+
 if __name__ == '__main__':
     import argparse
     
@@ -42,5 +52,9 @@ if __name__ == '__main__':
     for rule in app.url_map.iter_rules():
         print(f'  {rule.endpoint}: {rule.rule}')
     
+    # debug 模式下 werkzeug 的重载监控进程只负责重启子进程，不加载索引，写入锁留给处理请求的子进程（带 WERKZEUG_RUN_MAIN）
+    if not args.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        preload_vector_store()
+    
     # 根据参数决定是否启用debug模式
     app.run(host='0.0.0.0', port=8000, debug=args.debug)
\ No newline at end of file
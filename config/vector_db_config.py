@@ -12,4 +12,55 @@ class FAISSConfig:
     DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", "768"))
     
     # 搜索返回的最相似向量数
-    SEARCH_TOP_K = int(os.getenv("FAISS_SEARCH_TOP_K", "5"))
\ No newline at end of file
+    SEARCH_TOP_K = int(os.getenv("FAISS_SEARCH_TOP_K", "5"))
+    
+    # 预写日志（WAL）累计到该字节数时触发快照
+    WAL_MAX_BYTES = int(os.getenv("FAISS_WAL_MAX_BYTES", str(64 * 1024 * 1024)))
+    
+    # 距上次快照超过该秒数且有未快照写入时触发快照
+    SNAPSHOT_INTERVAL = float(os.getenv("FAISS_SNAPSHOT_INTERVAL", "300"))
+    
+    # 每次写WAL后是否fsync（更安全但更慢）
+    WAL_FSYNC = os.getenv("FAISS_WAL_FSYNC", "false").lower() == "true"
+    
+    # 分级索引策略：向量数超过阈值后在后台把 IndexFlatL2 升级为 "ivf"、"hnsw" 或压缩索引，"none" 表示始终使用暴力检索
+    UPGRADE_INDEX_TYPE = os.getenv("FAISS_UPGRADE_INDEX_TYPE", "ivf").lower()
+    UPGRADE_THRESHOLD = int(os.getenv("FAISS_UPGRADE_THRESHOLD", "50000"))
+    
+    # IVF参数：聚类中心数（0表示按 4*sqrt(N) 自动选择）和检索时探查的聚类数
+    IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", "0"))
+    NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+    
+    # HNSW参数：每个节点的邻居数、构建和检索时的候选队列长度
+    HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+    HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200"))
+    EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+    
+    # 索引加载方式："memory" 读入进程私有内存；"mmap" 只读内存映射，多个worker共享页缓存，首次写入时才拷贝到私有内存
+    LOAD_MODE = os.getenv("FAISS_LOAD_MODE", "memory").lower()
+    
+    # 删除标记占索引向量数的比例超过该值（且数量不少于下限）时，后台压缩重建索引
+    COMPACTION_THRESHOLD = float(os.getenv("FAISS_COMPACTION_THRESHOLD", "0.2"))
+    COMPACTION_MIN_TOMBSTONES = int(os.getenv("FAISS_COMPACTION_MIN_TOMBSTONES", "100"))
+    
+    # 相似度度量："l2" 欧氏距离；"cosine" 写入时归一化并使用内积索引（与 EmbeddingModel.cosine_similarity 一致）；"ip" 原始内积
+    METRIC = os.getenv("FAISS_METRIC", "l2").lower()
+    
+    # 压缩索引：FAISS_UPGRADE_INDEX_TYPE 设为 "sq8"（约4倍压缩）、"pq" 或 "ivfpq"（约16倍以上）即在超过阈值后切换为压缩索引
+    # PQ子空间数（需整除向量维度，不整除时自动取最大约数）和每个子空间的编码位数
+    PQ_M = int(os.getenv("FAISS_PQ_M", "64"))
+    PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", "8"))
+    
+    # 压缩索引检索时先召回 k*RERANK_FACTOR 个候选，再用磁盘上的原始向量计算精确距离重排（1 表示不重排）
+    RERANK_FACTOR = int(os.getenv("FAISS_RERANK_FACTOR", "4"))
+    
+    # 分片数：大于1时向量按标签取模分到多个子索引，检索时各分片在多个线程中并行执行后合并 top-k
+    NUM_SHARDS = int(os.getenv("FAISS_NUM_SHARDS", "1"))
+    
+    # 快照按代写入 INDEX_PATH.snapshots/gen-XXXXXXXX，保留最近几代；最新一代校验失败时回退到上一代并用归档日志补回
+    SNAPSHOT_KEEP_GENERATIONS = int(os.getenv("FAISS_SNAPSHOT_KEEP_GENERATIONS", "3"))
+    # 加载快照时超过该字节数的文件只校验大小，较小的文件（ID映射、元数据等）同时校验 CRC32，避免每次加载都完整读一遍大索引
+    SNAPSHOT_CRC_MAX_BYTES = int(os.getenv("FAISS_SNAPSHOT_CRC_MAX_BYTES", str(64 * 1024 * 1024)))
+    # 同一索引只有一个写入进程（持有 INDEX_PATH.lock 独占锁），其他进程只读打开，写入经 INDEX_PATH.sock 转发给写入进程，
+    # 并自动热加载写入进程提交的新快照代（转发的写入在下一代快照提交后可被检索）
+    HOT_RELOAD = os.getenv("FAISS_HOT_RELOAD", "true").lower() == "true"
@@ -0,0 +1,149 @@
+"""
+情景记忆后台整合线程
+短期记忆把待整合的批次放入有界队列后立即返回，摘要、向量化和落盘都在后台线程中批量完成，
+不占用任何请求的处理时间
+"""
+import queue
+import threading
+from typing import Any, Callable, Dict, List
+
+from app.config import Config
+from utils.helpers import SharedDependency, SharedInstance
+from utils.logging_config import get_logger
+logger = get_logger(__name__)
+
+# 摘要的最大长度（字符）
+_SUMMARY_MAX_CHARS = 500
+
+# 进程内共享的整合线程
+_shared_worker = SharedInstance(lambda: ConsolidationWorker())
+
+
+def get_consolidation_worker() -> "ConsolidationWorker":
+    """获取进程内共享的整合线程"""
+    return _shared_worker.get()
+
+
+def summarize_episodes(episodes: List[Dict[str, Any]]) -> List[str]:
+    """默认摘要：把情景的字段拼接为一行文本并截断，作为记忆内容和向量化的输入"""
+    summaries = []
+    for episode in episodes:
+        summary = "; ".join(f"{key}: {value}" for key, value in episode.items())
+        summaries.append(summary[:_SUMMARY_MAX_CHARS])
+    return summaries
+
+
+class ConsolidationWorker:
+    # 构造时未传入的依赖在首次访问时取进程内共享实例
+    embedding_model = SharedDependency("models.embedding_model:EmbeddingModel")
+    vector_store = SharedDependency("core.memory.faiss_vector_store:get_vector_store")
+    content_store = SharedDependency("core.memory.content_store:get_content_store")
+    long_term = SharedDependency("core.memory.episodic_log:get_episodic_log")
+
+    def __init__(
+        self,
+        summarizer: Callable[[List[Dict[str, Any]]], List[str]] = None,
+        embedding_model=None,
+        vector_store=None,
+        content_store=None,
+        long_term=None,
+        queue_size: int = None
+    ):
+        """
+        :param summarizer: 批量摘要函数，输入情景列表，返回等长的摘要文本列表
+        :param embedding_model: 向量化模型（需提供 embed_batch），默认 EmbeddingModel
+        :param vector_store: 向量库，默认共享的FAISS向量库
+        :param content_store: 内容库，默认共享的SQLite内容库
+        :param long_term: 情景记忆日志，默认共享的日志
+        :param queue_size: 队列最多容纳的批次数，队列满时 submit 立即返回 False
+        """
+        self.summarizer = summarizer or summarize_episodes
+        self._embedding_model = embedding_model
+        self._vector_store = vector_store
+        self._content_store = content_store
+        self._long_term = long_term
+        self._queue = queue.Queue(maxsize=queue_size or Config.CONSOLIDATION_QUEUE_SIZE)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, episodes: List[Any]) -> bool:
+        """
+        提交一批待整合的情景（Episode），不阻塞调用方
+        :return: 是否已放入队列；队列已满或已关闭时返回 False，调用方保留这批情景稍后重试
+        """
+        if self._closed or not episodes:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(list(episodes))
+            return True
+        except queue.Full:
+            logger.warning(f"Consolidation queue is full, deferring {len(episodes)} episodes")
+            return False
+
+    def flush(self):
+        """等待已提交的批次全部落盘"""
+        self._queue.join()
+
+    def close(self):
+        """处理完队列中剩余的批次后停止后台线程"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+
+    def _ensure_started(self):
+        """首次提交时启动后台线程"""
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="episodic-consolidator", daemon=True
+                    )
+                    self._thread.start()
+
+    def _run(self):
+        """后台线程：取出一个批次后顺带取走队列中已有的批次，合并为一次批量写入"""
+        while True:
+            batch = self._queue.get()
+            batches = [batch]
+            while batch is not None:
+                try:
+                    batch = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batches.append(batch)
+            episodes = [episode for batch in batches if batch is not None for episode in batch]
+            try:
+                if episodes:
+                    self._consolidate(episodes)
+            except Exception as e:
+                logger.error(f"Background consolidation of {len(episodes)} episodes failed: {e}")
+                import traceback
+                logger.error(f"Background consolidation traceback: {traceback.format_exc()}")
+            finally:
+                for _ in batches:
+                    self._queue.task_done()
+            if batches[-1] is None:
+                return
+
+    def _consolidate(self, episodes: List[Any]):
+        """批量摘要、向量化，再依次批量写入向量库、内容库和情景记忆日志"""
+        records = [episode.to_record() for episode in episodes]
+        summaries = self.summarizer([episode.data for episode in episodes])
+        for record, summary in zip(records, summaries):
+            record["content"] = summary
+
+        embeddings = self.embedding_model.embed_batch(summaries)
+        rows = self.vector_store.add_vectors(
+            [record["id"] for record in records], embeddings, records
+        )
+        for record, row in zip(records, rows):
+            record["embedding_row"] = row
+
+        self.content_store.put_many(records)
+        self.long_term.append_many(records)
+        logger.info(f"Consolidated {len(records)} episodes into long-term memory")
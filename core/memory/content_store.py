@@ -0,0 +1,239 @@
+"""
+记忆内容存储（SQLite）
+按记忆ID保存内容和元数据，向量库只保存向量，检索命中后用 get_many 一次取回整个 top-k 的内容
+向量本身不入库，embedding_row 为其在FAISS原始向量文件（定长 float32，可内存映射）中的行号
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import Config
+from utils.logging_config import get_logger
+from utils.helpers import SharedInstance
+logger = get_logger(__name__)
+
+_SQLITE_HEADER = b"SQLite format 3\x00"
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS memories (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    type TEXT,
+    content TEXT NOT NULL,
+    tags TEXT,
+    metadata TEXT,
+    score REAL,
+    storage_type TEXT,
+    timestamp TEXT,
+    embedding_row INTEGER,
+    access_count INTEGER NOT NULL DEFAULT 0,
+    last_accessed REAL
+)
+"""
+_ADDED_COLUMNS = {
+    "embedding_row": "INTEGER",
+    "access_count": "INTEGER NOT NULL DEFAULT 0",
+    "last_accessed": "REAL",
+}
+_CREATE_USER_INDEX = "CREATE INDEX IF NOT EXISTS idx_memories_user_time ON memories (user_id, timestamp)"
+
+# 语句保持不变，由 sqlite3 在每个连接上缓存为预编译语句
+# 已存在的记忆只更新内容列，access_count / last_accessed 保留（INSERT OR REPLACE 会删旧行并重置访问统计）
+_UPSERT = """
+INSERT INTO memories (id, user_id, type, content, tags, metadata, score, storage_type, timestamp, embedding_row)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET
+    user_id = excluded.user_id,
+    type = excluded.type,
+    content = excluded.content,
+    tags = excluded.tags,
+    metadata = excluded.metadata,
+    score = excluded.score,
+    storage_type = excluded.storage_type,
+    timestamp = excluded.timestamp,
+    embedding_row = excluded.embedding_row
+"""
+# ID列表以 JSON 数组作为单个参数传入，任意数量的ID共用同一条预编译语句
+_SELECT_MANY = """
+SELECT id, user_id, type, content, tags, metadata, score, storage_type, timestamp, embedding_row
+FROM memories WHERE id IN (SELECT value FROM json_each(?))
+"""
+# 检索命中时累加访问次数并记录访问时间（Unix 时间戳），供淘汰策略计算衰减分数
+_TOUCH_MANY = """
+UPDATE memories SET access_count = access_count + 1, last_accessed = ?
+WHERE id IN (SELECT value FROM json_each(?))
+"""
+_SELECT_ACCESS_STATS = """
+SELECT id, access_count, last_accessed FROM memories WHERE id IN (SELECT value FROM json_each(?))
+"""
+_DELETE_MANY = "DELETE FROM memories WHERE id IN (SELECT value FROM json_each(?))"
+_COUNT = "SELECT COUNT(*) FROM memories"
+
+# 进程内共享的内容存储实例
+_shared_store = SharedInstance(lambda: ContentStore())
+
+
+def get_content_store() -> "ContentStore":
+    """获取进程内共享的记忆内容存储"""
+    return _shared_store.get()
+
+
+class ContentStore:
+    def __init__(self, db_path: str = None):
+        """
+        初始化记忆内容存储
+        :param db_path: SQLite 数据库路径，默认 Config.DATABASE_PATH
+        """
+        self.db_path = db_path or Config.DATABASE_PATH
+        self._local = threading.local()  # 每个线程一个连接，WAL 模式下读写互不阻塞
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._prepare_database_file()
+        with self._connection() as conn:
+            conn.execute(_CREATE_TABLE)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(memories)")}
+            # 早期建的表没有向量行号和访问统计列
+            for column, definition in _ADDED_COLUMNS.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE memories ADD COLUMN {column} {definition}")
+            conn.execute(_CREATE_USER_INDEX)
+
+    def _prepare_database_file(self):
+        """确保目录存在；原有的非 SQLite 占位文件改名保留，不覆盖"""
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        if os.path.exists(self.db_path) and os.path.getsize(self.db_path) > 0:
+            with open(self.db_path, "rb") as f:
+                header = f.read(len(_SQLITE_HEADER))
+            if header != _SQLITE_HEADER:
+                backup_path = self.db_path + ".bak"
+                os.replace(self.db_path, backup_path)
+                logger.warning(f"{self.db_path} is not a SQLite database, moved it to {backup_path}")
+
+    def _connection(self) -> sqlite3.Connection:
+        """当前线程的连接，首次使用时创建并开启 WAL 模式"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @staticmethod
+    def _to_row(entry: Dict[str, Any]) -> tuple:
+        """记忆条目转换为表中的一行"""
+        return (
+            entry["id"],
+            entry.get("user_id"),
+            entry.get("type"),
+            entry.get("content", ""),
+            json.dumps(entry.get("tags", []), ensure_ascii=False),
+            json.dumps(entry.get("metadata", {}), ensure_ascii=False),
+            entry.get("score"),
+            entry.get("storage_type"),
+            entry.get("timestamp"),
+            entry.get("embedding_row"),
+        )
+
+    @staticmethod
+    def _from_row(row: tuple) -> Dict[str, Any]:
+        """表中的一行转换为记忆条目"""
+        return {
+            "id": row[0],
+            "user_id": row[1],
+            "type": row[2],
+            "content": row[3],
+            "tags": json.loads(row[4]) if row[4] else [],
+            "metadata": json.loads(row[5]) if row[5] else {},
+            "score": row[6],
+            "storage_type": row[7],
+            "timestamp": row[8],
+            "embedding_row": row[9],
+        }
+
+    def put_many(self, entries: List[Dict[str, Any]]) -> int:
+        """在一个事务中写入（或覆盖）多条记忆，返回写入条数"""
+        try:
+            with self._connection() as conn:
+                conn.executemany(_UPSERT, [self._to_row(entry) for entry in entries])
+            return len(entries)
+        except Exception as e:
+            logger.error(f"Failed to store memories in content store: {e}")
+            import traceback
+            logger.error(f"Content store write traceback: {traceback.format_exc()}")
+            return 0
+
+    def put(self, entry: Dict[str, Any]) -> bool:
+        """写入单条记忆"""
+        return self.put_many([entry]) == 1
+
+    def get_many(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """一次查询取回多条记忆，返回 {ID: 记忆}，不存在的ID不出现在结果中"""
+        if not ids:
+            return {}
+        try:
+            rows = self._connection().execute(_SELECT_MANY, (json.dumps(list(ids)),)).fetchall()
+            return {row[0]: self._from_row(row) for row in rows}
+        except Exception as e:
+            logger.error(f"Failed to fetch memories from content store: {e}")
+            import traceback
+            logger.error(f"Content store read traceback: {traceback.format_exc()}")
+            return {}
+
+    def get(self, memory_id: str) -> Optional[Dict[str, Any]]:
+        """按ID取回单条记忆"""
+        return self.get_many([memory_id]).get(memory_id)
+
+    def touch_many(self, ids: List[str], accessed_at: float = None) -> int:
+        """记录一次检索命中：访问次数加一并更新访问时间，返回更新条数"""
+        if not ids:
+            return 0
+        try:
+            with self._connection() as conn:
+                return conn.execute(
+                    _TOUCH_MANY, (accessed_at if accessed_at is not None else time.time(), json.dumps(list(ids)))
+                ).rowcount
+        except Exception as e:
+            logger.error(f"Failed to record memory access in content store: {e}")
+            return 0
+
+    def get_access_stats(self, ids: List[str]) -> Dict[str, Tuple[int, Optional[float]]]:
+        """一次查询取回多条记忆的访问统计，返回 {ID: (访问次数, 最近访问时间)}"""
+        if not ids:
+            return {}
+        try:
+            rows = self._connection().execute(_SELECT_ACCESS_STATS, (json.dumps(list(ids)),)).fetchall()
+            return {row[0]: (row[1], row[2]) for row in rows}
+        except Exception as e:
+            logger.error(f"Failed to fetch memory access stats from content store: {e}")
+            return {}
+
+    def delete_many(self, ids: List[str]) -> int:
+        """删除多条记忆，返回实际删除的条数"""
+        if not ids:
+            return 0
+        try:
+            with self._connection() as conn:
+                return conn.execute(_DELETE_MANY, (json.dumps(list(ids)),)).rowcount
+        except Exception as e:
+            logger.error(f"Failed to delete memories from content store: {e}")
+            return 0
+
+    def count(self) -> int:
+        """记忆总数"""
+        return self._connection().execute(_COUNT).fetchone()[0]
+
+    def close(self):
+        """关闭所有线程的连接"""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
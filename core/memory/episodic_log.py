@@ -0,0 +1,362 @@
+"""
+追加写的情景记忆日志（JSONL）
+每条记忆占一行，写入只追加不重写；旁边的偏移索引（.idx）按定长记录保存 <ID摘要, 偏移, 长度>，
+支持按ID随机读取。更新即追加新版本，删除即追加删除标记，旧版本由 compact() 清理
+"""
+import hashlib
+import itertools
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，跳过跨进程文件锁
+    fcntl = None
+
+from app.config import Config
+from utils.helpers import SharedInstance, chunk_list
+from utils.logging_config import get_logger
+logger = get_logger(__name__)
+
+# 偏移索引记录：ID的SHA1摘要（定长，不受ID长度限制）、行起始偏移、行长度（含换行符）
+_INDEX_DTYPE = np.dtype([("key", "S20"), ("offset", "<i8"), ("length", "<u4")])
+
+# 删除标记字段
+_DELETED = "_deleted"
+
+# 顺序扫描日志时每次转换为 Python 整数的偏移数
+_READ_CHUNK = 4096
+# 待合并的索引记录块达到该数量时合并一次（只追加不查找的进程也不会无限累积）
+_MAX_PENDING = 64
+
+# 进程内共享的日志实例
+_shared_log = SharedInstance(lambda: EpisodicLog())
+
+
+def get_episodic_log() -> "EpisodicLog":
+    """获取进程内共享的情景记忆日志"""
+    return _shared_log.get()
+
+
+def iter_memories(
+    batch_size: int = None,
+    fields: List[str] = None,
+    with_embeddings: bool = False
+) -> Iterator[Any]:
+    """遍历整个记忆库（共享日志实例），参数见 EpisodicLog.iter_memories"""
+    return get_episodic_log().iter_memories(batch_size, fields, with_embeddings)
+
+
+def _key(memory_id: str) -> bytes:
+    """记忆ID的定长摘要"""
+    return hashlib.sha1(memory_id.encode("utf-8")).digest()
+
+
+class EpisodicLog:
+    def __init__(self, path: str = None):
+        """
+        初始化情景记忆日志
+        :param path: 日志路径，偏移索引为 path + ".idx"
+        """
+        self.path = path or Config.EPISODIC_LOG_PATH
+        self.index_path = self.path + ".idx"
+        self._lock = threading.Lock()
+        # 每个ID最新版本的位置：按摘要排序的三个并列数组，按 searchsorted 查找（每个ID 32 字节）
+        self._keys = np.empty(0, dtype="S20")
+        self._offsets = np.empty(0, dtype="<i8")
+        self._lengths = np.empty(0, dtype="<u4")
+        self._pending = []  # 已读入但尚未并入上面数组的索引记录块，查找前由 _resolve() 合并
+        self._indexed = 0  # 已读入的索引记录数
+        self._inode = None  # 日志文件的 inode，compact() 替换文件后需要重新加载索引
+        log_dir = os.path.dirname(self.path)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        with self._file_lock():
+            self._recover()
+
+    @contextmanager
+    def _file_lock(self):
+        """跨进程的写锁，多个进程追加同一日志时不会交错或覆盖"""
+        with open(self.path + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _recover(self):
+        """
+        把崩溃时已写入日志但未写入索引的行补进索引，截掉写了一半的尾行（调用方需持有文件锁）
+        索引与日志不一致（如 compact 中途崩溃）时按日志重建索引
+        """
+        log_size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        index = self._read_index(0)
+        if len(index) and index[-1]["offset"] + index[-1]["length"] > log_size:
+            logger.warning(f"Offset index {self.index_path} is ahead of {self.path}, rebuilding it")
+            index = index[:0]
+        indexed_end = int(index[-1]["offset"] + index[-1]["length"]) if len(index) else 0
+        with open(self.index_path, "r+b" if os.path.exists(self.index_path) else "wb") as f:
+            f.truncate(len(index) * _INDEX_DTYPE.itemsize)
+        if log_size <= indexed_end:
+            return
+
+        records = []
+        good_end = indexed_end
+        with open(self.path, "rb") as f:
+            f.seek(indexed_end)
+            for line in f:
+                try:
+                    memory_id = json.loads(line)["id"] if line.endswith(b"\n") else None
+                except (ValueError, KeyError, TypeError):
+                    memory_id = None
+                if memory_id is None:
+                    break
+                records.append((_key(memory_id), good_end, len(line)))
+                good_end += len(line)
+        if good_end < log_size:
+            logger.warning(f"Truncating torn episodic log record in {self.path} at offset {good_end}")
+            with open(self.path, "r+b") as f:
+                f.truncate(good_end)
+        if records:
+            with open(self.index_path, "ab") as f:
+                f.write(np.array(records, dtype=_INDEX_DTYPE).tobytes())
+            logger.info(f"Recovered {len(records)} episodic log records into {self.index_path}")
+
+    def _read_index(self, start: int) -> np.ndarray:
+        """从第 start 条开始读取索引记录，忽略不完整的尾部记录"""
+        if not os.path.exists(self.index_path):
+            return np.empty(0, dtype=_INDEX_DTYPE)
+        with open(self.index_path, "rb") as f:
+            f.seek(start * _INDEX_DTYPE.itemsize)
+            raw = f.read()
+        usable = len(raw) - len(raw) % _INDEX_DTYPE.itemsize
+        return np.frombuffer(raw[:usable], dtype=_INDEX_DTYPE)
+
+    def _reset_positions(self):
+        """清空内存中的位置索引"""
+        self._keys = np.empty(0, dtype="S20")
+        self._offsets = np.empty(0, dtype="<i8")
+        self._lengths = np.empty(0, dtype="<u4")
+        self._pending = []
+        self._indexed = 0
+
+    def _refresh(self):
+        """读入其他进程追加的索引记录；日志被 compact() 替换后整体重新加载（调用方需持有 _lock）"""
+        inode = os.stat(self.path).st_ino if os.path.exists(self.path) else None
+        if inode != self._inode:
+            self._reset_positions()
+            self._inode = inode
+        records = self._read_index(self._indexed)
+        if len(records):
+            self._pending.append(records)
+            self._indexed += len(records)
+        if len(self._pending) >= _MAX_PENDING:
+            self._resolve()
+
+    def _resolve(self):
+        """
+        把待合并的索引记录并入按摘要排序的位置数组（调用方需持有 _lock）
+        新记录中每个摘要取最后一次出现；已有的摘要原地更新位置，新摘要按排序位置插入
+        """
+        if not self._pending:
+            return
+        records = np.concatenate(self._pending)[::-1]
+        self._pending = []
+        keys, last = np.unique(records["key"], return_index=True)
+        offsets = records["offset"][last]
+        lengths = records["length"][last]
+
+        positions = np.searchsorted(self._keys, keys)
+        found = positions < len(self._keys)
+        found[found] = self._keys[positions[found]] == keys[found]
+        self._offsets[positions[found]] = offsets[found]
+        self._lengths[positions[found]] = lengths[found]
+        added = ~found
+        if added.any():
+            self._keys = np.insert(self._keys, positions[added], keys[added])
+            self._offsets = np.insert(self._offsets, positions[added], offsets[added])
+            self._lengths = np.insert(self._lengths, positions[added], lengths[added])
+
+    def _latest_offsets(self) -> np.ndarray:
+        """所有ID最新版本的起始偏移，升序（调用方需持有 _lock）"""
+        self._refresh()
+        self._resolve()
+        return np.sort(self._offsets)
+
+    def append_many(self, entries: List[Dict[str, Any]]) -> int:
+        """追加多条记忆（同一ID再次追加即为更新），返回写入条数"""
+        lines = [json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n" for entry in entries]
+        if not lines:
+            return 0
+        with self._lock, self._file_lock():
+            self._refresh()
+            with open(self.path, "ab") as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(b"".join(lines))
+            records = np.empty(len(lines), dtype=_INDEX_DTYPE)
+            records["key"] = [_key(entry["id"]) for entry in entries]
+            records["length"] = [len(line) for line in lines]
+            records["offset"] = offset + np.concatenate(([0], np.cumsum(records["length"][:-1], dtype="int64")))
+            with open(self.index_path, "ab") as f:
+                f.write(records.tobytes())
+            self._refresh()
+        return len(lines)
+
+    def append(self, entry: Dict[str, Any]) -> bool:
+        """追加单条记忆"""
+        return self.append_many([entry]) == 1
+
+    def delete_many(self, ids: List[str]) -> int:
+        """追加删除标记，返回被删除的已有记忆数"""
+        existing = list(self.get_many(ids))
+        self.append_many([{"id": memory_id, _DELETED: True} for memory_id in existing])
+        return len(existing)
+
+    def get_many(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """按ID随机读取最新版本，返回 {ID: 记忆}，不存在或已删除的ID不出现在结果中"""
+        ids = list(ids)
+        keys = np.array([_key(memory_id) for memory_id in ids], dtype="S20")
+        with self._lock:
+            self._refresh()
+            self._resolve()
+            positions = np.minimum(np.searchsorted(self._keys, keys), max(len(self._keys) - 1, 0))
+            found = self._keys[positions] == keys if len(self._keys) else np.zeros(len(ids), dtype=bool)
+            offsets = self._offsets[positions[found]].tolist()
+            lengths = self._lengths[positions[found]].tolist()
+        located = zip([memory_id for memory_id, hit in zip(ids, found.tolist()) if hit], offsets, lengths)
+        results = {}
+        if not os.path.exists(self.path):
+            return results
+        with open(self.path, "rb") as f:
+            for memory_id, offset, length in located:
+                entry = json.loads(os.pread(f.fileno(), length, offset))
+                if entry.get("id") == memory_id and not entry.get(_DELETED):
+                    results[memory_id] = entry
+        return results
+
+    def get(self, memory_id: str) -> Optional[Dict[str, Any]]:
+        """按ID读取单条记忆"""
+        return self.get_many([memory_id]).get(memory_id)
+
+    def iter_entries(self) -> Iterator[Dict[str, Any]]:
+        """按写入顺序逐行读取每个ID的最新版本，跳过旧版本和已删除的记忆"""
+        with self._lock:
+            latest = self._latest_offsets()
+        yield from self._read_entries(latest)
+
+    def iter_memories(
+        self,
+        batch_size: int = None,
+        fields: List[str] = None,
+        with_embeddings: bool = False
+    ) -> Iterator[Any]:
+        """
+        流式遍历整个记忆库，逐行读取和解析，内存占用与记忆总数无关（偏移索引除外）
+        :param batch_size: 为空时逐条生成记忆；否则按固定大小分批生成列表
+        :param fields: 只保留这些字段（字段投影），为空时保留全部字段
+        :param with_embeddings: 按 embedding_row 从FAISS原始向量文件逐批读取向量，放入 "embedding" 字段（float32 数组）
+        """
+        memories = self.iter_entries()
+        if fields is not None:
+            keep = set(fields) | ({"embedding_row"} if with_embeddings else set())
+            memories = ({key: value for key, value in memory.items() if key in keep} for memory in memories)
+        batches = chunk_list(memories, batch_size or 1)
+        if with_embeddings:
+            batches = map(self._attach_embeddings, batches)
+        if batch_size:
+            yield from batches
+        else:
+            for batch in batches:
+                yield from batch
+
+    @staticmethod
+    def _attach_embeddings(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """一批记忆的向量一次读出；没有 embedding_row 的记忆 embedding 为 None"""
+        from .faiss_vector_store import get_vector_store
+
+        rows = [memory.get("embedding_row") for memory in batch]
+        present = [i for i, row in enumerate(rows) if row is not None]
+        vectors = get_vector_store().read_rows([rows[i] for i in present]) if present else []
+        for memory in batch:
+            memory["embedding"] = None
+        for i, vector in zip(present, vectors):
+            batch[i]["embedding"] = vector
+        return batch
+
+    def _read_entries(self, latest: np.ndarray) -> Iterator[Dict[str, Any]]:
+        """顺序扫描日志，只解析起始偏移在 latest（升序数组）中的行，跳过旧版本和已删除的记忆"""
+        if not os.path.exists(self.path):
+            return
+        # 升序偏移分块转换为 Python 整数，扫描时与当前行偏移逐个比对
+        targets = itertools.chain.from_iterable(
+            latest[start:start + _READ_CHUNK].tolist() for start in range(0, len(latest), _READ_CHUNK)
+        )
+        target = next(targets, None)
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                if target is None:
+                    break
+                if offset == target:
+                    entry = json.loads(line)
+                    if not entry.get(_DELETED):
+                        yield entry
+                    target = next(targets, None)
+                offset += len(line)
+
+    def compact(self) -> int:
+        """
+        重写日志，只保留每个ID的最新版本并去掉删除标记，返回保留的记忆数
+        先写临时文件再原子替换；替换前删除旧索引，中途崩溃时由 _recover 按新日志重建
+        """
+        with self._lock, self._file_lock():
+            latest = self._latest_offsets()
+            tmp_path = self.path + ".compact"
+            records = []
+            offset = 0
+            with open(tmp_path, "wb") as dst:
+                for entry in self._read_entries(latest):
+                    line = json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n"
+                    dst.write(line)
+                    records.append((_key(entry["id"]), offset, len(line)))
+                    offset += len(line)
+                dst.flush()
+                os.fsync(dst.fileno())
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            os.replace(tmp_path, self.path)
+            with open(self.index_path, "wb") as f:
+                f.write(np.array(records, dtype=_INDEX_DTYPE).tobytes())
+            self._refresh()
+        logger.info(f"Compacted episodic log {self.path} to {len(records)} records")
+        return len(records)
+
+    def import_legacy_json(
+        self,
+        legacy_path: str,
+        prepare: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]] = None
+    ) -> int:
+        """
+        把旧版 {"memories": [...]} 格式的 episodic_memory.json 导入日志，已存在的ID跳过，返回导入条数
+        :param prepare: 写入前对待导入记忆的批量处理（如把内嵌的 embedding 列表移到向量文件）
+        """
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            memories = [memory for memory in json.load(f).get("memories", []) if memory.get("id")]
+        existing = self.get_many([memory["id"] for memory in memories])
+        imported = [memory for memory in memories if memory["id"] not in existing]
+        if prepare is not None and imported:
+            imported = prepare(imported)
+        return self.append_many(imported)
+
+    def close(self):
+        """释放内存中的索引"""
+        with self._lock:
+            self._reset_positions()
+            self._inode = None
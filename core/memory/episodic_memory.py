@@ -1,20 +1,147 @@
 # 短期/长期记忆结构
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
 from datetime import datetime
+from itertools import islice, takewhile
+import json
+import threading
+import time
+import uuid
+
+from app.config import Config
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+class Episode:
+    """短期记忆中的一条情景，使用 __slots__ 不为每条记录创建 __dict__"""
+    __slots__ = ("id", "timestamp", "data")
+
+    def __init__(self, data: Dict[str, Any], timestamp: float = None, episode_id: str = None):
+        self.id = episode_id or str(uuid.uuid4())
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.data = data
+
+    def to_record(self) -> Dict[str, Any]:
+        """转换为长期存储（情景记忆日志）的记录格式"""
+        return {
+            "id": self.id,
+            "user_id": self.data.get("user_id"),  # 同时作为向量元数据的归属，没有时为共享记录
+            "type": "episode",
+            "content": json.dumps(self.data, ensure_ascii=False, default=str),
+            "metadata": self.data,
+            "timestamp": datetime.fromtimestamp(self.timestamp).isoformat(),
+            "storage_type": "episodic"
+        }
+
+class EpisodeRingBuffer:
+    """定长环形缓冲区，容量在创建时确定，写满后由调用方先整合最旧的记录"""
+    __slots__ = ("_slots", "_head", "_size")
+
+    def __init__(self, capacity: int):
+        self._slots: List[Optional[Episode]] = [None] * max(1, capacity)
+        self._head = 0  # 最旧记录的位置
+        self._size = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self._slots)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[Episode]:
+        """从旧到新遍历"""
+        for i in range(self._size):
+            yield self._slots[(self._head + i) % len(self._slots)]
+
+    def is_full(self) -> bool:
+        return self._size == len(self._slots)
+
+    def oldest(self) -> Optional[Episode]:
+        return self._slots[self._head] if self._size else None
+
+    def append(self, episode: Episode) -> Optional[Episode]:
+        """追加一条记录；缓冲区已满时覆盖并返回最旧的记录"""
+        evicted = None
+        if self._size == len(self._slots):
+            evicted = self._slots[self._head]
+            self._head = (self._head + 1) % len(self._slots)
+            self._size -= 1
+        self._slots[(self._head + self._size) % len(self._slots)] = episode
+        self._size += 1
+        return evicted
+
+    def pop_oldest(self, n: int) -> List[Episode]:
+        """移除并返回最旧的 n 条记录"""
+        n = min(n, self._size)
+        popped = []
+        for _ in range(n):
+            popped.append(self._slots[self._head])
+            self._slots[self._head] = None
+            self._head = (self._head + 1) % len(self._slots)
+        self._size -= n
+        return popped
 
 class EpisodicMemory:
-    def __init__(self):
-        self.short_term = []
-        self.long_term = []
-    
+    def __init__(
+        self,
+        capacity: int = None,
+        batch_size: int = None,
+        max_age: float = None,
+        worker=None
+    ):
+        """
+        :param capacity: 短期记忆容量（环形缓冲区大小）
+        :param batch_size: 每次整合转移到长期记忆的最少条数
+        :param max_age: 短期记忆的最长保留时间（秒），超龄的记录在下次整合时一并转移
+        :param worker: 后台整合线程（ConsolidationWorker），默认使用进程内共享的线程
+        """
+        self.short_term = EpisodeRingBuffer(capacity or Config.SHORT_TERM_CAPACITY)
+        self.batch_size = max(1, batch_size or Config.CONSOLIDATION_BATCH_SIZE)
+        self.max_age = max_age if max_age is not None else Config.SHORT_TERM_MAX_AGE
+        self._worker = worker
+        self._lock = threading.Lock()
+
+    @property
+    def worker(self):
+        """后台整合线程，首次整合时才创建"""
+        if self._worker is None:
+            from .consolidation_worker import get_consolidation_worker
+            self._worker = get_consolidation_worker()
+        return self._worker
+
     def add_episode(self, episode: Dict[str, Any]):
-        # 添加到短期记忆
-        self.short_term.append(episode)
-        
-        # 如果短期记忆过长，转移到长期记忆
-        if len(self.short_term) > 100:
-            self._consolidate_memory()
-    
+        with self._lock:
+            # 短期记忆已满或最旧的记录已超龄时，把一批记录交给后台线程整合
+            oldest = self.short_term.oldest()
+            if self.short_term.is_full() or (oldest is not None and oldest.timestamp < time.time() - self.max_age):
+                self._consolidate_memory()
+
+            # 添加到短期记忆（后台队列持续已满时覆盖最旧的记录，内存占用始终有界）
+            evicted = self.short_term.append(Episode(episode))
+        if evicted is not None:
+            logger.warning(f"Short-term memory full, dropped episode {evicted.id} without consolidation")
+
     def _consolidate_memory(self):
-        # 记忆整合逻辑
-        pass 
\ No newline at end of file
+        """
+        把超龄的记录和（缓冲区已满时）最旧的一批记录提交给后台整合线程（调用方需持有 _lock）
+        只做入队，摘要、向量化和落盘都不在调用方线程中执行
+        """
+        cutoff = time.time() - self.max_age
+        aged = sum(1 for _ in takewhile(lambda e: e.timestamp < cutoff, self.short_term))
+        count = max(aged, self.batch_size if self.short_term.is_full() else 0)
+        if not count:
+            return
+        batch = list(islice(self.short_term, count))
+        # 入队成功后才从短期记忆中移除，队列已满时留待下次重试
+        if self.worker.submit(batch):
+            self.short_term.pop_oldest(len(batch))
+
+    def flush(self):
+        """把短期记忆中的全部记录交给后台线程，并等待落盘完成（如进程退出前）"""
+        with self._lock:
+            batch = list(self.short_term)
+            if batch and self.worker.submit(batch):
+                self.short_term.pop_oldest(len(batch))
+        if self._worker is not None:
+            self._worker.flush()
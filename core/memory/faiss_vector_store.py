@@ -3,10 +3,24 @@ FAISS向量数据库实现
 """
 import faiss
 import numpy as np
+import glob
 import json
 import os
+import re
+import shutil
+import socket
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from multiprocessing.connection import Client, Connection
 from typing import List, Dict, Any
 
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，跳过跨进程的写入锁和快照锁
+    fcntl = None
+
 # 延迟导入配置，避免循环导入
 try:
     from config.vector_db_config import FAISSConfig
@@ -17,25 +31,332 @@ except ImportError as e:
         INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "data/faiss_index")
         DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", "768"))
         SEARCH_TOP_K = int(os.getenv("FAISS_SEARCH_TOP_K", "5"))
+        WAL_MAX_BYTES = int(os.getenv("FAISS_WAL_MAX_BYTES", str(64 * 1024 * 1024)))
+        SNAPSHOT_INTERVAL = float(os.getenv("FAISS_SNAPSHOT_INTERVAL", "300"))
+        WAL_FSYNC = os.getenv("FAISS_WAL_FSYNC", "false").lower() == "true"
+        UPGRADE_INDEX_TYPE = os.getenv("FAISS_UPGRADE_INDEX_TYPE", "ivf").lower()
+        UPGRADE_THRESHOLD = int(os.getenv("FAISS_UPGRADE_THRESHOLD", "50000"))
+        IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", "0"))
+        NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+        HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+        HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200"))
+        EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+        COMPACTION_THRESHOLD = float(os.getenv("FAISS_COMPACTION_THRESHOLD", "0.2"))
+        COMPACTION_MIN_TOMBSTONES = int(os.getenv("FAISS_COMPACTION_MIN_TOMBSTONES", "100"))
+        LOAD_MODE = os.getenv("FAISS_LOAD_MODE", "memory").lower()
+        METRIC = os.getenv("FAISS_METRIC", "l2").lower()
+        PQ_M = int(os.getenv("FAISS_PQ_M", "64"))
+        PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", "8"))
+        RERANK_FACTOR = int(os.getenv("FAISS_RERANK_FACTOR", "4"))
+        SNAPSHOT_KEEP_GENERATIONS = int(os.getenv("FAISS_SNAPSHOT_KEEP_GENERATIONS", "3"))
+        SNAPSHOT_CRC_MAX_BYTES = int(os.getenv("FAISS_SNAPSHOT_CRC_MAX_BYTES", str(64 * 1024 * 1024)))
+        HOT_RELOAD = os.getenv("FAISS_HOT_RELOAD", "true").lower() == "true"
+        NUM_SHARDS = int(os.getenv("FAISS_NUM_SHARDS", "1"))
 
+from utils.helpers import ReadWriteLock, SharedInstance
+from .id_map import IdMap
+from .label_metadata import LabelMetadata
+from .vector_file import VectorFile
+from .write_ahead_log import WriteAheadLog
 from utils.logging_config import get_logger
 logger = get_logger(__name__)
 
+# 有损压缩的索引类型，检索结果需要用原始向量重排
+COMPRESSED_INDEX_TYPES = ("sq8", "pq", "ivfpq")
+
+# 构建索引时每次从向量文件读入内存的行数
+_BUILD_BLOCK_ROWS = 65536
+
+# 快照代目录名，写入中的代带 .tmp 后缀，校验失败隔离的代带 .corrupt 后缀
+_GENERATION_PATTERN = re.compile(r"gen-(\d{8})")
+
+
+def _file_checksum(path: str) -> Dict[str, int]:
+    """计算文件大小和 CRC32，用于快照清单"""
+    checksum = 0
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            checksum = zlib.crc32(chunk, checksum)
+            size += len(chunk)
+    return {"size": size, "crc32": checksum}
+
+
+def _fsync_dir(path: str):
+    """把目录项（新建/改名）刷到磁盘"""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# 进程内共享的向量库实例
+_shared_store = SharedInstance(lambda: FAISSVectorStore())
+
+
+def get_vector_store() -> "FAISSVectorStore":
+    """
+    获取进程内共享的FAISS向量库
+    索引只在首次调用时从磁盘加载一次，之后所有检索和写入复用同一实例
+    """
+    return _shared_store.get()
+
+
+def _detach_shared_store_after_fork():
+    """
+    fork 出的子进程（如 gunicorn --preload 的 worker）丢弃继承来的共享实例，首次使用时重新打开：
+    继承的写入锁文件描述符与父进程共用同一把锁，子进程不能据此认为自己是写入进程
+    """
+    store = _shared_store.reset()
+    if store is not None:
+        store._detach_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_detach_shared_store_after_fork)
+
+
 class FAISSVectorStore:
-    def __init__(self, index_path: str = None, dimension: int = None):
+    def __init__(
+        self,
+        index_path: str = None,
+        dimension: int = None,
+        load_mode: str = None,
+        metric: str = None,
+        num_shards: int = None,
+        read_only: bool = False
+    ):
         """
         初始化FAISS向量数据库
+        同一索引只允许一个写入进程：打开时尝试获取 index_path + ".lock" 的独占锁并持有到 close()，
+        锁已被其他进程持有时以只读方式打开，只加载已提交的快照代并热加载新代，不回放和追加日志，不写向量文件和快照；
+        只读进程的写入（add_vectors/remove/get_rows）经 index_path + ".sock" 转发给写入进程执行，
+        写入进程不可达时抛出 RuntimeError；转发的写入在写入进程提交下一代快照后才能被本进程检索到
         :param index_path: 索引文件路径
         :param dimension: 向量维度
+        :param load_mode: "memory" 读入私有内存；"mmap" 只读内存映射，多进程共享页缓存
+                          （适合只读进程；写入进程回放日志或首次写入时会把索引拷贝到私有内存）
+        :param metric: "l2" 欧氏距离；"cosine" 写入时归一化并用内积检索；"ip" 原始内积
+        :param num_shards: 分片数，大于1时各分片并行检索后合并结果
+        :param read_only: 为 True 时不争夺写入锁，始终只读打开（如检索副本进程）
         """
         self.index_path = index_path or FAISSConfig.INDEX_PATH
         self.dimension = dimension or FAISSConfig.DIMENSION
+        self.load_mode = (load_mode or FAISSConfig.LOAD_MODE).lower()
+        self.metric = (metric or FAISSConfig.METRIC).lower()
+        self.num_shards = max(1, num_shards or FAISSConfig.NUM_SHARDS)
         self.index = None
-        self.id_map = {}  # ID映射表
+        self.id_map = IdMap()  # int64标签 <-> 外部ID
+        self.metadata = LabelMetadata()  # int64标签 -> 用户/类型/时间，用于过滤检索
+        self.vector_file = None  # 原始向量文件，按标签寻址，用于重建索引和压缩索引的精确重排
+        self._mapped_files = []  # mmap模式下已映射快照（每个分片一个）的文件句柄，首次写入时用于读入私有内存
+        self._lock = ReadWriteLock()  # 检索并发读，写入独占
+        self._write_mutex = threading.Lock()  # 写入之间以及写入与快照之间串行，快照期间检索不受影响
+        self.read_only = read_only  # 只读打开（其他进程是写入进程）
+        self._writer_lock_file = None  # 写入进程持有独占锁的文件句柄
+        self._write_server = None  # 写入进程接收只读进程转发写入的 Unix 套接字
+        self._write_server_thread = None
+        self._forwarded_sockets = set()  # 写入进程中已连接的只读进程
+        self._writer_conn = None  # 只读进程到写入进程的连接
+        self._forward_lock = threading.Lock()
+        
+        # 分级索引：当前索引类型与可调的检索参数
+        self.index_type = "flat"
+        self.nprobe = FAISSConfig.NPROBE
+        self.ef_search = FAISSConfig.EF_SEARCH
+        self._rebuild_thread = None  # 升级/压缩共用的后台重建线程
+        
+        # 删除标记：按标签记录已删除的向量，检索时立即跳过，后台压缩时真正从索引中移除
+        self._deleted = np.zeros(0, dtype=bool)
+        self._tombstones_in_index = 0  # 仍留在索引中的已删除向量数
+        
+        # 预写日志与快照状态
+        self._lsn = 0  # 最近一次已应用的日志序号
+        self._snapshot_lsn = 0  # 最近一次快照覆盖到的日志序号
+        self._last_snapshot_time = time.time()
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._wal = None
+        self._force_snapshot = False
+        
+        # 快照按代写入独立目录，目录原子改名即提交；加载时选择最新的一致代
+        self.snapshot_dir = self.index_path + ".snapshots"
+        self._generation = 0  # 当前内存状态对应（或最近写入）的快照代
+        
+        if not self.read_only:
+            self._acquire_writer_lock()
         self._load_or_create_index()
+        self._maybe_rebuild_index()
+        
+        # 后台快照线程
+        self._snapshot_thread = threading.Thread(
+            target=self._snapshot_loop, name="faiss-snapshotter", daemon=True
+        )
+        self._snapshot_thread.start()
+        if not self.read_only:
+            self._start_write_server()
+    
+    def _acquire_writer_lock(self):
+        """
+        获取索引的独占写入锁（非阻塞），进程生命周期内持有
+        各进程的日志序号、ID映射标签和向量文件行号互相独立，两个进程写同一索引会互相覆盖，
+        因此锁被占用时转为只读，写入转发给持有锁的进程
+        """
+        if fcntl is None:
+            return
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        lock_file = open(self.index_path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            self.read_only = True
+            logger.warning(f"FAISS index {self.index_path} is locked by another writer process, opening read-only")
+            return
+        self._writer_lock_file = lock_file
+    
+    def _start_write_server(self):
+        """写入进程监听 index_path + ".sock"，执行只读进程转发的写入（没有 fcntl 的平台上每个进程都是写入进程，不监听）"""
+        if fcntl is None:
+            return
+        path = self.index_path + ".sock"
+        try:
+            # 已持有写入锁，残留的套接字文件来自已退出的写入进程
+            if os.path.exists(path):
+                os.remove(path)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(path)
+            os.chmod(path, 0o600)
+            server.listen()
+        except OSError as e:
+            logger.error(f"Failed to listen on {path}, writes from read-only processes will be refused: {e}")
+            return
+        self._write_server = server
+        self._write_server_thread = threading.Thread(
+            target=self._serve_forwarded_writes, name="faiss-write-server", daemon=True
+        )
+        self._write_server_thread.start()
+    
+    def _serve_forwarded_writes(self):
+        """接受只读进程的连接，每个连接一个线程"""
+        while not self._stop_event.is_set():
+            try:
+                sock, _ = self._write_server.accept()
+            except OSError:
+                break
+            self._forwarded_sockets.add(sock)
+            threading.Thread(
+                target=self._handle_forwarded_writes, args=(sock,), name="faiss-write-forward", daemon=True
+            ).start()
+    
+    def _handle_forwarded_writes(self, sock: socket.socket):
+        """依次执行一个只读进程转发的请求 (op, args)，回复 ("ok", 结果) 或 ("error", 错误信息)"""
+        conn = Connection(os.dup(sock.fileno()))
+        handlers = {"add": self.add_vectors, "remove": self.remove, "get_rows": self.get_rows}
+        try:
+            while True:
+                try:
+                    op, args = conn.recv()
+                except (EOFError, OSError):
+                    break
+                try:
+                    if self._stop_event.is_set():
+                        raise RuntimeError("writer process is shutting down")
+                    reply = ("ok", handlers[op](*args))
+                except Exception as e:
+                    logger.error(f"Forwarded FAISS {op} failed: {e}")
+                    reply = ("error", f"{type(e).__name__}: {e}")
+                conn.send(reply)
+        finally:
+            conn.close()
+            self._forwarded_sockets.discard(sock)
+            sock.close()
+    
+    def _stop_write_server(self):
+        """停止接收转发的写入，断开已连接的只读进程（它们之后的写入会抛出异常）"""
+        if self._write_server is None:
+            return
+        for sock in [self._write_server] + list(self._forwarded_sockets):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._write_server.close()
+        self._write_server_thread.join()
+        self._write_server = None
+        path = self.index_path + ".sock"
+        if os.path.exists(path):
+            os.remove(path)
+    
+    def _forward(self, op: str, *args):
+        """
+        只读进程把写入转发给写入进程执行并返回其结果
+        复用的连接在发送时断开（写入进程已重启）会重连一次；请求发出后连接断开时不重发，避免重复写入
+        :raises RuntimeError: 写入进程不可达或执行失败
+        """
+        with self._forward_lock:
+            for attempt in range(2):
+                reused = self._writer_conn is not None
+                try:
+                    if not reused:
+                        self._writer_conn = Client(self.index_path + ".sock", family="AF_UNIX")
+                    self._writer_conn.send((op, args))
+                except OSError as e:
+                    self._close_writer_conn()
+                    if reused and attempt == 0:
+                        continue
+                    raise RuntimeError(
+                        f"FAISS index {self.index_path} is open read-only and the writer process is unreachable: {e}"
+                    ) from e
+                try:
+                    status, result = self._writer_conn.recv()
+                except (EOFError, OSError) as e:
+                    self._close_writer_conn()
+                    raise RuntimeError(f"Lost connection to the FAISS writer process during {op}: {e}") from e
+                if status != "ok":
+                    raise RuntimeError(f"FAISS writer process failed to {op}: {result}")
+                return result
+    
+    def _close_writer_conn(self):
+        """关闭只读进程到写入进程的连接"""
+        if self._writer_conn is not None:
+            self._writer_conn.close()
+            self._writer_conn = None
+    
+    def _detach_after_fork(self):
+        """
+        fork 后在子进程中放弃继承来的实例：只关闭继承的文件描述符（不解锁、不删除套接字文件，它们仍属于父进程），
+        并标记为已停止，子进程退出时不会写快照
+        """
+        self._stop_event.set()
+        if self._writer_lock_file is not None:
+            self._writer_lock_file.close()
+            self._writer_lock_file = None
+        for sock in [self._write_server] + list(self._forwarded_sockets):
+            if sock is not None:
+                sock.close()
+        self._write_server = None
+        self._forwarded_sockets = set()
+        self._writer_conn = None  # 与父进程共用的连接，子进程不能再收发
+        self._forward_lock = threading.Lock()
+    
+    def _release_writer_lock(self):
+        """释放写入锁"""
+        if self._writer_lock_file is not None:
+            fcntl.flock(self._writer_lock_file.fileno(), fcntl.LOCK_UN)
+            self._writer_lock_file.close()
+            self._writer_lock_file = None
     
     def _load_or_create_index(self):
-        """加载或创建索引"""
+        """加载最新的一致快照代；写入进程随后回放预写日志，只读进程只使用已提交的快照"""
         try:
             # 确保索引目录存在
             index_dir = os.path.dirname(self.index_path)
@@ -43,87 +364,942 @@ class FAISSVectorStore:
                 os.makedirs(index_dir, exist_ok=True)
                 logger.info(f"Created directory for FAISS index: {index_dir}")
             
-            if os.path.exists(self.index_path) and os.path.exists(self.index_path + ".ids"):
-                # 加载现有索引
-                self.index = faiss.read_index(self.index_path)
-                with open(self.index_path + ".ids", "r") as f:
-                    self.id_map = json.load(f)
-                logger.info(f"Loaded FAISS index from {self.index_path}")
+            # 从最新一代开始逐代校验，损坏的代隔离后回退到上一代，之后的写入由归档日志补回
+            state = None
+            for generation in self._list_generations():
+                try:
+                    state = self._read_generation(generation)
+                    break
+                except Exception as e:
+                    logger.error(f"FAISS snapshot generation {generation} is inconsistent, "
+                                 f"falling back to the previous generation: {e}")
+                    if not self.read_only:
+                        self._quarantine_generation(generation)
+                        self._force_snapshot = True
+            if state is None:
+                state = self._read_legacy_snapshot()
+            
+            if state is not None:
+                self._install_snapshot(state)
+                logger.info(f"Loaded FAISS index generation {self._generation} from {self.index_path} "
+                            f"(mode: {self.load_mode})")
             else:
+                if self._force_snapshot:
+                    logger.error(f"No consistent FAISS snapshot found for {self.index_path}, "
+                                 f"rebuilding from the write-ahead log only")
                 # 创建新索引
-                self.index = faiss.IndexFlatL2(self.dimension)
-                self.id_map = {}
+                self.index = self._new_index()
+                self.id_map = IdMap()
+                self.metadata = LabelMetadata()
                 logger.info("Created new FAISS index")
         except Exception as e:
             logger.error(f"Failed to load or create FAISS index: {e}")
             import traceback
             logger.error(f"FAISS index loading/creation traceback: {traceback.format_exc()}")
             # 创建新索引
-            self.index = faiss.IndexFlatL2(self.dimension)
-            self.id_map = {}
+            for mapped_file in self._mapped_files:
+                mapped_file.close()
+            self._mapped_files = []
+            self.index = self._new_index()
+            self.id_map = IdMap()
+            self.metadata = LabelMetadata()
+            self._deleted = np.zeros(0, dtype=bool)
+            self._lsn = 0
+        
+        self.vector_file = VectorFile(self.index_path + ".vectors", self.dimension, read_only=self.read_only)
+        self._snapshot_lsn = self._lsn
+        if self.read_only:
+            return
+        self._backfill_vector_file()
+        self._wal = WriteAheadLog(self.index_path + ".wal", fsync=FAISSConfig.WAL_FSYNC)
+        self._replay_wal()
+    
+    def _generation_dir(self, generation: int) -> str:
+        """快照代目录"""
+        return os.path.join(self.snapshot_dir, f"gen-{generation:08d}")
+    
+    def _list_generations(self) -> List[int]:
+        """已提交（目录已原子改名）的快照代号，从新到旧"""
+        if not os.path.isdir(self.snapshot_dir):
+            return []
+        generations = [
+            int(match.group(1)) for match in map(_GENERATION_PATTERN.fullmatch, os.listdir(self.snapshot_dir))
+            if match
+        ]
+        return sorted(generations, reverse=True)
     
-    def add_vectors(self, ids: List[str], vectors: List[List[float]]):
-        """添加向量到索引"""
+    def _next_generation(self) -> int:
+        """分配新的代号，跳过已提交、写了一半和已隔离的代（调用方需持有快照文件锁）"""
+        used = [self._generation]
+        if os.path.isdir(self.snapshot_dir):
+            used += [
+                int(match.group(1)) for match in map(_GENERATION_PATTERN.match, os.listdir(self.snapshot_dir))
+                if match
+            ]
+        return max(used) + 1
+    
+    def _quarantine_generation(self, generation: int):
+        """把校验失败的代改名隔离，保留现场且不再参与加载和清理"""
+        generation_dir = self._generation_dir(generation)
+        try:
+            os.replace(generation_dir, generation_dir + ".corrupt")
+        except OSError as e:
+            logger.error(f"Failed to quarantine FAISS snapshot generation {generation}: {e}")
+    
+    def _read_generation(self, generation: int) -> Dict[str, Any]:
+        """
+        读取一代快照，文件大小或校验和与清单不符时抛出异常
+        所有文件校验大小，不超过 SNAPSHOT_CRC_MAX_BYTES 的文件再校验 CRC32，大索引文件不必每次加载都完整读一遍
+        """
+        generation_dir = self._generation_dir(generation)
+        with open(os.path.join(generation_dir, "MANIFEST"), "r") as f:
+            manifest = json.load(f)
+        for name, expected in manifest["files"].items():
+            path = os.path.join(generation_dir, name)
+            size = os.path.getsize(path)
+            if size != expected["size"]:
+                raise ValueError(f"size mismatch for {path}: {size} != {expected['size']}")
+            if size <= FAISSConfig.SNAPSHOT_CRC_MAX_BYTES and _file_checksum(path) != expected:
+                raise ValueError(f"checksum mismatch for {path}")
+        return self._read_snapshot(
+            self._index_files(os.path.join(generation_dir, "index"), manifest["shards"]),
+            os.path.join(generation_dir, "ids.npy"),
+            os.path.join(generation_dir, "labels.npy"),
+            os.path.join(generation_dir, "labels.json"),
+            os.path.join(generation_dir, "deleted.npy"),
+            manifest
+        )
+    
+    def _read_legacy_snapshot(self):
+        """读取引入快照代之前直接写在 index_path 旁边的快照，不存在时返回 None"""
+        meta = {}
+        if os.path.exists(self.index_path + ".meta"):
+            with open(self.index_path + ".meta", "r") as f:
+                meta = json.load(f)
+        index_files = self._index_files(self.index_path, meta.get("shards", 1))
+        ids_path = self.index_path + ".ids.npy"
+        if not os.path.exists(ids_path):
+            ids_path = self.index_path + ".ids"  # 更早的 JSON 映射
+        if not all(os.path.exists(path) for path in index_files) or not os.path.exists(ids_path):
+            return None
+        return self._read_snapshot(
+            index_files, ids_path, self.index_path + ".labels.npy", self.index_path + ".labels.json",
+            self.index_path + ".deleted.npy", meta
+        )
+    
+    def _read_snapshot(
+        self,
+        index_files: List[str],
+        ids_path: str,
+        labels_path: str,
+        vocab_path: str,
+        deleted_path: str,
+        meta: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """读取快照文件，返回尚未生效的状态，由 _install_snapshot 切换"""
+        mmap = self.load_mode == "mmap"
+        index, mapped_files = self._read_index_files(index_files)
         try:
-            # 转换向量格式
-            vectors_np = np.array(vectors).astype('float32')
+            if ids_path.endswith(".npy"):
+                id_map = IdMap.load(ids_path, mmap=mmap)
+            else:
+                id_map = IdMap.load_legacy_json(ids_path)
+            metadata = LabelMetadata()
+            if os.path.exists(labels_path):
+                metadata = LabelMetadata.load(labels_path, vocab_path, mmap=mmap)
+            # 早期快照没有元数据，补齐为无归属记录
+            metadata.extend([None] * (len(id_map) - len(metadata)))
+            deleted = np.load(deleted_path) if os.path.exists(deleted_path) else np.zeros(0, dtype=bool)
+        except Exception:
+            for mapped_file in mapped_files:
+                mapped_file.close()
+            raise
+        return {
+            "index": index,
+            "mapped_files": mapped_files,
+            "id_map": id_map,
+            "metadata": metadata,
+            "deleted": deleted,
+            "lsn": meta.get("lsn", 0),
+            "metric": meta.get("metric", "l2"),  # 早期快照没有记录度量，均为L2
+            "generation": meta.get("generation", 0),
+        }
+    
+    def _install_snapshot(self, state: Dict[str, Any]):
+        """切换到读取好的快照状态（重新加载时调用方需持有写锁）"""
+        self.index = state["index"]
+        self._mapped_files = state["mapped_files"]
+        self.id_map = state["id_map"]
+        self.metadata = state["metadata"]
+        self._deleted = state["deleted"]
+        self._grow_deleted(len(self.id_map))
+        self._lsn = self._snapshot_lsn = state["lsn"]
+        self._generation = state["generation"]
+        if state["metric"] != self.metric:
+            # 已有向量按快照的度量写入，沿用快照的度量以保证结果一致
+            logger.warning(f"FAISS index at {self.index_path} uses metric '{state['metric']}', "
+                           f"ignoring configured metric '{self.metric}'")
+            self.metric = state["metric"]
+        if not isinstance(faiss.downcast_index(self.index), (faiss.IndexIDMap2, faiss.IndexShards)):
+            self._migrate_positional_index()
+        self.index_type = self._detect_index_type(self.index)
+        if not self._mapped_files:
+            self._ensure_direct_map()
+        self._tombstones_in_index = int(np.count_nonzero(self._deleted[self._index_labels()]))
+        if len(self._sub_indexes()) != self.num_shards:
+            # 分片数与配置不同时先按快照的布局加载，随后由后台重建重新分片
+            logger.info(f"FAISS index at {self.index_path} has {len(self._sub_indexes())} shards, "
+                        f"resharding to {self.num_shards} in background")
+    
+    def reload(self) -> bool:
+        """
+        只读进程热加载写入进程提交的更新快照代（如 mmap 只读副本跟随写入进程），无需重启或重建索引
+        写入进程不热加载：它的内存状态总是不旧于磁盘上的任何一代
+        :return: 是否切换到了新的快照代
+        """
+        if not self.read_only:
+            return False
+        for generation in self._list_generations():
+            if generation <= self._generation:
+                break
+            try:
+                state = self._read_generation(generation)
+            except Exception as e:
+                logger.warning(f"Skipping inconsistent FAISS snapshot generation {generation}: {e}")
+                continue
+            with self._lock.write_lock():
+                stale_files = self._mapped_files
+                self._install_snapshot(state)
+            for mapped_file in stale_files:
+                mapped_file.close()
+            logger.info(f"Reloaded FAISS index generation {generation} from {self.snapshot_dir}")
+            return True
+        return False
+    
+    def _backfill_vector_file(self):
+        """早期快照没有原始向量文件时，从（无损的）索引中取回向量补齐"""
+        missing_from = self.vector_file.rows
+        if missing_from >= len(self.id_map) or self.index_type in COMPRESSED_INDEX_TYPES:
+            return
+        try:
+            for sub in self._sub_indexes():
+                labels = faiss.vector_to_array(sub.id_map)
+                labels = np.sort(labels[labels >= missing_from])
+                if len(labels):
+                    self.vector_file.write(labels, sub.reconstruct_batch(labels))
+                    logger.info(f"Backfilled {len(labels)} raw vectors into {self.vector_file.path}")
+        except Exception as e:
+            logger.error(f"Failed to backfill FAISS raw vector file: {e}")
+    
+    def _replay_wal(self):
+        """回放快照之后写入的日志记录"""
+        replayed = 0
+        try:
+            for header, payload in self._wal.replay():
+                if header["lsn"] <= self._lsn:
+                    continue
+                # 无效记录（如维度不符）记录错误后跳过，不影响之后的记录
+                try:
+                    if header["op"] == "add":
+                        vectors_np = np.frombuffer(payload, dtype='float32')
+                        if len(vectors_np) != len(header["ids"]) * self.dimension:
+                            raise ValueError(f"{len(vectors_np)} floats for {len(header['ids'])} ids "
+                                             f"of dimension {self.dimension}")
+                        self._apply_add(header["ids"], vectors_np.reshape(-1, self.dimension), header.get("metadatas"))
+                    elif header["op"] == "remove":
+                        self._apply_remove(np.array(header["labels"], dtype='int64'))
+                    replayed += 1
+                except Exception as e:
+                    logger.error(f"Skipping invalid FAISS WAL record {header['lsn']}: {e}")
+                self._lsn = header["lsn"]
+        except Exception as e:
+            logger.error(f"Failed to replay FAISS WAL: {e}")
+            import traceback
+            logger.error(f"FAISS WAL replay traceback: {traceback.format_exc()}")
+        if replayed:
+            logger.info(f"Replayed {replayed} WAL records into FAISS index")
+    
+    @staticmethod
+    def _wrap_index(index):
+        """用 IndexIDMap2 包装底层索引，向量以 int64 标签寻址"""
+        return faiss.IndexIDMap2(index)
+    
+    @staticmethod
+    def _index_files(base: str, num_shards: int) -> List[str]:
+        """快照中索引文件的路径：单分片为 base，多分片时每个分片一个文件"""
+        if num_shards == 1:
+            return [base]
+        return [f"{base}.shard{i}" for i in range(num_shards)]
+    
+    def _read_index_files(self, paths: List[str]):
+        """
+        读取快照中的索引文件，返回 (索引, 文件句柄列表)；mmap模式下只读映射并保留文件句柄
+        IO_FLAG_MMAP_IFC 让 Flat/HNSW/SQ/IVF 的编码直接引用映射的页（多进程共享页缓存）；
+        IO_FLAG_MMAP 仍会把编码拷贝到私有内存
+        """
+        mapped_files = []
+        if self.load_mode == "mmap":
+            mapped_files = [open(path, "rb") for path in paths]
+            shards = [faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC) for path in paths]
+        else:
+            shards = [faiss.read_index(path) for path in paths]
+        return self._combine_shards(shards), mapped_files
+    
+    def _combine_shards(self, shards: list):
+        """
+        多个子索引组合为 IndexShards：检索时每个分片在独立线程中执行，再按距离合并 top-k
+        子索引各自用 IndexIDMap2 维护标签，合并结果直接是全局标签
+        """
+        if len(shards) == 1:
+            return shards[0]
+        index = faiss.IndexShards(self.dimension, True, False)
+        for shard in shards:
+            index.add_shard(shard)
+        return index
+    
+    def _sub_indexes(self, index=None) -> list:
+        """返回索引的各个分片（未分片时只有索引本身）"""
+        index = faiss.downcast_index(self.index if index is None else index)
+        if isinstance(index, faiss.IndexShards):
+            return [faiss.downcast_index(index.at(i)) for i in range(index.count())]
+        return [index]
+    
+    def _index_labels(self, index=None) -> np.ndarray:
+        """索引中所有向量的标签"""
+        return np.concatenate([faiss.vector_to_array(sub.id_map) for sub in self._sub_indexes(index)])
+    
+    def _index_add(self, index, vectors_np: np.ndarray, labels: np.ndarray):
+        """按 标签 % 分片数 把向量写入对应分片，标签连续分配，各分片数量保持均衡"""
+        shards = self._sub_indexes(index)
+        if len(shards) == 1:
+            shards[0].add_with_ids(vectors_np, labels)
+            return
+        shard_of = labels % len(shards)
+        for i, shard in enumerate(shards):
+            selected = shard_of == i
+            if selected.any():
+                shard.add_with_ids(np.ascontiguousarray(vectors_np[selected]), labels[selected])
+        index.syncWithSubIndexes()
+    
+    def _new_index(self):
+        """创建空的暴力检索索引"""
+        empty = np.empty((0, self.dimension), dtype='float32')
+        return self._build_index("flat", empty, np.empty(0, dtype='int64'))
+    
+    @property
+    def _faiss_metric(self) -> int:
+        """当前度量对应的FAISS度量类型"""
+        if self.metric in ("cosine", "ip"):
+            return faiss.METRIC_INNER_PRODUCT
+        return faiss.METRIC_L2
+    
+    def _prepare_vectors(self, vectors, rows: int = None) -> np.ndarray:
+        """
+        转换为连续的 float32 矩阵；余弦模式下拷贝后归一化，不修改调用方的数据
+        :param rows: 期望的行数，为空时不限；形状不是 (rows, dimension) 时抛出 ValueError
+        """
+        vectors_np = np.atleast_2d(np.ascontiguousarray(vectors, dtype='float32'))
+        expected = (vectors_np.shape[0] if rows is None else rows, self.dimension)
+        if vectors_np.shape != expected:
+            raise ValueError(f"Expected vectors of shape {expected}, got {vectors_np.shape}")
+        if self.metric == "cosine":
+            vectors_np = vectors_np.copy()
+            faiss.normalize_L2(vectors_np)
+        return vectors_np
+    
+    def _migrate_positional_index(self):
+        """把旧版按位置编号的索引迁移为 IndexIDMap2，位置即标签"""
+        self._ensure_writable()
+        legacy = faiss.downcast_index(self.index)
+        if isinstance(legacy, faiss.IndexIVF):
+            legacy.make_direct_map()
+        vectors_np = legacy.reconstruct_n(0, legacy.ntotal)
+        self.index = self._build_index(
+            self._detect_index_type(legacy), vectors_np, np.arange(legacy.ntotal, dtype='int64')
+        )
+        self._force_snapshot = True
+        logger.info(f"Migrated positional FAISS index ({legacy.ntotal} vectors) to IndexIDMap2")
+    
+    def _ensure_direct_map(self):
+        """IVF索引需要直接映射才能按标签取回向量（压缩时使用）"""
+        for sub in self._sub_indexes():
+            inner = faiss.downcast_index(sub.index)
+            if isinstance(inner, faiss.IndexIVF) and inner.direct_map.type == faiss.DirectMap.NoMap:
+                inner.make_direct_map()
+    
+    @staticmethod
+    def _detect_index_type(index) -> str:
+        """识别索引类型"""
+        index = faiss.downcast_index(index)
+        if isinstance(index, faiss.IndexShards):
+            index = faiss.downcast_index(index.at(0))
+        if isinstance(index, faiss.IndexIDMap2):
+            index = faiss.downcast_index(index.index)
+        if isinstance(index, faiss.IndexHNSW):
+            return "hnsw"
+        if isinstance(index, faiss.IndexIVFPQ):
+            return "pq" if index.nlist == 1 else "ivfpq"
+        if isinstance(index, faiss.IndexIVF):
+            return "ivf"
+        if isinstance(index, faiss.IndexScalarQuantizer):
+            return "sq8"
+        return "flat"
+    
+    def _build_index(self, index_type: str, vectors_np: np.ndarray, labels: np.ndarray):
+        """
+        按类型构建、训练并填充新索引（不持有锁，耗时操作在后台线程中执行）
+        :param vectors_np: 按标签寻址的向量矩阵（第 i 行为标签 i 的向量），可以是原始向量文件的内存映射
+        :param labels: 要写入新索引的标签；训练只读取抽样的行，写入按块读取，不会把全部向量读入内存
+        """
+        metric = self._faiss_metric
+        if index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(self.dimension, FAISSConfig.HNSW_M, metric)
+            index.hnsw.efConstruction = FAISSConfig.HNSW_EF_CONSTRUCTION
+        elif index_type == "sq8":
+            # 每维压缩为 1 字节，约为原始大小的 1/4
+            index = faiss.IndexScalarQuantizer(self.dimension, faiss.ScalarQuantizer.QT_8bit, metric)
+            index.train(self._training_sample(vectors_np, labels, 1))
+        elif index_type in ("ivf", "ivfpq", "pq"):
+            if index_type == "pq":
+                # 单个聚类的 IVF-PQ 等价于 IndexPQ，且支持按ID过滤（IndexPQ 不支持）
+                nlist = 1
+            else:
+                nlist = FAISSConfig.IVF_NLIST or int(4 * np.sqrt(len(labels)))
+                nlist = max(1, min(nlist, len(labels) // 39))
+            quantizer = faiss.IndexFlat(self.dimension, metric)
+            if index_type == "ivf":
+                index = faiss.IndexIVFFlat(quantizer, self.dimension, nlist, metric)
+            else:
+                index = faiss.IndexIVFPQ(
+                    quantizer, self.dimension, nlist, self._pq_m(), FAISSConfig.PQ_NBITS, metric
+                )
+            index.train(self._training_sample(vectors_np, labels, max(nlist, 1 << FAISSConfig.PQ_NBITS)))
+            # 维护直接映射，压缩时可按标签取回向量
+            index.make_direct_map()
+        else:
+            index = faiss.IndexFlat(self.dimension, metric)
+        # 训练好的空索引按分片数复制，各分片共享同一组聚类中心/量化参数
+        template = self._wrap_index(index)
+        index = self._combine_shards(
+            [template] + [faiss.clone_index(template) for _ in range(self.num_shards - 1)]
+        )
+        for start in range(0, len(labels), _BUILD_BLOCK_ROWS):
+            block = labels[start:start + _BUILD_BLOCK_ROWS]
+            self._index_add(index, np.ascontiguousarray(vectors_np[block], dtype='float32'), block)
+        return index
+    
+    @staticmethod
+    def _training_sample(vectors_np: np.ndarray, labels: np.ndarray, centroids: int) -> np.ndarray:
+        """从 labels 中抽样最多 256*聚类数 行作为训练样本，训练耗时和内存与总量无关（按行号顺序读取映射的文件）"""
+        sample_size = min(len(labels), 256 * centroids)
+        sample = np.sort(np.random.choice(labels, sample_size, replace=False))
+        return np.ascontiguousarray(vectors_np[sample], dtype='float32')
+    
+    def _pq_m(self) -> int:
+        """PQ子空间数，需整除向量维度，取不超过配置值的最大约数"""
+        m = max(1, min(FAISSConfig.PQ_M, self.dimension))
+        while self.dimension % m:
+            m -= 1
+        return m
+    
+    def _maybe_rebuild_index(self):
+        """
+        按需在后台重建索引：
+        1. 向量数超过阈值时把暴力检索索引升级为 IVF/HNSW 或压缩索引（SQ8/PQ/IVF-PQ）
+        2. 删除标记占比超过阈值时按当前类型压缩索引
+        3. 快照的分片数与配置不同时按当前类型重新分片
+        """
+        if self._mapped_files or self.read_only:
+            return
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return
+        target = FAISSConfig.UPGRADE_INDEX_TYPE
+        if (target in COMPRESSED_INDEX_TYPES + ("ivf", "hnsw") and self.index_type == "flat"
+                and self.index.ntotal - self._tombstones_in_index >= FAISSConfig.UPGRADE_THRESHOLD):
+            index_type = target
+        elif (self._tombstones_in_index >= FAISSConfig.COMPACTION_MIN_TOMBSTONES
+                and self._tombstones_in_index >= FAISSConfig.COMPACTION_THRESHOLD * self.index.ntotal):
+            index_type = self.index_type
+        elif len(self._sub_indexes()) != self.num_shards:
+            index_type = self.index_type
+        else:
+            return
+        self._rebuild_thread = threading.Thread(
+            target=self._rebuild_index, args=(index_type,), name="faiss-index-rebuild", daemon=True
+        )
+        self._rebuild_thread.start()
+    
+    def _rebuild_index(self, index_type: str):
+        """
+        用未删除的向量训练并切换到新索引（升级和压缩共用）
+        构建期间只在读锁内拷贝向量，检索和写入照常进行；切换时在写锁内补齐期间新增的向量
+        新索引沿用原有的 int64 标签，ID映射和元数据无需改动
+        """
+        try:
+            with self._lock.read_lock():
+                base_next = self.id_map.next_label
+                labels = self._index_labels()
+                live = np.sort(labels[~self._deleted[labels]])
+            
+            # 直接使用原始向量文件的内存映射（抽样训练、按块写入），压缩索引重建时不会累积量化误差
+            logger.info(f"Rebuilding FAISS index as {index_type} with {len(live)} live vectors "
+                        f"({len(labels) - len(live)} tombstones dropped)")
+            new_index = self._build_index(index_type, self.vector_file.matrix(), live)
             
-            # 添加到索引
-            start_id = self.index.ntotal
-            self.index.add(vectors_np)
+            with self._write_section():
+                labels = self._index_labels()
+                fresh = labels[(labels >= base_next) & ~self._deleted[labels]]
+                if len(fresh):
+                    self._index_add(new_index, self.vector_file.read(fresh), fresh)
+                self.index = new_index
+                self.index_type = index_type
+                # 构建期间被删除的向量仍在新索引中，继续由删除标记过滤
+                self._tombstones_in_index = int(np.count_nonzero(self._deleted[self._index_labels()]))
+                self._force_snapshot = True
+            
+            self._snapshot_event.set()
+            logger.info(f"Switched FAISS index to {index_type} ({new_index.ntotal} vectors)")
+        except Exception as e:
+            logger.error(f"Failed to rebuild FAISS index: {e}")
+            import traceback
+            logger.error(f"FAISS index rebuild traceback: {traceback.format_exc()}")
+    
+    def set_search_params(self, nprobe: int = None, ef_search: int = None):
+        """调整检索参数，在召回率和延迟之间权衡"""
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+    
+    def _search_params(self, selector=None):
+        """按当前索引类型生成检索参数，selector 为可选的 ID 过滤器"""
+        if self.index_type in ("ivf", "ivfpq", "pq"):
+            return faiss.SearchParametersIVF(nprobe=self.nprobe, sel=selector)
+        if self.index_type == "hnsw":
+            return faiss.SearchParametersHNSW(efSearch=self.ef_search, sel=selector)
+        if selector is not None:
+            return faiss.SearchParameters(sel=selector)
+        return None
+    
+    def _filter_selector(self, filters: Dict[str, Any]):
+        """
+        根据过滤条件和删除标记生成 IDSelectorBitmap（调用方需持有读锁）
+        位图按标签编号，FAISS在检索内部跳过不满足条件或已删除的向量
+        返回 (selector, bitmap)，bitmap 需在检索期间保持引用
+        """
+        if filters:
+            mask = self.metadata.mask(filters)
+        else:
+            mask = np.ones(len(self.id_map), dtype=bool)
+        if self._tombstones_in_index:
+            mask &= ~self._deleted[:len(mask)]
+        bitmap = np.packbits(mask, bitorder='little')
+        return faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap)), bitmap
+    
+    @contextmanager
+    def _write_section(self):
+        """
+        修改内存索引的临界区：先取写入互斥锁（快照写文件期间等待），再取写锁（等待进行中的检索）
+        快照只持有写入互斥锁，等待快照的写入还没有排队申请写锁，因此不会挡住新的检索
+        """
+        with self._write_mutex, self._lock.write_lock():
+            yield
+    
+    def _ensure_writable(self):
+        """
+        mmap模式下首次写入时，把映射的只读索引读入私有内存（调用方需持有写锁）
+        通过加载时打开的文件句柄读取，即使快照文件已被新版本替换也能读到同一份数据
+        """
+        if not self._mapped_files:
+            return
+        shards = []
+        for mapped_file in self._mapped_files:
+            mapped_file.seek(0)
+            shards.append(faiss.read_index(faiss.PyCallbackIOReader(mapped_file.read)))
+            mapped_file.close()
+        self._mapped_files = []
+        self.index = self._combine_shards(shards)
+        if isinstance(faiss.downcast_index(self.index), (faiss.IndexIDMap2, faiss.IndexShards)):
+            self._ensure_direct_map()
+        logger.info("Copied memory-mapped FAISS index into private memory for writing")
+    
+    def _apply_add(self, ids: List[str], vectors_np: np.ndarray, metadatas: List[Dict[str, Any]] = None) -> np.ndarray:
+        """把向量写入内存索引并更新ID映射和元数据（调用方需持有写锁），返回分配的标签"""
+        self._ensure_writable()
+        labels = self.id_map.extend(ids)
+        self.metadata.extend(metadatas or [None] * len(ids))
+        self._grow_deleted(len(self.id_map))
+        self.vector_file.write(labels, vectors_np)
+        self._index_add(self.index, vectors_np, labels)
+        return labels
+    
+    def _grow_deleted(self, size: int):
+        """删除标记数组扩容到至少 size 个标签"""
+        if len(self._deleted) < size:
+            grown = np.zeros(max(size, 2 * len(self._deleted), 1024), dtype=bool)
+            grown[:len(self._deleted)] = self._deleted
+            self._deleted = grown
+    
+    def _apply_remove(self, labels: np.ndarray) -> int:
+        """标记删除（调用方需持有写锁），返回新删除的向量数"""
+        labels = labels[~self._deleted[labels]]
+        self._deleted[labels] = True
+        self._tombstones_in_index += len(labels)
+        return len(labels)
+    
+    def remove(self, ids: List[str]) -> int:
+        """
+        删除向量：写入删除标记后检索立即跳过，删除标记占比超过阈值时后台压缩索引
+        :param ids: 要删除的外部ID
+        :return: 实际删除的向量数
+        """
+        if self.read_only:
+            return self._forward("remove", list(ids))
+        try:
+            # 反查标签只需读锁，不阻塞检索；标签一经分配不会改变
+            with self._lock.read_lock():
+                labels = self.id_map.find(ids)
+            with self._write_section():
+                labels = labels[~self._deleted[labels]]
+                if not len(labels):
+                    return 0
+                self._lsn += 1
+                self._wal.append({"lsn": self._lsn, "op": "remove", "labels": labels.tolist()})
+                removed = self._apply_remove(labels)
             
-            # 更新ID映射
-            for i, id in enumerate(ids):
-                self.id_map[str(start_id + i)] = id
+            self._maybe_rebuild_index()
+            logger.info(f"Removed {removed} vectors from FAISS index")
+            return removed
+        except Exception as e:
+            logger.error(f"Failed to remove vectors from FAISS index: {e}")
+            import traceback
+            logger.error(f"FAISS vector removal traceback: {traceback.format_exc()}")
+            return 0
+    
+    def add_vectors(
+        self,
+        ids: List[str],
+        vectors: List[List[float]],
+        metadatas: List[Dict[str, Any]] = None
+    ) -> List[int]:
+        """
+        添加向量到索引：先追加预写日志，再更新内存索引，快照由后台线程完成
+        :param metadatas: 与 ids 一一对应的元数据（user_id、type、timestamp），用于过滤检索
+        :return: 与 ids 一一对应的标签，即向量在原始向量文件中的行号；失败时为空列表
+        :raises ValueError: 向量形状不是 (len(ids), dimension) 或元数据条数不符，此时不写入日志和索引
+        :raises RuntimeError: 只读打开且无法转发给写入进程
+        """
+        ids = list(ids)
+        if not ids:
+            return []
+        # 写日志前校验并转换向量格式（余弦模式下在写入时一次性归一化），无效的写入不会进入日志
+        vectors_np = self._prepare_vectors(vectors, rows=len(ids))
+        if metadatas is not None and len(metadatas) != len(ids):
+            raise ValueError(f"Expected {len(ids)} metadatas, got {len(metadatas)}")
+        if metadatas is not None:
+            metadatas = [
+                {key: (metadata or {}).get(key) for key in ("user_id", "type", "timestamp")}
+                for metadata in metadatas
+            ]
+        if self.read_only:
+            return self._forward("add", ids, vectors_np, metadatas)
+        try:
+            with self._write_section():
+                self._lsn += 1
+                self._wal.append(
+                    {"lsn": self._lsn, "op": "add", "ids": ids, "metadatas": metadatas},
+                    vectors_np.tobytes()
+                )
+                labels = self._apply_add(ids, vectors_np, metadatas)
             
-            # 保存索引
-            self._save_index()
+            self._maybe_rebuild_index()
+            if self._wal.size >= FAISSConfig.WAL_MAX_BYTES:
+                self._snapshot_event.set()
             logger.info(f"Added {len(ids)} vectors to FAISS index")
+            return labels.tolist()
         except Exception as e:
             logger.error(f"Failed to add vectors to FAISS index: {e}")
             import traceback
             logger.error(f"FAISS vector addition traceback: {traceback.format_exc()}")
+            return []
+    
+    def get_rows(self, ids: List[str]) -> Dict[str, int]:
+        """
+        外部ID -> 原始向量文件中的行号（即标签），记忆记录中只保存行号而不保存向量本身
+        不存在或已删除的ID不出现在结果中，同一ID写入多次时取最新的一行
+        用于写入前查重，只读进程向写入进程查询（包括尚未进入快照的写入）
+        """
+        if self.read_only:
+            return self._forward("get_rows", list(ids))
+        with self._lock.read_lock():
+            labels = self.id_map.find(ids)
+            labels = labels[~self._deleted[labels]]
+            found = self.id_map.lookup(labels)
+        return dict(zip(found, labels.tolist()))
+    
+    def read_rows(self, rows) -> np.ndarray:
+        """按行号读取原始向量，返回 (len(rows), dimension) 的 float32 矩阵（余弦模式下为归一化后的向量）"""
+        return self.vector_file.read(rows)
     
-    def search(self, query_vector: List[float], k: int = 5) -> List[Dict[str, Any]]:
+    def embedding_matrix(self) -> np.ndarray:
+        """整个原始向量文件的只读内存映射视图，第 i 行即行号 i 的向量，可零拷贝批量计算"""
+        return self.vector_file.matrix()
+    
+    def search(
+        self,
+        query_vector: List[float],
+        k: int = 5,
+        filters: Dict[str, Any] = None
+    ) -> List[Dict[str, Any]]:
         """搜索相似向量"""
+        results = self.search_batch([query_vector], k, filters)
+        return results[0] if results else []
+    
+    def search_batch(
+        self,
+        query_matrix,
+        k: int = 5,
+        filters: Dict[str, Any] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        批量搜索相似向量，所有查询在一次FAISS调用中完成
+        :param query_matrix: (n, d) 的查询矩阵，float32 的 numpy 数组可零拷贝传入
+        :param k: 每个查询返回的结果数
+        :param filters: 可选过滤条件 user_id / type / start_time / end_time，在FAISS检索内部生效
+        :return: 按查询顺序排列的结果列表
+        :raises ValueError: 查询向量维度与索引不符
+        """
+        # 转换查询矩阵格式
+        query_np = self._prepare_vectors(query_matrix)
         try:
-            # 转换查询向量格式
-            query_np = np.array([query_vector]).astype('float32')
-            
             # 执行搜索
-            distances, indices = self.index.search(query_np, k)
+            with self._lock.read_lock():
+                if filters or self._tombstones_in_index:
+                    selector, bitmap = self._filter_selector(filters)
+                else:
+                    selector, bitmap = None, None
+                # 压缩索引先多召回候选，再用原始向量重排
+                rerank = self.index_type in COMPRESSED_INDEX_TYPES and FAISSConfig.RERANK_FACTOR > 1
+                fetch_k = k * FAISSConfig.RERANK_FACTOR if rerank else k
+                distances, labels = self.index.search(query_np, fetch_k, params=self._search_params(selector))
+                if rerank:
+                    distances, labels = self._rerank(query_np, labels, k)
+                # FAISS返回-1表示没有找到更多结果，对应 None
+                original_ids = self.id_map.lookup(labels.ravel())
             
             # 构建结果
             results = []
-            for i in range(len(indices[0])):
-                idx = indices[0][i]
-                if idx != -1:  # FAISS返回-1表示没有找到更多结果
-                    original_id = self.id_map.get(str(idx), str(idx))
-                    results.append({
-                        "id": original_id,
-                        "distance": float(distances[0][i])
-                    })
+            for row in range(len(query_np)):
+                row_results = []
+                for col in range(labels.shape[1]):
+                    original_id = original_ids[row * labels.shape[1] + col]
+                    if original_id is not None:
+                        row_results.append(self._format_hit(original_id, float(distances[row, col])))
+                results.append(row_results)
             
             return results
         except Exception as e:
             logger.error(f"Failed to search FAISS index: {e}")
             return []
     
+    def _rerank(self, query_np: np.ndarray, labels: np.ndarray, k: int):
+        """用原始向量重新计算候选的精确距离，返回前 k 个 (distances, labels)"""
+        valid = labels >= 0
+        candidates = self.vector_file.read(np.where(valid, labels, 0).ravel())
+        candidates = candidates.reshape(labels.shape[0], labels.shape[1], self.dimension)
+        if self._faiss_metric == faiss.METRIC_INNER_PRODUCT:
+            exact = np.einsum('nkd,nd->nk', candidates, query_np)
+            order_key = -exact
+        else:
+            exact = ((candidates - query_np[:, None, :]) ** 2).sum(axis=2)
+            order_key = exact.copy()
+        order_key[~valid] = np.inf
+        top = np.argsort(order_key, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(exact, top, axis=1), np.take_along_axis(labels, top, axis=1)
+    
+    def _format_hit(self, original_id: str, value: float) -> Dict[str, Any]:
+        """
+        构建单条检索结果，distance 始终越小越相似
+        内积/余弦模式额外返回相似度 score（余弦模式下即余弦相似度）
+        """
+        if self.metric == "cosine":
+            return {"id": original_id, "distance": 1.0 - value, "score": value}
+        if self.metric == "ip":
+            return {"id": original_id, "distance": -value, "score": value}
+        return {"id": original_id, "distance": value}
+    
+    def _needs_snapshot(self) -> bool:
+        """判断是否达到快照触发条件（日志大小或时间间隔），只读进程从不写快照"""
+        if self.read_only:
+            return False
+        if self._force_snapshot:
+            return True
+        if self._lsn == self._snapshot_lsn:
+            return False
+        return (self._wal.size >= FAISSConfig.WAL_MAX_BYTES
+                or time.time() - self._last_snapshot_time >= FAISSConfig.SNAPSHOT_INTERVAL)
+    
+    def _snapshot_loop(self):
+        """后台快照线程：写入进程按日志大小或时间间隔写全量快照，只读进程热加载写入进程提交的新快照"""
+        poll_interval = max(0.1, min(FAISSConfig.SNAPSHOT_INTERVAL, 5.0))
+        while not self._stop_event.is_set():
+            self._snapshot_event.wait(timeout=poll_interval)
+            self._snapshot_event.clear()
+            if self._stop_event.is_set():
+                break
+            if self.read_only:
+                if FAISSConfig.HOT_RELOAD:
+                    self.reload()
+            elif self._needs_snapshot():
+                self._save_index()
+    
     def _save_index(self):
-        """保存索引到磁盘"""
+        """
+        保存全量快照到磁盘，每次写入新的一代
+        持有写入互斥锁期间用 faiss.write_index 把各分片直接写入临时代目录并轮转日志：
+        写入等待快照完成，检索只需读锁，不受影响；索引不经过内存缓冲，快照不额外占用一份索引大小的内存
+        fsync、校验和及其余文件在锁外完成，最后写入带校验和的清单，目录原子改名即提交
+        提交后已轮转的日志归档到该代名下，回退到上一代时用于补回之后的写入
+        """
+        if self.read_only:
+            return
+        with self._snapshot_lock:
+            if self._lsn == self._snapshot_lsn and not self._force_snapshot:
+                return
+            tmp_dir = None
+            try:
+                os.makedirs(self.snapshot_dir, exist_ok=True)
+                with self._snapshot_file_lock():
+                    generation = self._next_generation()
+                    tmp_dir = self._generation_dir(generation) + ".tmp"
+                    os.makedirs(tmp_dir)
+                    
+                    with self._write_mutex:
+                        self._force_snapshot = False
+                        # IndexShards 本身不能序列化，逐个分片写文件
+                        sub_indexes = self._sub_indexes()
+                        index_names = self._index_files("index", len(sub_indexes))
+                        for name, sub in zip(index_names, sub_indexes):
+                            faiss.write_index(sub, os.path.join(tmp_dir, name))
+                        id_array = self.id_map.to_array()
+                        metadata_rows = self.metadata.to_array()
+                        metadata_vocab = self.metadata.vocab()
+                        deleted = self._deleted[:len(id_array)].copy()
+                        lsn = self._lsn
+                        self._wal.rotate()
+                    
+                    # 原始向量文件先落盘，快照之前写入的向量不再依赖日志回放
+                    self.vector_file.flush()
+                    
+                    files = {name: self._sync_file(os.path.join(tmp_dir, name)) for name in index_names}
+                    contents = {
+                        "ids.npy": id_array,  # 二进制定长数组，可内存映射
+                        "deleted.npy": deleted,
+                        "labels.npy": metadata_rows,
+                        "labels.json": json.dumps(metadata_vocab, ensure_ascii=False).encode("utf-8"),
+                    }
+                    for name, content in contents.items():
+                        files[name] = self._write_file(os.path.join(tmp_dir, name), content)
+                    self._commit_generation(generation, tmp_dir, files, {
+                        "lsn": lsn, "metric": self.metric, "shards": len(index_names), "created_at": time.time()
+                    })
+                    tmp_dir = None
+                    self._wal.archive(generation)
+                    self._prune_generations()
+                
+                self._generation = generation
+                self._remove_legacy_snapshot()
+                self._snapshot_lsn = lsn
+                self._last_snapshot_time = time.time()
+                logger.info(f"Saved FAISS index generation {generation} to {self.snapshot_dir}")
+            except Exception as e:
+                logger.error(f"Failed to save FAISS index: {e}")
+                import traceback
+                logger.error(f"FAISS index saving traceback: {traceback.format_exc()}")
+                if tmp_dir is not None:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+    
+    @contextmanager
+    def _snapshot_file_lock(self):
+        """快照目录锁，分配代号和清理旧代时持有（写入进程唯一，锁只防止残留进程或手工操作同时改动快照目录）"""
+        with open(os.path.join(self.snapshot_dir, "LOCK"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    
+    def _commit_generation(self, generation: int, tmp_dir: str, files: Dict[str, Any], meta: Dict[str, Any]):
+        """临时目录中的文件都已落盘后写清单，原子改名提交这一代"""
+        generation_dir = self._generation_dir(generation)
+        manifest = dict(meta, generation=generation, files=files)
+        self._write_file(os.path.join(tmp_dir, "MANIFEST"), json.dumps(manifest, indent=2).encode("utf-8"))
+        _fsync_dir(tmp_dir)
+        os.rename(tmp_dir, generation_dir)
+        _fsync_dir(self.snapshot_dir)
+    
+    def _prune_generations(self):
+        """只保留最近几代快照及回退所需的归档日志，并清理崩溃遗留的临时目录（调用方需持有快照文件锁）"""
+        generations = self._list_generations()
+        kept = generations[:max(1, FAISSConfig.SNAPSHOT_KEEP_GENERATIONS)]
+        for generation in generations[len(kept):]:
+            shutil.rmtree(self._generation_dir(generation), ignore_errors=True)
+        if kept:
+            # 回退到最旧的保留代时，只需要它之后各代的归档日志
+            self._wal.prune_archives(kept[-1])
+        for name in os.listdir(self.snapshot_dir):
+            if name.endswith(".tmp"):
+                shutil.rmtree(os.path.join(self.snapshot_dir, name), ignore_errors=True)
+    
+    def _remove_legacy_snapshot(self):
+        """删除引入快照代之前直接写在 index_path 旁边的快照文件"""
+        legacy_files = [self.index_path] + glob.glob(glob.escape(self.index_path) + ".shard[0-9]*") + [
+            self.index_path + suffix
+            for suffix in (".ids", ".ids.npy", ".labels.npy", ".labels.json", ".deleted.npy", ".meta")
+        ]
+        for path in legacy_files:
+            if os.path.isfile(path):
+                os.remove(path)
+    
+    @staticmethod
+    def _write_file(path: str, content) -> Dict[str, int]:
+        """写入文件并fsync，返回大小和校验和；content 为字节串或 numpy 数组（保存为 .npy 格式）"""
+        with open(path, "wb") as f:
+            if isinstance(content, np.ndarray):
+                np.save(f, content)
+            else:
+                f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        return _file_checksum(path)
+    
+    @staticmethod
+    def _sync_file(path: str) -> Dict[str, int]:
+        """fsync 已写好的文件（如 faiss.write_index 的输出），返回大小和校验和"""
+        fd = os.open(path, os.O_RDONLY)
         try:
-            # 确保目录存在
-            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
-            
-            # 保存索引
-            faiss.write_index(self.index, self.index_path)
-            
-            # 保存ID映射
-            with open(self.index_path + ".ids", "w") as f:
-                json.dump(self.id_map, f)
-            
-            logger.info(f"Saved FAISS index to {self.index_path}")
-        except Exception as e:
-            logger.error(f"Failed to save FAISS index: {e}")
-            import traceback
-            logger.error(f"FAISS index saving traceback: {traceback.format_exc()}")
\ No newline at end of file
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return _file_checksum(path)
+    
+    def close(self):
+        """停止接收转发的写入和后台快照线程，写最后一次快照，关闭日志并释放写入锁"""
+        if self._stop_event.is_set():
+            return
+        self._stop_event.set()
+        self._stop_write_server()
+        self._close_writer_conn()
+        self._snapshot_event.set()
+        self._snapshot_thread.join()
+        if self._rebuild_thread is not None:
+            self._rebuild_thread.join()
+        self._save_index()
+        if self._wal is not None:
+            self._wal.close()
+        self.vector_file.close()
+        for mapped_file in self._mapped_files:
+            mapped_file.close()
+        self._release_writer_lock()
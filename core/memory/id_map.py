@@ -0,0 +1,121 @@
+"""
+FAISS int64 标签与外部记忆ID（UUID）之间的紧凑映射
+标签按写入顺序从0连续分配，第 i 个标签对应定长字节数组的第 i 行（.npy），
+不为每个条目创建Python对象，支持内存映射加载，多个进程可共享同一份页缓存
+反查（外部ID -> 标签）使用按ID排序的标签数组（每个条目 8 字节）二分查找
+"""
+import json
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+# 排序数组之后新写入、尚未并入排序的标签数超过该值时合并一次，未并入的部分反查时线性扫描
+_MAX_UNSORTED = 65536
+
+
+class IdMap:
+    def __init__(self, ids: np.ndarray = None):
+        """
+        :param ids: 已有的定长字节数组，第 i 个元素为标签 i 对应的外部ID
+        """
+        self._ids = ids if ids is not None else np.empty(0, dtype="S36")
+        self._size = len(self._ids)
+        self._order = None  # 按外部ID排序的标签，覆盖标签 [0, len(self._order))，首次反查时建立
+        self._order_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def next_label(self) -> int:
+        """下一个可分配的标签"""
+        return self._size
+
+    def get(self, label: int, default: Optional[str] = None) -> Optional[str]:
+        """按标签查询外部ID"""
+        if 0 <= label < self._size:
+            return self._ids[label].decode("utf-8")
+        return default
+
+    def lookup(self, labels: np.ndarray) -> List[Optional[str]]:
+        """批量把标签转换为外部ID，无效标签（如FAISS返回的-1）对应 None"""
+        labels = np.asarray(labels, dtype="int64")
+        valid = (labels >= 0) & (labels < self._size)
+        raw = self._ids[np.where(valid, labels, 0)] if self._size else np.empty(len(labels), dtype="S1")
+        return [r.decode("utf-8") if ok else None for r, ok in zip(raw, valid)]
+
+    def find(self, ids: List[str]) -> np.ndarray:
+        """
+        批量把外部ID反查为标签，返回升序且去重的标签（同一ID写入多次时返回全部标签），不存在的ID被忽略
+        已排序部分二分查找，尚未并入排序的尾部线性扫描；可与其他 find 并发，不能与 extend 并发
+        """
+        keys = np.array([id.encode("utf-8") for id in ids])
+        if not len(keys) or not self._size:
+            return np.empty(0, dtype="int64")
+        order = self._sorted_order()
+        indexed = len(order)
+        sorted_part = self._ids[:indexed]
+        left = np.searchsorted(sorted_part, keys, side="left", sorter=order)
+        counts = np.searchsorted(sorted_part, keys, side="right", sorter=order) - left
+        # 每个ID命中的是排序数组中的一段 [left, left + count)，展开为排序数组下标
+        starts = np.cumsum(counts) - counts
+        matched = order[np.repeat(left - starts, counts) + np.arange(counts.sum())]
+        unsorted = np.nonzero(np.isin(self._ids[indexed:self._size], keys))[0] + indexed
+        return np.unique(np.concatenate([matched, unsorted]).astype("int64"))
+
+    def _sorted_order(self) -> np.ndarray:
+        """按外部ID排序的标签；未并入排序的尾部超过 _MAX_UNSORTED 时归并进来（并发反查时只建立一次）"""
+        order = self._order
+        if order is not None and self._size - len(order) <= _MAX_UNSORTED:
+            return order
+        with self._order_lock:
+            order = self._order
+            if order is None:
+                order = np.argsort(self._ids[:self._size], kind="stable")
+            elif self._size - len(order) > _MAX_UNSORTED:
+                tail = np.arange(len(order), self._size, dtype="int64")
+                tail = tail[np.argsort(self._ids[len(order):self._size], kind="stable")]
+                positions = np.searchsorted(self._ids[:len(order)], self._ids[tail], side="right", sorter=order)
+                order = np.insert(order, positions, tail)
+            self._order = order.astype("int64", copy=False)
+            return self._order
+
+    def extend(self, ids: List[str]) -> np.ndarray:
+        """在末尾追加外部ID并返回为其分配的标签，容量按倍数增长"""
+        encoded = np.array([id.encode("utf-8") for id in ids])
+        if not len(encoded):
+            return np.empty(0, dtype="int64")
+        width = max(self._ids.dtype.itemsize, encoded.dtype.itemsize)
+        needed = self._size + len(encoded)
+        if (needed > len(self._ids) or width > self._ids.dtype.itemsize
+                or not self._ids.flags.writeable):
+            # 重新分配，内存映射的只读数组在首次写入时转为私有内存
+            grown = np.empty(max(needed, 2 * len(self._ids), 1024), dtype=f"S{width}")
+            grown[:self._size] = self._ids[:self._size]
+            self._ids = grown
+        self._ids[self._size:needed] = encoded
+        labels = np.arange(self._size, needed, dtype="int64")
+        self._size = needed
+        return labels
+
+    def to_array(self) -> np.ndarray:
+        """
+        返回当前有效部分的视图
+        已写入的位置不会再被修改，扩容时旧数组由视图持有，因此快照可以直接使用该视图而无需拷贝
+        """
+        return self._ids[:self._size]
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = False) -> "IdMap":
+        """从 .npy 文件加载，mmap=True 时只读映射到内存"""
+        return cls(np.load(path, mmap_mode="r" if mmap else None))
+
+    @classmethod
+    def load_legacy_json(cls, path: str) -> "IdMap":
+        """加载旧版 {位置字符串: ID} 格式的 JSON 映射，位置即标签"""
+        with open(path, "r") as f:
+            legacy = json.load(f)
+        id_map = cls()
+        id_map.extend([legacy.get(str(i), str(i)) for i in range(len(legacy))])
+        return id_map
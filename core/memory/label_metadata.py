@@ -0,0 +1,113 @@
+"""
+按 int64 标签存储的列式记忆元数据（用户、类型、时间）
+用于在FAISS检索内部生成 ID 过滤位图，而不是检索后在Python中丢弃结果
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# 每个标签一行：用户编码、类型编码、时间戳（秒），编码 -1 表示缺失
+_ROW_DTYPE = np.dtype([("user", "<i4"), ("type", "<i4"), ("timestamp", "<f8")])
+
+
+def _to_timestamp(value: Any) -> float:
+    """把 ISO 字符串/datetime/数字统一转换为时间戳，无法识别时返回 NaN"""
+    if value is None:
+        return float("nan")
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return float("nan")
+
+
+class LabelMetadata:
+    def __init__(self, rows: np.ndarray = None, vocab: Dict[str, List[str]] = None):
+        """
+        :param rows: 已有的元数据行，第 i 行对应标签 i
+        :param vocab: 用户和类型的字符串词表，编码即词表下标
+        """
+        self._rows = rows if rows is not None else np.empty(0, dtype=_ROW_DTYPE)
+        self._size = len(self._rows)
+        vocab = vocab or {}
+        self._users = list(vocab.get("user", []))
+        self._types = list(vocab.get("type", []))
+        self._user_codes = {v: i for i, v in enumerate(self._users)}
+        self._type_codes = {v: i for i, v in enumerate(self._types)}
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def _encode(value: Optional[str], values: List[str], codes: Dict[str, int], create: bool) -> int:
+        """字符串转编码；create=False 时未知值返回 -2（不匹配任何行）"""
+        if value is None or value == "":
+            return -1
+        code = codes.get(value)
+        if code is None:
+            if not create:
+                return -2
+            code = len(values)
+            values.append(value)
+            codes[value] = code
+        return code
+
+    def extend(self, metadatas: List[Optional[Dict[str, Any]]]):
+        """为新分配的标签追加元数据行，容量按倍数增长"""
+        if not metadatas:
+            return
+        needed = self._size + len(metadatas)
+        if needed > len(self._rows) or not self._rows.flags.writeable:
+            grown = np.empty(max(needed, 2 * len(self._rows), 1024), dtype=_ROW_DTYPE)
+            grown[:self._size] = self._rows[:self._size]
+            self._rows = grown
+        new_rows = self._rows[self._size:needed]
+        for i, metadata in enumerate(metadatas):
+            metadata = metadata or {}
+            new_rows[i] = (
+                self._encode(metadata.get("user_id"), self._users, self._user_codes, True),
+                self._encode(metadata.get("type"), self._types, self._type_codes, True),
+                _to_timestamp(metadata.get("timestamp")),
+            )
+        self._size = needed
+
+    def mask(self, filters: Dict[str, Any]) -> np.ndarray:
+        """
+        按过滤条件生成布尔掩码（向量化），第 i 位表示标签 i 是否满足条件
+        支持的键：user_id、type、start_time、end_time
+        没有归属用户的历史记录对所有用户可见
+        """
+        rows = self._rows[:self._size]
+        selected = np.ones(self._size, dtype=bool)
+        if filters.get("user_id") is not None:
+            code = self._encode(filters["user_id"], self._users, self._user_codes, False)
+            selected &= (rows["user"] == code) | (rows["user"] == -1)
+        if filters.get("type") is not None:
+            code = self._encode(filters["type"], self._types, self._type_codes, False)
+            selected &= rows["type"] == code
+        if filters.get("start_time") is not None:
+            selected &= rows["timestamp"] >= _to_timestamp(filters["start_time"])
+        if filters.get("end_time") is not None:
+            selected &= rows["timestamp"] <= _to_timestamp(filters["end_time"])
+        return selected
+
+    def to_array(self) -> np.ndarray:
+        """返回当前有效部分的视图（已写入的行不会再被修改，快照可直接使用）"""
+        return self._rows[:self._size]
+
+    def vocab(self) -> Dict[str, List[str]]:
+        """返回词表副本"""
+        return {"user": list(self._users), "type": list(self._types)}
+
+    @classmethod
+    def load(cls, rows_path: str, vocab_path: str, mmap: bool = False) -> "LabelMetadata":
+        """加载元数据行（.npy）和词表（.json），mmap=True 时只读映射到内存"""
+        rows = np.load(rows_path, mmap_mode="r" if mmap else None)
+        with open(vocab_path, "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        return cls(rows, vocab)
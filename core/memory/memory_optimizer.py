@@ -1,14 +1,366 @@
 # 记忆优化与清洗
-from typing import List, Dict, Any
+import heapq
+import math
+import time
+from datetime import datetime
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+import numpy as np
+
+from app.config import Config
+from utils.helpers import SharedDependency, chunk_list
+from utils.logging_config import get_logger
+logger = get_logger(__name__)
+
+# 重复检测只读取这些字段，不解析完整记忆
+_DEDUP_FIELDS = ["id", "user_id", "type", "embedding_row"]
+# 淘汰策略只读取这些字段
+_EVICTION_FIELDS = ["id", "user_id", "type", "score", "timestamp"]
+# 桶内精确比对时每次计算相似度矩阵的行数（1024x1024 的布尔矩阵约 1MB）
+_BUCKET_CHUNK = 1024
+# 合并后元数据中最多保留的被合并ID数
+_MAX_MERGED_IDS = 20
+
+
+class _UnionFind:
+    """并查集（路径压缩 + 按大小合并），把多张LSH表中发现的重复关系合并为簇"""
+    __slots__ = ("parent", "size")
+
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, i: int) -> int:
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, a: int, b: int):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+    def clusters(self) -> List[List[int]]:
+        """所有包含两个及以上成员的簇"""
+        roots = np.fromiter((self.find(i) for i in range(len(self.parent))), dtype=np.int64, count=len(self.parent))
+        order = np.argsort(roots, kind="stable")
+        bounds = np.flatnonzero(np.diff(roots[order])) + 1
+        return [group.tolist() for group in np.split(order, bounds) if len(group) > 1]
+
+
+def _parse_timestamp(value: Any, default: float) -> float:
+    """ISO 时间字符串转 Unix 时间戳，缺失或无法解析时返回 default"""
+    if not value:
+        return default
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return default
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """按行L2归一化，零向量保持为零"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
 
 class MemoryOptimizer:
-    def __init__(self):
-        pass
-    
-    def optimize_memory(self, memories: List[Dict[str, Any]]):
-        # 记忆优化
-        pass
-    
-    def clean_memory(self, memories: List[Dict[str, Any]]):
-        # 记忆清洗
-        pass 
\ No newline at end of file
+    # 构造时未传入的依赖在首次访问时取进程内共享实例
+    vector_store = SharedDependency("core.memory.faiss_vector_store:get_vector_store")
+    content_store = SharedDependency("core.memory.content_store:get_content_store")
+    long_term = SharedDependency("core.memory.episodic_log:get_episodic_log")
+
+    def __init__(
+        self,
+        vector_store=None,
+        content_store=None,
+        long_term=None,
+        similarity_threshold: float = None,
+        lsh_bits: int = None,
+        lsh_tables: int = None,
+        block_size: int = None,
+        seed: int = 0,
+        max_per_user: int = None,
+        max_entries: int = None,
+        ttl_by_type: Dict[str, float] = None,
+        half_life: float = None
+    ):
+        """
+        :param vector_store: 向量库，默认共享的FAISS向量库
+        :param content_store: 内容库，默认共享的SQLite内容库
+        :param long_term: 情景记忆日志，默认共享的日志
+        :param similarity_threshold: 余弦相似度不低于该值的两条记忆视为重复
+        :param lsh_bits: 每张LSH表的随机超平面数
+        :param lsh_tables: LSH表数
+        :param block_size: 计算LSH签名时每块读取的向量行数
+        :param seed: 随机超平面的种子，固定后结果可复现
+        :param max_per_user: 每个用户最多保留的记忆数，0 表示不限
+        :param max_entries: 全部记忆的总上限，0 表示不限
+        :param ttl_by_type: 按记忆类型的存活时间（秒），未配置的类型不过期
+        :param half_life: 保留分数随闲置时间衰减的半衰期（秒）
+        """
+        self._vector_store = vector_store
+        self._content_store = content_store
+        self._long_term = long_term
+        self.similarity_threshold = similarity_threshold or Config.DEDUP_SIMILARITY_THRESHOLD
+        self.lsh_bits = min(lsh_bits or Config.DEDUP_LSH_BITS, 62)
+        self.lsh_tables = lsh_tables or Config.DEDUP_LSH_TABLES
+        self.block_size = block_size or Config.DEDUP_BLOCK_SIZE
+        self.seed = seed
+        self.max_per_user = Config.MEMORY_MAX_PER_USER if max_per_user is None else max_per_user
+        self.max_entries = Config.MEMORY_MAX_ENTRIES if max_entries is None else max_entries
+        self.ttl_by_type = Config.MEMORY_TTL_BY_TYPE if ttl_by_type is None else ttl_by_type
+        self.half_life = half_life or Config.MEMORY_DECAY_HALF_LIFE
+
+    def optimize_memory(self, memories: List[Dict[str, Any]] = None) -> Dict[str, int]:
+        """
+        离线近重复检测与合并
+        1. 分块计算每条记忆向量的随机超平面LSH签名，同一用户、同一类型且签名相同的记忆落入同一个桶
+        2. 桶内用分块相似度矩阵精确比对，相似度不低于阈值的记忆用并查集合并为簇
+        3. 每个簇保留一条规范记忆（分数最高、其次最新），合并元数据后写回，其余记忆从向量库、内容库和日志中删除
+        :param memories: 要去重的记忆（需带 embedding 或 embedding_row），为空时流式扫描整个情景记忆日志
+        :return: {"scanned": 参与比对的记忆数, "clusters": 重复簇数, "merged": 被合并删除的记忆数}
+        """
+        try:
+            ids, groups, matrix, rows = self._load_candidates(memories)
+            clusters = self._find_duplicate_clusters(matrix, rows, groups)
+            records = None if memories is None else {memory["id"]: memory for memory in memories}
+            merged = self._merge_clusters([[ids[i] for i in cluster] for cluster in clusters], records)
+            logger.info(f"Memory dedup scanned {len(ids)} memories, merged {merged} duplicates in {len(clusters)} clusters")
+            return {"scanned": len(ids), "clusters": len(clusters), "merged": merged}
+        except Exception as e:
+            logger.error(f"Memory dedup failed: {e}")
+            import traceback
+            logger.error(f"Memory dedup traceback: {traceback.format_exc()}")
+            return {"scanned": 0, "clusters": 0, "merged": 0}
+
+    def _load_candidates(
+        self,
+        memories: Optional[List[Dict[str, Any]]]
+    ) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+        """
+        收集参与比对的记忆，返回 (ID列表, 分组编号, 向量矩阵, 每条记忆在矩阵中的行号)
+        扫描整个日志时向量矩阵为原始向量文件的内存映射视图，不把全部向量读入内存
+        """
+        group_codes: Dict[Tuple[Any, Any], int] = {}
+        ids, groups, rows = [], [], []
+
+        def collect(memory: Dict[str, Any], row: int):
+            ids.append(memory["id"])
+            groups.append(group_codes.setdefault((memory.get("user_id"), memory.get("type")), len(group_codes)))
+            rows.append(row)
+
+        if memories is None:
+            for batch in self.long_term.iter_memories(batch_size=self.block_size, fields=_DEDUP_FIELDS):
+                for memory in batch:
+                    if memory.get("embedding_row") is not None:
+                        collect(memory, memory["embedding_row"])
+            matrix = self.vector_store.embedding_matrix()
+        else:
+            vectors = []
+            stored = [memory for memory in memories if memory.get("embedding") is None
+                      and memory.get("embedding_row") is not None]
+            for memory in memories:
+                if memory.get("embedding") is not None:
+                    collect(memory, len(vectors))
+                    vectors.append(np.asarray(memory["embedding"], dtype=np.float32))
+            if stored:
+                stored_vectors = self.vector_store.read_rows([memory["embedding_row"] for memory in stored])
+                for memory, vector in zip(stored, stored_vectors):
+                    collect(memory, len(vectors))
+                    vectors.append(vector)
+            matrix = np.vstack(vectors) if vectors else np.zeros((0, 1), dtype=np.float32)
+        return ids, np.asarray(groups, dtype=np.int64), matrix, np.asarray(rows, dtype=np.int64)
+
+    def _find_duplicate_clusters(self, matrix: np.ndarray, rows: np.ndarray, groups: np.ndarray) -> List[List[int]]:
+        """LSH分桶 + 桶内精确比对，返回重复簇（每个簇为候选记忆的下标列表）"""
+        n = len(rows)
+        if n < 2:
+            return []
+
+        # 分块计算签名：每张表 lsh_bits 个超平面，符号位打包为一个整数
+        planes = np.random.default_rng(self.seed).standard_normal(
+            (matrix.shape[1], self.lsh_tables * self.lsh_bits)
+        ).astype(np.float32)
+        weights = np.left_shift(1, np.arange(self.lsh_bits, dtype=np.int64))
+        codes = np.empty((n, self.lsh_tables), dtype=np.int64)
+        for start in range(0, n, self.block_size):
+            block = np.asarray(matrix[rows[start:start + self.block_size]], dtype=np.float32)
+            signs = (block @ planes > 0).reshape(len(block), self.lsh_tables, self.lsh_bits)
+            codes[start:start + len(block)] = signs @ weights
+
+        union_find = _UnionFind(n)
+        for table in range(self.lsh_tables):
+            order = np.lexsort((codes[:, table], groups))
+            keys_changed = (np.diff(codes[order, table]) != 0) | (np.diff(groups[order]) != 0)
+            for bucket in np.split(order, np.flatnonzero(keys_changed) + 1):
+                if len(bucket) > 1:
+                    self._cluster_bucket(matrix, rows, bucket, union_find)
+        return union_find.clusters()
+
+    def _cluster_bucket(self, matrix: np.ndarray, rows: np.ndarray, members: np.ndarray, union_find: _UnionFind):
+        """
+        桶内贪心聚类：每块内取第一条未归类的记忆为代表，与其相似度不低于阈值的记忆归入同一簇
+        超过一块的大桶先在块内聚类，再对各块的代表递归比对，相似度矩阵始终只有一块大小
+        """
+        leaders = []
+        for chunk in chunk_list(members.tolist(), _BUCKET_CHUNK):
+            vectors = _normalize(matrix[rows[chunk]])
+            similar = vectors @ vectors.T >= self.similarity_threshold
+            unassigned = np.ones(len(chunk), dtype=bool)
+            for i in range(len(chunk)):
+                if not unassigned[i]:
+                    continue
+                group = np.flatnonzero(similar[i] & unassigned)
+                unassigned[group] = False
+                leaders.append(chunk[i])
+                for j in group:
+                    union_find.union(chunk[i], chunk[j])
+        if len(members) > _BUCKET_CHUNK and len(leaders) < len(members):
+            self._cluster_bucket(matrix, rows, np.asarray(leaders, dtype=np.int64), union_find)
+
+    def _merge_clusters(
+        self,
+        clusters: List[List[str]],
+        records: Optional[Dict[str, Dict[str, Any]]] = None
+    ) -> int:
+        """按批合并重复簇：写回规范记忆，再从向量库、内容库和日志中批量删除其余记忆，返回删除条数"""
+        merged = 0
+        for batch in chunk_list(clusters, _BUCKET_CHUNK):
+            lookup = records if records is not None else self.long_term.get_many(
+                [memory_id for cluster in batch for memory_id in cluster]
+            )
+            canonicals, duplicates = [], []
+            for cluster in batch:
+                members = [lookup[memory_id] for memory_id in cluster if memory_id in lookup]
+                if len(members) < 2:
+                    continue
+                canonical = self._merge_cluster(members)
+                canonicals.append(canonical)
+                duplicates.extend(member["id"] for member in members if member["id"] != canonical["id"])
+            if not canonicals:
+                continue
+
+            self.long_term.append_many(canonicals)
+            self.content_store.put_many(canonicals)
+            self.vector_store.remove(duplicates)
+            self.content_store.delete_many(duplicates)
+            self.long_term.delete_many(duplicates)
+            merged += len(duplicates)
+        return merged
+
+    @staticmethod
+    def _merge_cluster(members: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """选出规范记忆（分数最高、其次最新）并聚合整个簇的元数据"""
+        canonical = max(members, key=lambda m: (m.get("score") or 0, m.get("timestamp") or ""))
+        merged = {key: value for key, value in canonical.items() if key != "embedding"}
+
+        metadatas = [member.get("metadata") or {} for member in members]
+        first_seen = [m.get("first_seen") or member.get("timestamp") for m, member in zip(metadatas, members)]
+        last_seen = [m.get("last_seen") or member.get("timestamp") for m, member in zip(metadatas, members)]
+        merged_ids = list((canonical.get("metadata") or {}).get("merged_ids", []))
+        merged_ids.extend(member["id"] for member in members if member["id"] != canonical["id"])
+
+        merged["metadata"] = {
+            **(canonical.get("metadata") or {}),
+            "duplicate_count": sum(m.get("duplicate_count", 1) for m in metadatas),
+            "first_seen": min(filter(None, first_seen), default=None),
+            "last_seen": max(filter(None, last_seen), default=None),
+            "merged_ids": merged_ids[:_MAX_MERGED_IDS],
+        }
+        merged["tags"] = list(dict.fromkeys(tag for member in members for tag in member.get("tags") or []))
+        scores = [member["score"] for member in members if member.get("score") is not None]
+        if scores:
+            merged["score"] = max(scores)
+        return merged
+
+    def clean_memory(self, memories: List[Dict[str, Any]] = None, now: float = None) -> Dict[str, int]:
+        """
+        记忆清洗（淘汰），依次应用三种策略：
+        1. 按类型的TTL：创建时间超过该类型存活时间的记忆直接过期
+        2. 每用户容量：每个用户维护一个大小为 max_per_user 的最小堆（按保留分数），
+           堆满后每条新记忆 heappushpop 一次，弹出的即为淘汰对象，单次 O(log n)
+        3. 总容量：所有用户剩余的记忆建堆后弹出保留分数最低的记忆，直到不超过 max_entries
+        淘汰的记忆从向量库、内容库和日志中一并删除，随后压缩日志，索引大小和检索延迟保持有界
+        :param memories: 要清洗的记忆，为空时流式扫描整个情景记忆日志
+        :param now: 当前时间（Unix 时间戳），默认为调用时刻
+        :return: {"scanned": 扫描条数, "expired": TTL过期条数, "evicted": 因容量淘汰条数}
+        """
+        try:
+            now = time.time() if now is None else now
+            expired, evicted = [], []
+            survivors: Dict[Any, List[Tuple[float, str]]] = {}
+            scanned = 0
+            for batch in self._iter_eviction_candidates(memories):
+                stats = self.content_store.get_access_stats([memory["id"] for memory in batch])
+                for memory in batch:
+                    scanned += 1
+                    created = _parse_timestamp(memory.get("timestamp"), now)
+                    ttl = self.ttl_by_type.get(memory.get("type"))
+                    if ttl is not None and now - created > ttl:
+                        expired.append(memory["id"])
+                        continue
+
+                    access_count, last_accessed = stats.get(memory["id"], (0, None))
+                    entry = (self._retention_score(memory.get("score"), created, access_count, last_accessed, now),
+                             memory["id"])
+                    heap = survivors.setdefault(memory.get("user_id"), [])
+                    if not self.max_per_user:
+                        heap.append(entry)
+                    elif len(heap) < self.max_per_user:
+                        heapq.heappush(heap, entry)
+                    else:
+                        evicted.append(heapq.heappushpop(heap, entry)[1])
+
+            remaining = [entry for heap in survivors.values() for entry in heap]
+            if self.max_entries and len(remaining) > self.max_entries:
+                heapq.heapify(remaining)
+                evicted.extend(heapq.heappop(remaining)[1] for _ in range(len(remaining) - self.max_entries))
+
+            self._prune(expired + evicted)
+            logger.info(f"Memory cleanup scanned {scanned} memories, expired {len(expired)}, evicted {len(evicted)}")
+            return {"scanned": scanned, "expired": len(expired), "evicted": len(evicted)}
+        except Exception as e:
+            logger.error(f"Memory cleanup failed: {e}")
+            import traceback
+            logger.error(f"Memory cleanup traceback: {traceback.format_exc()}")
+            return {"scanned": 0, "expired": 0, "evicted": 0}
+
+    def _iter_eviction_candidates(self, memories: Optional[List[Dict[str, Any]]]) -> Iterator[List[Dict[str, Any]]]:
+        """按批生成待评估的记忆"""
+        if memories is None:
+            return self.long_term.iter_memories(batch_size=self.block_size, fields=_EVICTION_FIELDS)
+        return chunk_list(memories, self.block_size)
+
+    def _retention_score(
+        self,
+        score: Optional[float],
+        created: float,
+        access_count: int,
+        last_accessed: Optional[float],
+        now: float
+    ) -> float:
+        """
+        保留分数 = (1 + 价值评分) * (1 + ln(1 + 访问次数)) * 0.5 ^ (闲置时长 / 半衰期)
+        闲置时长从最近一次访问（未访问过则从创建）算起，分数越低越先淘汰
+        """
+        idle = max(0.0, now - max(created, last_accessed or created))
+        return (1 + (score or 0)) * (1 + math.log1p(access_count)) * 0.5 ** (idle / self.half_life)
+
+    def _prune(self, ids: List[str]):
+        """从向量库、内容库和日志中批量删除记忆，删除后压缩日志"""
+        if not ids:
+            return
+        for batch in chunk_list(ids, self.block_size):
+            self.vector_store.remove(batch)
+            self.content_store.delete_many(batch)
+            self.long_term.delete_many(batch)
+        self.long_term.compact()
@@ -1,11 +1,11 @@
 # 记忆检索模块
-from typing import List, Dict, Any, Optional
+from typing import List, Optional
 import asyncio
 import json
-from datetime import datetime
 
 from models.embedding_model import EmbeddingModel
 from models.llm_inference import LLMInference
+from utils.schema import MemoryRecord
 from utils.logging_config import get_logger
 
 logger = get_logger(__name__)
@@ -26,7 +26,7 @@ class MemoryStore:
         query: str, 
         user_id: str = "default",
         max_chunks: int = 5
-    ) -> List[Dict[str, Any]]:
+    ) -> List[MemoryRecord]:
         """
         记忆检索主函数
         
@@ -59,7 +59,7 @@ class MemoryStore:
         self, 
         query: str, 
         user_id: str
-    ) -> List[Dict[str, Any]]:
+    ) -> List[MemoryRecord]:
         """embedding 相似度召回"""
         try:
             # 获取查询的 embedding
@@ -78,26 +78,18 @@ class MemoryStore:
     async def _chunk_scoring(
         self, 
         query: str, 
-        candidates: List[Dict[str, Any]]
-    ) -> List[Dict[str, Any]]:
+        candidates: List[MemoryRecord]
+    ) -> List[MemoryRecord]:
         """chunk scoring（评分模型选择关键记忆）"""
         try:
-            scored_candidates = []
-            
             for candidate in candidates:
-                # 使用 LLM 对每个候选记忆进行评分
-                score = await self._score_chunk_relevance(query, candidate)
-                
-                scored_candidate = {
-                    **candidate,
-                    "relevance_score": score
-                }
-                scored_candidates.append(scored_candidate)
+                # 使用 LLM 对每个候选记忆进行评分，直接写入记录，不复制
+                candidate.relevance_score = await self._score_chunk_relevance(query, candidate)
             
             # 按评分排序
-            scored_candidates.sort(key=lambda x: x["relevance_score"], reverse=True)
+            candidates.sort(key=lambda x: x.relevance_score, reverse=True)
             
-            return scored_candidates
+            return candidates
             
         except Exception as e:
             logger.error(f"Chunk scoring failed: {str(e)}")
@@ -106,7 +98,7 @@ class MemoryStore:
     async def _score_chunk_relevance(
         self, 
         query: str, 
-        chunk: Dict[str, Any]
+        chunk: MemoryRecord
     ) -> float:
         """使用 LLM 评分记忆片段的相关性"""
         try:
@@ -114,7 +106,7 @@ class MemoryStore:
             请评估以下记忆片段与用户查询的相关性，评分范围 0-1：
             
             用户查询：{query}
-            记忆片段：{chunk.get('content', '')}
+            记忆片段：{chunk.content}
             
             请只返回一个 0-1 之间的数字作为相关性评分。
             """
@@ -132,14 +124,15 @@ class MemoryStore:
             logger.error(f"Chunk scoring failed: {str(e)}")
             return 0.5
     
-    async def _search_vector_db(self, query_embedding: List[float], user_id: str) -> List[Dict[str, Any]]:
+    async def _search_vector_db(self, query_embedding: List[float], user_id: str) -> List[MemoryRecord]:
         """从向量数据库搜索（FAISS实现）"""
         try:
             # 使用FAISS向量数据库搜索
-            from .faiss_vector_store import FAISSVectorStore
+            from .faiss_vector_store import get_vector_store
+            from .content_store import get_content_store
             
-            # 初始化FAISS索引
-            faiss_store = FAISSVectorStore()
+            # 获取进程内共享的FAISS索引
+            faiss_store = get_vector_store()
             
             # 导入配置
             try:
@@ -149,19 +142,23 @@ class MemoryStore:
                 # 如果配置导入失败，使用默认值
                 search_top_k = 5
             
-            # 执行搜索
-            search_results = faiss_store.search(query_embedding, k=search_top_k)
+            # 执行搜索，只召回该用户的记忆（过滤在FAISS检索内部完成）
+            search_results = faiss_store.search(
+                query_embedding, k=search_top_k, filters={"user_id": user_id}
+            )
             
-            # 这里需要根据实际存储结构返回结果
-            # 目前返回模拟数据结构
+            # 一次查询从内容库取回全部命中的记忆，内容库中缺失的ID跳过
+            content_store = get_content_store()
+            memories = content_store.get_many([result["id"] for result in search_results])
+            # 记录命中，访问越频繁的记忆在淘汰时衰减越慢
+            content_store.touch_many(list(memories))
             results = []
             for result in search_results:
-                results.append({
-                    "id": result["id"],
-                    "content": "从FAISS检索到的内容",  # 需要从实际存储中获取
-                    "embedding": query_embedding,
-                    "timestamp": datetime.now().isoformat()
-                })
+                memory = memories.get(result["id"])
+                if memory is None:
+                    logger.warning(f"Memory {result['id']} found in FAISS but missing from content store")
+                    continue
+                results.append(MemoryRecord.from_dict(memory, distance=result["distance"]))
             
             return results
             
@@ -1,14 +1,15 @@
 # 记忆更新模块
 from typing import List, Dict, Any, Optional
-import json
 import asyncio
 from datetime import datetime
 import uuid
 
+import numpy as np
+
 from models.embedding_model import EmbeddingModel
 from models.llm_inference import LLMInference
 from utils.logging_config import get_logger
-from utils.helpers import save_json_file
+from utils.schema import MemoryRecord
 
 logger = get_logger(__name__)
 
@@ -22,7 +23,6 @@ class MemoryUpdater:
         self.embedding_model = EmbeddingModel()
         self.llm_inference = LLMInference()
         self.memory_db_path = "data/memory.db"
-        self.memory_file_path = "data/episodic_memory.json"
         
     async def update_memory(
         self, 
@@ -30,7 +30,7 @@ class MemoryUpdater:
         plan_steps: List[str], 
         execution_result: Dict[str, Any],
         user_id: str = "default"
-    ) -> List[Dict[str, Any]]:
+    ) -> List[MemoryRecord]:
         """
         更新记忆
         
@@ -65,7 +65,7 @@ class MemoryUpdater:
                 if memory_entry:
                     await self._store_memory(memory_entry)
                     memory_traces.append(memory_entry)
-                    logger.info(f"记忆更新步骤4/4：片段存储完成，ID: {memory_entry['id']}")
+                    logger.info(f"记忆更新步骤4/4：片段存储完成，ID: {memory_entry.id}")
                 else:
                     logger.warning(f"记忆更新步骤4/4：片段创建失败，跳过存储")
             
@@ -104,13 +104,10 @@ class MemoryUpdater:
             scored_segments = []
             
             for segment in segments:
-                score = await self._evaluate_segment_value(segment)
-                scored_segment = {
-                    **segment,
-                    "score": score,
-                    "timestamp": datetime.now().isoformat()
-                }
-                scored_segments.append(scored_segment)
+                # 片段是本次新建的字典，直接写入评分，不复制
+                segment["score"] = await self._evaluate_segment_value(segment)
+                segment["timestamp"] = datetime.now().isoformat()
+                scored_segments.append(segment)
             
             # 按评分排序
             scored_segments.sort(key=lambda x: x["score"], reverse=True)
@@ -210,7 +207,7 @@ class MemoryUpdater:
         self, 
         segment: Dict[str, Any], 
         user_id: str
-    ) -> Dict[str, Any]:
+    ) -> Optional[MemoryRecord]:
         """创建记忆条目"""
         try:
             # 生成 embedding
@@ -218,58 +215,70 @@ class MemoryUpdater:
             embedding = self.embedding_model.embed_text(content)
             
             # 创建记忆条目
-            memory_entry = {
-                "id": str(uuid.uuid4()),
-                "content": content,
-                "embedding": embedding,
-                "tags": [],
-                "type": segment.get("type", ""),
-                "metadata": segment.get("metadata", {}),
-                "score": segment.get("score", 0.0),
-                "user_id": user_id,
-                "timestamp": datetime.now().isoformat(),
-                "storage_type": "episodic"  # 或 "semantic", "procedural"
-            }
+            memory_entry = MemoryRecord(
+                id=str(uuid.uuid4()),
+                content=content,
+                embedding=embedding,
+                type=segment.get("type", ""),
+                metadata=segment.get("metadata", {}),
+                score=segment.get("score", 0.0),
+                user_id=user_id,
+                timestamp=datetime.now().isoformat(),
+                storage_type="episodic"  # 或 "semantic", "procedural"
+            )
             
             return memory_entry
             
         except Exception as e:
             logger.error(f"Memory entry creation failed: {str(e)}")
-            return {}
+            return None
     
-    async def _store_memory(self, memory_entry: Dict[str, Any]):
+    async def _store_memory(self, memory_entry: MemoryRecord):
         """存储记忆条目"""
         try:
-            # 1. 存储到向量数据库（模拟）
+            # 1. 存储到向量数据库，向量写入原始向量文件，记录中只保留行号 embedding_row
             await self._store_to_vector_db(memory_entry)
             
-            # 2. 存储到知识图谱（模拟）
+            # 2. 存储内容和元数据
+            await self._store_to_content_db(memory_entry)
+            
+            # 3. 存储到知识图谱（模拟）
             await self._store_to_knowledge_graph(memory_entry)
             
-            # 3. 存储到文本文件
+            # 4. 追加到情景记忆日志
             await self._store_to_text_file(memory_entry)
             
-            logger.info(f"Stored memory entry: {memory_entry.get('id')}")
+            logger.info(f"Stored memory entry: {memory_entry.id}")
             
         except Exception as e:
             logger.error(f"Memory storage failed: {str(e)}")
     
-    async def _store_to_vector_db(self, memory_entry: Dict[str, Any]):
+    async def _store_to_content_db(self, memory_entry: MemoryRecord):
+        """存储内容和元数据到 SQLite 内容库（按记忆ID寻址，向量本身不入库）"""
+        from .content_store import get_content_store
+        
+        if get_content_store().put(memory_entry):
+            logger.info(f"Stored to content DB: {memory_entry.id}")
+    
+    async def _store_to_vector_db(self, memory_entry: MemoryRecord):
         """存储到向量数据库（FAISS实现）"""
         try:
             # 使用FAISS向量数据库存储
-            from .faiss_vector_store import FAISSVectorStore
+            from .faiss_vector_store import get_vector_store
             
-            # 初始化FAISS索引
-            faiss_store = FAISSVectorStore()
+            # 获取进程内共享的FAISS索引
+            faiss_store = get_vector_store()
             
             # 提取需要存储的数据
-            memory_id = memory_entry.get("id")
-            embedding = memory_entry.get("embedding")
+            memory_id = memory_entry.id
+            embedding = memory_entry.embedding
             
-            # 添加到FAISS索引
-            if memory_id and embedding:
-                faiss_store.add_vectors([memory_id], [embedding])
+            # 添加到FAISS索引（float32 向量直接写入，不再转换）
+            if memory_id and embedding is not None:
+                rows = faiss_store.add_vectors([memory_id], embedding[np.newaxis], [memory_entry])
+                if not rows:
+                    raise RuntimeError(f"FAISS index did not accept vector for {memory_id}")
+                memory_entry.embedding_row = rows[0]
                 logger.info(f"Stored to FAISS vector DB: {memory_id}")
             else:
                 logger.warning(f"Missing id or embedding for memory entry: {memory_id}")
@@ -278,28 +287,21 @@ class MemoryUpdater:
             logger.error(f"Failed to store to FAISS vector DB: {str(e)}")
             import traceback
             logger.error(f"FAISS vector store traceback: {traceback.format_exc()}")
+            # 向量没有写入时不写内容库和日志，否则这条记忆带着空的 embedding_row 永远检索不到
+            raise
     
-    async def _store_to_knowledge_graph(self, memory_entry: Dict[str, Any]):
+    async def _store_to_knowledge_graph(self, memory_entry: MemoryRecord):
         """存储到知识图谱"""
         # 这里应该连接到实际的知识图谱数据库
         # 目前是模拟实现
-        logger.info(f"Storing to knowledge graph: {memory_entry.get('id')}")
+        logger.info(f"Storing to knowledge graph: {memory_entry.id}")
     
-    async def _store_to_text_file(self, memory_entry: Dict[str, Any]):
-        """存储到文本文件"""
+    async def _store_to_text_file(self, memory_entry: MemoryRecord):
+        """追加到情景记忆日志（JSONL，只追加一行，不重写已有内容；落盘的记录不含向量本身，向量按 embedding_row 读取）"""
         try:
-            # 读取现有记忆文件
-            try:
-                with open(self.memory_file_path, 'r', encoding='utf-8') as f:
-                    memory_data = json.load(f)
-            except FileNotFoundError:
-                memory_data = {"memories": []}
-            
-            # 添加新记忆条目
-            memory_data["memories"].append(memory_entry)
+            from .episodic_log import get_episodic_log
             
-            # 保存到文件
-            save_json_file(memory_data, self.memory_file_path)
+            get_episodic_log().append(memory_entry.to_dict())
             
         except Exception as e:
             logger.error(f"Text file storage failed: {str(e)}")
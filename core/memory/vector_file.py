@@ -0,0 +1,71 @@
+"""
+定长步长的 float32 向量文件
+第 i 行存放标签 i 的原始向量，按行号随机读写，读取通过内存映射零拷贝完成
+"""
+import os
+import threading
+
+import numpy as np
+
+
+class VectorFile:
+    def __init__(self, path: str, dimension: int, read_only: bool = False):
+        """
+        :param path: 向量文件路径
+        :param dimension: 向量维度，每行占 dimension * 4 字节
+        :param read_only: 只读打开（只读的向量库进程），不能调用 write
+        """
+        self.path = path
+        self.dimension = dimension
+        self.row_bytes = dimension * 4
+        file_dir = os.path.dirname(path)
+        if file_dir:
+            os.makedirs(file_dir, exist_ok=True)
+        self._fd = os.open(path, (os.O_RDONLY if read_only else os.O_RDWR) | os.O_CREAT, 0o644)
+        self._map = None
+        self._map_rows = 0
+        self._map_lock = threading.Lock()
+
+    @property
+    def rows(self) -> int:
+        """文件中已写入的行数"""
+        return os.fstat(self._fd).st_size // self.row_bytes
+
+    def write(self, labels: np.ndarray, vectors: np.ndarray):
+        """按标签写入向量（幂等，重复写同一行会覆盖），标签连续时合并为一次写入"""
+        labels = np.asarray(labels, dtype="int64")
+        vectors = np.ascontiguousarray(vectors, dtype="float32").reshape(-1, self.dimension)
+        if not len(labels):
+            return
+        if np.array_equal(labels, np.arange(labels[0], labels[0] + len(labels))):
+            os.pwrite(self._fd, vectors.tobytes(), int(labels[0]) * self.row_bytes)
+            return
+        for label, vector in zip(labels, vectors):
+            os.pwrite(self._fd, vector.tobytes(), int(label) * self.row_bytes)
+
+    def read(self, labels: np.ndarray) -> np.ndarray:
+        """按标签读取向量，返回 (len(labels), dimension) 的 float32 矩阵"""
+        labels = np.asarray(labels, dtype="int64")
+        return self.matrix()[labels]
+
+    def matrix(self) -> np.ndarray:
+        """返回整个文件的只读内存映射视图（文件增长后自动重新映射）"""
+        rows = self.rows
+        with self._map_lock:
+            if self._map is None or self._map_rows != rows:
+                if rows == 0:
+                    self._map = np.empty((0, self.dimension), dtype="float32")
+                else:
+                    self._map = np.memmap(self.path, dtype="float32", mode="r", shape=(rows, self.dimension))
+                self._map_rows = rows
+            return self._map
+
+    def flush(self):
+        """把已写入的数据刷到磁盘"""
+        os.fsync(self._fd)
+
+    def close(self):
+        """关闭文件"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,132 @@
+"""
+追加写的预写日志（WAL）
+每条记录格式：<头长度, 负载长度, CRC32> + JSON头 + 二进制负载
+快照提交后，轮转出的旧日志按快照代号归档（path + ".00000012"），回退到上一代快照时用于补回写入
+"""
+import glob
+import json
+import os
+import re
+import struct
+import zlib
+from typing import Any, Dict, Iterator, List, Tuple
+
+from utils.logging_config import get_logger
+logger = get_logger(__name__)
+
+_RECORD_HEADER = struct.Struct("<III")
+_ARCHIVE_SUFFIX = re.compile(r"\.(\d{8})$")
+
+
+class WriteAheadLog:
+    def __init__(self, path: str, fsync: bool = False):
+        """
+        初始化预写日志
+        :param path: 日志文件路径，轮转中的旧日志为 path + ".old"
+        :param fsync: 每次追加后是否fsync
+        """
+        self.path = path
+        self.rotated_path = path + ".old"
+        self.fsync = fsync
+        self._file = None
+        self.size = 0
+        self._open()
+
+    def _open(self):
+        """以追加模式打开日志文件"""
+        log_dir = os.path.dirname(self.path)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        self._file = open(self.path, "ab")
+        self.size = self._file.tell()
+
+    def append(self, header: Dict[str, Any], payload: bytes = b"") -> int:
+        """追加一条记录，返回写入的字节数"""
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        checksum = zlib.crc32(payload, zlib.crc32(header_bytes))
+        record = _RECORD_HEADER.pack(len(header_bytes), len(payload), checksum) + header_bytes + payload
+        self._file.write(record)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.size += len(record)
+        return len(record)
+
+    def rotate(self):
+        """
+        轮转日志：当前日志移到 .old，新写入进入空日志
+        若上一次轮转的 .old 尚未被清理（快照失败），则把当前日志接到其后
+        """
+        self._file.close()
+        if os.path.exists(self.rotated_path):
+            with open(self.rotated_path, "ab") as dst, open(self.path, "rb") as src:
+                while True:
+                    chunk = src.read(1 << 20)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+            os.remove(self.path)
+        elif os.path.exists(self.path):
+            os.replace(self.path, self.rotated_path)
+        self._open()
+
+    def archive(self, generation: int):
+        """快照代提交后，把已轮转的旧日志归档到该代名下（其中的记录已全部包含在该代快照中）"""
+        if os.path.exists(self.rotated_path):
+            os.replace(self.rotated_path, f"{self.path}.{generation:08d}")
+
+    def _archives(self) -> List[Tuple[int, str]]:
+        """按代号排序的归档日志 (代号, 路径)"""
+        archives = []
+        for path in glob.glob(glob.escape(self.path) + ".[0-9]*"):
+            match = _ARCHIVE_SUFFIX.search(path)
+            if match:
+                archives.append((int(match.group(1)), path))
+        return sorted(archives)
+
+    def prune_archives(self, generation: int):
+        """删除代号不大于 generation 的归档日志，这些记录已包含在仍保留的最旧快照中"""
+        for archived, path in self._archives():
+            if archived <= generation:
+                os.remove(path)
+
+    def replay(self) -> Iterator[Tuple[Dict[str, Any], bytes]]:
+        """按写入顺序回放归档日志、旧日志和当前日志中的所有完整记录（调用方按日志序号跳过已快照的记录）"""
+        for path in [path for _, path in self._archives()] + [self.rotated_path, self.path]:
+            if os.path.exists(path):
+                yield from self._read_records(path)
+
+    def _read_records(self, path: str) -> Iterator[Tuple[Dict[str, Any], bytes]]:
+        """读取单个日志文件，遇到不完整或校验失败的尾部记录时停止"""
+        with open(path, "rb") as f:
+            while True:
+                offset = f.tell()
+                prefix = f.read(_RECORD_HEADER.size)
+                if not prefix:
+                    return
+                if len(prefix) < _RECORD_HEADER.size:
+                    self._truncate_tail(path, offset)
+                    return
+                header_len, payload_len, checksum = _RECORD_HEADER.unpack(prefix)
+                header_bytes = f.read(header_len)
+                payload = f.read(payload_len)
+                if (len(header_bytes) < header_len or len(payload) < payload_len
+                        or zlib.crc32(payload, zlib.crc32(header_bytes)) != checksum):
+                    self._truncate_tail(path, offset)
+                    return
+                yield json.loads(header_bytes.decode("utf-8")), payload
+
+    def _truncate_tail(self, path: str, offset: int):
+        """截掉崩溃时写了一半的尾部记录"""
+        logger.warning(f"Truncating torn WAL record in {path} at offset {offset}")
+        if path == self.path:
+            self._file.close()
+        with open(path, "r+b") as f:
+            f.truncate(offset)
+        if path == self.path:
+            self._open()
+
+    def close(self):
+        """关闭日志文件"""
+        if self._file and not self._file.closed:
+            self._file.close()
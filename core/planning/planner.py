@@ -4,6 +4,7 @@ import json
 import asyncio
 
 from models.llm_inference import LLMInference
+from utils.schema import MemoryRecord
 from utils.logging_config import get_logger
 
 logger = get_logger(__name__)
@@ -20,7 +21,7 @@ class Planner:
     async def generate_plan(
         self, 
         query: str, 
-        context_chunks: List[Dict[str, Any]]
+        context_chunks: List[MemoryRecord]
     ) -> List[str]:
         """
         生成执行计划
@@ -52,7 +53,7 @@ class Planner:
     def _construct_planning_prompt(
         self, 
         query: str, 
-        context_chunks: List[Dict[str, Any]]
+        context_chunks: List[MemoryRecord]
     ) -> str:
         """构造规划 prompt"""
         
@@ -61,8 +62,8 @@ class Planner:
         if context_chunks:
             memory_context = "你当前拥有如下背景知识：\n"
             for i, chunk in enumerate(context_chunks, 1):
-                content = chunk.get("content", "")
-                score = chunk.get("relevance_score", 0.0)
+                content = chunk.content
+                score = chunk.relevance_score or 0.0
                 
                 memory_context += f"{i}. {content}\n"
                 memory_context += f"   相关性评分：{score:.2f}\n\n"
@@ -121,7 +122,7 @@ class Planner:
     async def generate_detailed_plan(
         self, 
         query: str, 
-        context_chunks: List[Dict[str, Any]]
+        context_chunks: List[MemoryRecord]
     ) -> Dict[str, Any]:
         """
         生成详细计划（包含推理过程）
@@ -156,7 +157,7 @@ class Planner:
     def _construct_detailed_planning_prompt(
         self, 
         query: str, 
-        context_chunks: List[Dict[str, Any]]
+        context_chunks: List[MemoryRecord]
     ) -> str:
         """构造详细规划 prompt"""
         
@@ -164,8 +165,8 @@ class Planner:
         if context_chunks:
             memory_context = "背景知识：\n"
             for i, chunk in enumerate(context_chunks, 1):
-                content = chunk.get("content", "")
-                score = chunk.get("relevance_score", 0.0)
+                content = chunk.content
+                score = chunk.relevance_score or 0.0
                 
                 memory_context += f"{i}. {content}\n"
                 memory_context += f"   相关性：{score:.2f}\n\n"
@@ -6,6 +6,7 @@ from datetime import datetime
 
 from models.llm_inference import LLMInference
 from models.tool_wrappers import ToolWrapper
+from utils.schema import MemoryRecord
 from utils.logging_config import get_logger
 
 logger = get_logger(__name__)
@@ -26,7 +27,7 @@ class ReactAgent:
         self, 
         query: str, 
         plan_steps: List[str], 
-        context_chunks: List[Dict[str, Any]]
+        context_chunks: List[MemoryRecord]
     ) -> Dict[str, Any]:
         """
         执行计划
@@ -295,7 +296,7 @@ class ReactAgent:
         self, 
         query: str, 
         intermediate_results: List[Dict[str, Any]],
-        context_chunks: List[Dict[str, Any]]
+        context_chunks: List[MemoryRecord]
     ) -> str:
         """生成最终答案"""
         prompt = f"""
@@ -314,14 +315,14 @@ class ReactAgent:
         except Exception as e:
             return f"基于执行过程生成答案时出错：{str(e)}"
     
-    def _format_context(self, context_chunks: List[Dict[str, Any]]) -> str:
+    def _format_context(self, context_chunks: List[MemoryRecord]) -> str:
         """格式化背景知识"""
         if not context_chunks:
             return "无相关背景知识"
         
         context = "背景知识：\n"
         for i, chunk in enumerate(context_chunks, 1):
-            content = chunk.get("content", "")
+            content = chunk.content
             context += f"{i}. {content}\n"
         
         return context
@@ -0,0 +1,145 @@
+"""
+嵌入向量缓存
+两级缓存：进程内有容量上限的 LRU（float32 数组）+ 磁盘上的 SQLite 持久缓存
+键为（模型名, 文本）的内容哈希，向量以 float32 字节保存；SQLite 使用 WAL 模式，多个工作进程可同时读写同一个缓存文件，
+重启后同样的告警文本不会再次请求嵌入接口
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from app.config import Config
+from utils.logging_config import get_logger
+from utils.helpers import SharedInstance
+logger = get_logger(__name__)
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    vector BLOB NOT NULL
+)
+"""
+# 键列表以 JSON 数组作为单个参数传入，任意数量的键共用同一条预编译语句
+_SELECT_MANY = "SELECT key, vector FROM embeddings WHERE key IN (SELECT value FROM json_each(?))"
+_UPSERT = "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)"
+
+# 进程内共享的缓存实例
+_shared_cache = SharedInstance(lambda: EmbeddingCache())
+
+
+def get_embedding_cache() -> "EmbeddingCache":
+    """获取进程内共享的嵌入缓存"""
+    return _shared_cache.get()
+
+
+def content_key(model_name: str, text: str) -> str:
+    """缓存键：模型名和文本的 SHA1，不同模型的向量互不混用"""
+    return hashlib.sha1(f"{model_name}\n{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, db_path: str = None, capacity: int = None):
+        """
+        :param db_path: SQLite 缓存文件路径，默认 Config.EMBEDDING_CACHE_PATH
+        :param capacity: 进程内 LRU 最多保留的向量数，默认 Config.EMBEDDING_CACHE_SIZE
+        """
+        self.db_path = db_path or Config.EMBEDDING_CACHE_PATH
+        self.capacity = max(1, capacity or Config.EMBEDDING_CACHE_SIZE)
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lru_lock = threading.Lock()
+        self._local = threading.local()  # 每个线程一个连接
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """当前线程的连接，首次使用时创建（缓存文件在首次使用时才建立）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(_CREATE_TABLE)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """
+        批量读取：先查 LRU，未命中的键一次查询磁盘缓存，磁盘命中的向量放入 LRU
+        :return: {键: float32 向量}，未缓存的键不出现在结果中
+        """
+        found = {}
+        missing = []
+        with self._lru_lock:
+            for key in keys:
+                vector = self._lru.get(key)
+                if vector is None:
+                    missing.append(key)
+                else:
+                    self._lru.move_to_end(key)
+                    found[key] = vector
+        if missing:
+            try:
+                rows = self._connection().execute(_SELECT_MANY, (json.dumps(missing),)).fetchall()
+                loaded = {key: np.frombuffer(blob, dtype=np.float32) for key, blob in rows}
+                self._remember(loaded.items())
+                found.update(loaded)
+            except Exception as e:
+                logger.error(f"Failed to read embedding cache: {e}")
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key: str):
+        """读取单个向量，未缓存时返回 None"""
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: List[Tuple[str, np.ndarray]]):
+        """批量写入 LRU 和磁盘缓存（一个事务）"""
+        items = [(key, np.asarray(vector, dtype=np.float32)) for key, vector in items]
+        if not items:
+            return
+        self._remember(items)
+        try:
+            with self._connection() as conn:
+                conn.executemany(_UPSERT, [(key, vector.tobytes()) for key, vector in items])
+        except Exception as e:
+            logger.error(f"Failed to write embedding cache: {e}")
+            import traceback
+            logger.error(f"Embedding cache write traceback: {traceback.format_exc()}")
+
+    def put(self, key: str, vector: np.ndarray):
+        """写入单个向量"""
+        self.put_many([(key, vector)])
+
+    def _remember(self, items):
+        """放入 LRU，超出容量时淘汰最久未使用的向量"""
+        with self._lru_lock:
+            for key, vector in items:
+                self._lru[key] = vector
+                self._lru.move_to_end(key)
+            while len(self._lru) > self.capacity:
+                self._lru.popitem(last=False)
+
+    def close(self):
+        """关闭所有线程的连接"""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
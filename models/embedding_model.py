@@ -1,91 +1,168 @@
 # 本地模型或调用 OpenAI/HuggingFace 等接口
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import numpy as np
 import hashlib
 import json
 import openai
 from app.config import Config
+from models.embedding_cache import EmbeddingCache, content_key, get_embedding_cache
+from models.local_embedder import get_local_embedder
 
 class EmbeddingModel:
-    def __init__(self):
+    def __init__(self, cache: EmbeddingCache = None):
+        """
+        :param cache: 嵌入缓存，默认使用进程内共享的 LRU + 磁盘缓存（只缓存嵌入接口返回的向量）
+        """
         self.api_key = Config.OPENAI_API_KEY
         self.model_name = "text-embedding-ada-002"  # OpenAI embedding model
         self.client = None
-        self.cache = {}  # 简单的内存缓存
+        self.sync_client = None
+        self.cache = cache if cache is not None else get_embedding_cache()
+        self.batch_size = Config.EMBEDDING_BATCH_SIZE  # 每个请求最多的文本数
+        self.batch_tokens = Config.EMBEDDING_BATCH_TOKENS  # 每个请求最多的token数（估算）
+        self.concurrency = max(1, Config.EMBEDDING_CONCURRENCY)  # 同时进行的请求数
         
         if self.api_key:
             try:
                 self.client = openai.AsyncOpenAI(api_key=self.api_key)
+                self.sync_client = openai.OpenAI(api_key=self.api_key)
             except Exception as e:
                 print(f"Failed to initialize OpenAI client for embeddings: {e}")
+        
+        # 嵌入引擎：local 或 auto 且没有 API key 时使用本地 n-gram 哈希嵌入（写入向量库后不要再切换引擎）
+        self.engine = Config.EMBEDDING_ENGINE
+        self.local_embedder = None
+        if self.engine == "local" or (self.engine == "auto" and not self.client):
+            self.local_embedder = get_local_embedder()
     
     def embed_text(self, text: str) -> List[float]:
         """文本嵌入"""
-        try:
-            # 检查缓存
-            cache_key = self._get_cache_key(text)
-            if cache_key in self.cache:
-                return self.cache[cache_key]
-            
-            # 如果没有 OpenAI 客户端，使用简单的哈希嵌入
-            if not self.client:
-                return self._simple_hash_embedding(text)
-            
-            # 使用 OpenAI embedding
-            return self._openai_embedding(text)
-            
-        except Exception as e:
-            print(f"Embedding failed: {e}")
-            return self._simple_hash_embedding(text)
+        return self.embed_batch([text])[0]
     
     async def embed_text_async(self, text: str) -> List[float]:
         """异步文本嵌入"""
-        try:
-            # 检查缓存
-            cache_key = self._get_cache_key(text)
-            if cache_key in self.cache:
-                return self.cache[cache_key]
-            
-            # 如果没有 OpenAI 客户端，使用简单的哈希嵌入
-            if not self.client:
-                return self._simple_hash_embedding(text)
-            
-            # 使用 OpenAI embedding
-            return await self._openai_embedding_async(text)
-            
-        except Exception as e:
-            print(f"Async embedding failed: {e}")
-            return self._simple_hash_embedding(text)
+        return (await self.embed_batch_async([text]))[0]
     
-    def embed_batch(self, texts: List[str]) -> List[List[float]]:
-        """批量嵌入"""
+    def embed_batch(self, texts: List[str], strict: bool = False) -> List[List[float]]:
+        """
+        批量嵌入：已缓存的文本直接返回，其余文本去重后按条数和token预算打包为若干请求，
+        最多 EMBEDDING_CONCURRENCY 个请求并发，结果按输入顺序返回；本地引擎一次批量计算
+        :param strict: 为 True 时任一请求失败即抛出 RuntimeError，不用哈希嵌入代替（批量导入据此不推进断点）
+        """
         try:
-            embeddings = []
-            for text in texts:
-                embedding = self.embed_text(text)
-                embeddings.append(embedding)
+            if self.local_embedder:
+                return self.local_embedder.embed(texts).tolist()
+            embeddings, positions, batches = self._plan_batches(texts)
+            if len(batches) == 1:
+                # 单个请求（常见于单条查询）直接在当前线程发出，不为它创建线程池
+                results = [self._embed_request(batches[0])]
+            elif batches:
+                with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as pool:
+                    results = list(pool.map(self._embed_request, batches))
+            else:
+                results = []
+            for batch, vectors in zip(batches, results):
+                if vectors is None and strict:
+                    raise RuntimeError(f"Embedding request failed for a batch of {len(batch)} texts")
+                self._fill_results(embeddings, positions, batch, vectors)
             return embeddings
             
         except Exception as e:
+            if strict:
+                raise
             print(f"Batch embedding failed: {e}")
             return [self._simple_hash_embedding(text) for text in texts]
     
     async def embed_batch_async(self, texts: List[str]) -> List[List[float]]:
-        """异步批量嵌入"""
+        """异步批量嵌入，打包和并发规则同 embed_batch"""
         try:
-            embeddings = []
-            for text in texts:
-                embedding = await self.embed_text_async(text)
-                embeddings.append(embedding)
+            if self.local_embedder:
+                return self.local_embedder.embed(texts).tolist()
+            embeddings, positions, batches = self._plan_batches(texts)
+            if batches:
+                semaphore = asyncio.Semaphore(self.concurrency)
+                
+                async def request(batch: List[str]) -> Optional[List[List[float]]]:
+                    async with semaphore:
+                        return await self._embed_request_async(batch)
+                
+                results = await asyncio.gather(*(request(batch) for batch in batches))
+                for batch, vectors in zip(batches, results):
+                    self._fill_results(embeddings, positions, batch, vectors)
             return embeddings
             
         except Exception as e:
             print(f"Async batch embedding failed: {e}")
             return [self._simple_hash_embedding(text) for text in texts]
     
+    def _plan_batches(
+        self,
+        texts: List[str]
+    ) -> Tuple[List[Optional[List[float]]], Dict[str, List[int]], List[List[str]]]:
+        """
+        查缓存并为未缓存的文本（去重后）分批
+        :return: (与 texts 等长的结果列表，已缓存的位置已填好, 未缓存文本 -> 在输入中的位置, 待请求的文本批次)
+        """
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        pending: Dict[str, List[int]] = {}
+        for i, text in enumerate(texts):
+            pending.setdefault(text, []).append(i)
+        
+        # 只有接口返回的向量才会缓存，没有客户端时不查缓存
+        if self.client or self.sync_client:
+            cached = self.cache.get_many([self._get_cache_key(text) for text in pending])
+            for text in list(pending):
+                vector = cached.get(self._get_cache_key(text))
+                if vector is not None:
+                    vector = vector.tolist()
+                    for i in pending.pop(text):
+                        embeddings[i] = vector
+        
+        # 按条数和估算的token数打包：任一上限达到即开始新的一批
+        batches, batch, batch_tokens = [], [], 0
+        for text in pending:
+            tokens = self._estimate_tokens(text)
+            if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > self.batch_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return embeddings, pending, batches
+    
+    def _fill_results(
+        self,
+        embeddings: List[Optional[List[float]]],
+        positions: Dict[str, List[int]],
+        batch: List[str],
+        vectors: Optional[List[List[float]]]
+    ):
+        """
+        把一批结果填入输入中所有等于这些文本的位置（同一文本在输入中可能出现多次）
+        请求成功的结果写入缓存；没有客户端或请求失败时该批使用哈希嵌入，不缓存，下次仍会重试
+        """
+        if vectors is None:
+            vectors = [self._simple_hash_embedding(text) for text in batch]
+        else:
+            # 统一为 float32 精度，首次请求和命中缓存时返回完全相同的向量
+            vectors = np.asarray(vectors, dtype=np.float32)
+            self.cache.put_many([(self._get_cache_key(text), vector) for text, vector in zip(batch, vectors)])
+            vectors = vectors.tolist()
+        for text, vector in zip(batch, vectors):
+            for i in positions[text]:
+                embeddings[i] = vector
+    
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """不依赖分词器的保守token估算：UTF-8 字节数的三分之一（英文约 4 字节/token，中文约 3 字节/token）"""
+        return len(text.encode('utf-8')) // 3 + 1
+    
     def _get_cache_key(self, text: str) -> str:
-        """生成缓存键"""
-        return hashlib.md5(text.encode('utf-8')).hexdigest()
+        """生成缓存键（模型名和文本的内容哈希）"""
+        return content_key(self.model_name, text)
     
     def _simple_hash_embedding(self, text: str) -> List[float]:
         """简单的哈希嵌入（备用方案）"""
@@ -106,45 +183,36 @@ class EmbeddingModel:
         
         return embedding[:1536]
     
-    def _openai_embedding(self, text: str) -> List[float]:
-        """使用 OpenAI embedding（同步版本）"""
+    def _embed_request(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """一次请求嵌入一批文本（同步版本），没有客户端或请求失败时返回 None"""
+        if not self.sync_client:
+            return None
         try:
-            response = self.client.embeddings.create(
+            response = self.sync_client.embeddings.create(
                 model=self.model_name,
-                input=text
+                input=texts
             )
-            
-            embedding = response.data[0].embedding
-            
-            # 缓存结果
-            cache_key = self._get_cache_key(text)
-            self.cache[cache_key] = embedding
-            
-            return embedding
+            # 按 index 还原顺序
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
             
         except Exception as e:
             print(f"OpenAI embedding failed: {e}")
-            return self._simple_hash_embedding(text)
+            return None
     
-    async def _openai_embedding_async(self, text: str) -> List[float]:
-        """使用 OpenAI embedding（异步版本）"""
+    async def _embed_request_async(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """一次请求嵌入一批文本（异步版本），没有客户端或请求失败时返回 None"""
+        if not self.client:
+            return None
         try:
             response = await self.client.embeddings.create(
                 model=self.model_name,
-                input=text
+                input=texts
             )
-            
-            embedding = response.data[0].embedding
-            
-            # 缓存结果
-            cache_key = self._get_cache_key(text)
-            self.cache[cache_key] = embedding
-            
-            return embedding
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
             
         except Exception as e:
             print(f"OpenAI async embedding failed: {e}")
-            return self._simple_hash_embedding(text)
+            return None
     
     def cosine_similarity(self, embedding1: List[float], embedding2: List[float]) -> float:
         """计算余弦相似度"""
@@ -170,16 +238,22 @@ class EmbeddingModel:
         query_embedding: List[float], 
         candidate_embeddings: List[List[float]]
     ) -> List[tuple]:
-        """找到最相似的嵌入"""
+        """找到最相似的嵌入（一次矩阵运算计算所有候选的余弦相似度）"""
         try:
-            similarities = []
-            for i, candidate in enumerate(candidate_embeddings):
-                similarity = self.cosine_similarity(query_embedding, candidate)
-                similarities.append((i, similarity))
+            if len(candidate_embeddings) == 0:
+                return []
+            query = np.asarray(query_embedding, dtype=np.float32)
+            candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+            
+            norms = np.linalg.norm(candidates, axis=1) * np.linalg.norm(query)
+            similarities = np.divide(
+                candidates @ query, norms,
+                out=np.zeros(len(candidates), dtype=np.float32), where=norms != 0
+            )
             
             # 按相似度排序
-            similarities.sort(key=lambda x: x[1], reverse=True)
-            return similarities
+            order = np.argsort(-similarities, kind="stable")
+            return [(int(i), float(similarities[i])) for i in order]
             
         except Exception as e:
             print(f"Similarity search failed: {e}")
@@ -0,0 +1,154 @@
+"""
+本地离线嵌入（不依赖外部服务和模型文件）
+1. 字符 n-gram（中文按字，英文按字母）和词 n-gram 的特征哈希，整批文本拼成一个码点数组后用多项式滚动哈希一次算出
+2. 稀疏随机投影：每个特征按哈希映射到 _PROJECTIONS 个输出维度，符号随机（±1），等价于用稀疏随机矩阵
+   把高维的 n-gram 计数向量投影到 dimension 维，不需要保存投影矩阵
+3. 按行 L2 归一化
+全部为批量 NumPy 运算，隔离网络环境下也能得到有语义区分度的向量
+"""
+from typing import List
+
+import numpy as np
+
+from app.config import Config
+from utils.helpers import SharedInstance
+
+# 字符 n-gram 和词 n-gram 的长度
+_CHAR_NGRAMS = (2, 3, 4)
+_WORD_NGRAMS = (1, 2)
+# 每个特征投影到的输出维度数
+_PROJECTIONS = 2
+# 词特征相对字符特征的权重
+_WORD_WEIGHT = 2.0
+# 多项式哈希的底数（奇数，模 2^64 可逆）
+_BASE = np.uint64(0x100000001B3)
+_MASK64 = (1 << 64) - 1
+# 每次处理的文本数，限制中间数组的内存占用
+_CHUNK_SIZE = 1024
+# 文本之间的分隔符（码点 0）
+_SEPARATOR = "\x00"
+
+# 进程内共享的本地嵌入器
+_shared_embedder = SharedInstance(lambda: LocalEmbedder())
+
+
+def get_local_embedder() -> "LocalEmbedder":
+    """获取进程内共享的本地嵌入器（无状态，可多线程共用）"""
+    return _shared_embedder.get()
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """splitmix64 终混函数，把相近的哈希值打散到整个 64 位空间"""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def _is_word_char(codepoints: np.ndarray) -> np.ndarray:
+    """词字符：ASCII 字母数字和非 ASCII 字符（中日韩标点和全角符号除外）"""
+    ascii_alnum = (
+        ((codepoints >= 48) & (codepoints <= 57))
+        | ((codepoints >= 97) & (codepoints <= 122))
+        | ((codepoints >= 65) & (codepoints <= 90))
+        | (codepoints == 95)
+    )
+    cjk_punct = ((codepoints >= 0x3000) & (codepoints <= 0x303F)) | ((codepoints >= 0xFF00) & (codepoints <= 0xFF20))
+    return ascii_alnum | ((codepoints > 0x7F) & ~cjk_punct)
+
+
+class LocalEmbedder:
+    def __init__(self, dimension: int = None, seed: int = 0):
+        """
+        :param dimension: 输出向量维度，默认 Config.LOCAL_EMBEDDING_DIMENSION
+        :param seed: 投影的随机种子，同一种子下向量稳定可复现（写入向量库后不要更换）
+        """
+        self.dimension = dimension or Config.LOCAL_EMBEDDING_DIMENSION
+        self._salts = _mix(np.arange(1, _PROJECTIONS + 1, dtype=np.uint64) + np.uint64(seed * 0x9E3779B97F4A7C15 & _MASK64))
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """批量嵌入，返回 (len(texts), dimension) 的 float32 矩阵，每行 L2 归一化（空文本为零向量）"""
+        if len(texts) <= _CHUNK_SIZE:
+            return self._embed_chunk(texts)
+        return np.vstack([self._embed_chunk(texts[i:i + _CHUNK_SIZE]) for i in range(0, len(texts), _CHUNK_SIZE)])
+
+    def _embed_chunk(self, texts: List[str]) -> np.ndarray:
+        """嵌入一块文本：整块拼接为一个码点数组，所有 n-gram 的哈希一次算出"""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        # 文本自身的 NUL 换成空格，否则会被当作分隔符，拆出多余的文本
+        joined = _SEPARATOR.join(text.lower().replace(_SEPARATOR, " ") for text in texts) + _SEPARATOR
+        codepoints = np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        n = len(codepoints)
+
+        # 前缀哈希 P[i] = sum_{j<i} c[j] * B^j，子串 [s, e) 的哈希为 (P[e] - P[s]) * B^-s（模 2^64，与位置无关）
+        powers = np.empty(n, dtype=np.uint64)
+        powers[0] = 1
+        np.cumprod(np.full(n - 1, _BASE, dtype=np.uint64), out=powers[1:])
+        inverse_base = np.uint64(pow(int(_BASE), -1, 1 << 64))
+        inverse_powers = np.empty(n, dtype=np.uint64)
+        inverse_powers[0] = 1
+        np.cumprod(np.full(n - 1, inverse_base, dtype=np.uint64), out=inverse_powers[1:])
+        prefix = np.zeros(n + 1, dtype=np.uint64)
+        np.cumsum(codepoints * powers, out=prefix[1:])
+
+        def substring_hash(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+            return (prefix[ends] - prefix[starts]) * inverse_powers[starts]
+
+        separators = codepoints == 0
+        separators_before = np.concatenate(([0], np.cumsum(separators)))
+        doc_ids = separators_before[:-1]
+
+        feature_hashes, feature_docs, feature_weights = [], [], []
+
+        # 字符 n-gram：窗口内不含分隔符
+        for size in _CHAR_NGRAMS:
+            if n < size:
+                continue
+            starts = np.arange(n - size + 1)
+            valid = separators_before[starts + size] == separators_before[starts]
+            starts = starts[valid]
+            feature_hashes.append(substring_hash(starts, starts + size) + np.uint64(size))
+            feature_docs.append(doc_ids[starts])
+            feature_weights.append(np.ones(len(starts), dtype=np.float32))
+
+        # 词 n-gram：连续的词字符为一个词，二元组只在同一文本内组合
+        word_chars = _is_word_char(codepoints) & ~separators
+        edges = np.diff(np.concatenate(([False], word_chars, [False])).astype(np.int8))
+        word_starts = np.flatnonzero(edges == 1)
+        word_ends = np.flatnonzero(edges == -1)
+        if len(word_starts):
+            word_hashes = _mix(substring_hash(word_starts, word_ends))
+            word_docs = doc_ids[word_starts]
+            for size in _WORD_NGRAMS:
+                if len(word_hashes) < size:
+                    continue
+                count = len(word_hashes) - size + 1
+                hashes = word_hashes[:count].copy()
+                valid = np.ones(count, dtype=bool)
+                for offset in range(1, size):
+                    hashes = _mix(hashes * _BASE + word_hashes[offset:offset + count])
+                    valid &= word_docs[offset:offset + count] == word_docs[:count]
+                feature_hashes.append(hashes[valid] + np.uint64(0x1000 + size))
+                feature_docs.append(word_docs[:count][valid])
+                feature_weights.append(np.full(int(valid.sum()), _WORD_WEIGHT, dtype=np.float32))
+
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        if feature_hashes:
+            hashes = np.concatenate(feature_hashes)
+            docs = np.concatenate(feature_docs).astype(np.int64)
+            weights = np.concatenate(feature_weights)
+            # 稀疏随机投影：每个特征落到 _PROJECTIONS 个维度，符号由哈希的最高位决定
+            for salt in self._salts:
+                mixed = _mix(hashes ^ salt)
+                columns = (mixed % np.uint64(self.dimension)).astype(np.int64)
+                signs = np.where(mixed >> np.uint64(63), -1.0, 1.0).astype(np.float32)
+                vectors += np.bincount(
+                    docs * self.dimension + columns, weights=signs * weights, minlength=vectors.size
+                ).reshape(vectors.shape).astype(np.float32)
+
+        # 次线性缩放后归一化，削弱高频 n-gram 的影响
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
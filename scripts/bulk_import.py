@@ -0,0 +1,177 @@
+"""
+历史故障/运行手册批量导入工具
+流式读取 JSONL 或 CSV 文件，按批向量化（线程池并发多个批次），每批一次性写入向量库、内容库和情景记忆日志
+每批写入后更新断点文件，中断后重新执行同一命令即从断点继续；运行中按批输出吞吐量
+不经过 /api/v1/train 的逐条 LLM 打分，适合一次性加载大量历史文档
+
+用法：
+    python scripts/bulk_import.py data/postmortems.jsonl --type postmortem
+    python scripts/bulk_import.py runbooks.csv --content-field body --id-field runbook_id --workers 8
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.helpers import chunk_list
+
+# 这些字段映射到记忆的同名字段，其余字段进入 metadata
+_RECORD_FIELDS = ("type", "user_id", "tags", "score", "timestamp")
+
+
+def read_source(path: str, fmt: str = None) -> Iterator[Dict[str, Any]]:
+    """逐条读取 JSONL 或 CSV 文件（按扩展名判断格式），不一次性载入整个文件"""
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def build_memory(raw: Dict[str, Any], source: str, number: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """源记录转换为记忆条目；没有ID字段时由文件路径和记录序号生成确定的ID，重复导入不会产生新记忆"""
+    memory_id = raw.get(args.id_field) or str(uuid.uuid5(uuid.NAMESPACE_URL, f"{source}:{number}"))
+    metadata = dict(raw.get("metadata") or {})
+    metadata.update({
+        key: value for key, value in raw.items()
+        if key not in (args.id_field, args.content_field, "metadata") and key not in _RECORD_FIELDS
+    })
+    metadata["source"] = source
+    tags = raw.get("tags") or []
+    if isinstance(tags, str):
+        tags = [tag.strip() for tag in tags.split(",") if tag.strip()]
+    return {
+        "id": str(memory_id),
+        "content": str(raw.get(args.content_field) or ""),
+        "type": raw.get("type") or args.type,
+        "user_id": raw.get("user_id") or args.user_id,
+        "tags": tags,
+        "score": float(raw["score"]) if raw.get("score") not in (None, "") else None,
+        "metadata": metadata,
+        "timestamp": raw.get("timestamp") or datetime.now().isoformat(),
+        "storage_type": "semantic",
+    }
+
+
+def load_checkpoint(path: str) -> int:
+    """已导入的记录数，没有断点文件时为 0"""
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("records_done", 0)
+
+
+def save_checkpoint(path: str, source: str, records_done: int):
+    """原子地更新断点文件"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"source": source, "records_done": records_done, "updated_at": datetime.now().isoformat()}, f)
+    os.replace(tmp_path, path)
+
+
+def write_batch(memories: List[Dict[str, Any]], embeddings: List[List[float]]) -> int:
+    """
+    一批记忆一次性写入三个存储；已在向量库中的ID（断点前已写入向量但未更新断点）复用原有行号，不重复写向量
+    :return: 写入的记忆数
+    """
+    from core.memory.content_store import get_content_store
+    from core.memory.episodic_log import get_episodic_log
+    from core.memory.faiss_vector_store import get_vector_store
+
+    vector_store = get_vector_store()
+    rows = vector_store.get_rows([memory["id"] for memory in memories])
+    missing = [i for i, memory in enumerate(memories) if memory["id"] not in rows and len(embeddings[i])]
+    if missing:
+        added = vector_store.add_vectors(
+            [memories[i]["id"] for i in missing], [embeddings[i] for i in missing], [memories[i] for i in missing]
+        )
+        if len(added) != len(missing):
+            raise RuntimeError("Failed to add vectors to FAISS index")
+        rows.update(zip([memories[i]["id"] for i in missing], added))
+    for memory in memories:
+        memory["embedding_row"] = rows.get(memory["id"])
+
+    if get_content_store().put_many(memories) != len(memories):
+        raise RuntimeError("Failed to write memories to content store")
+    get_episodic_log().append_many(memories)
+    return len(memories)
+
+
+def bulk_import(path: str, args: argparse.Namespace) -> int:
+    """
+    导入单个文件：主线程读取并组批，线程池并发向量化，按读取顺序逐批写入，断点之前的记录保证已全部落盘
+    嵌入请求失败时抛出异常且不推进断点（不写入哈希嵌入），重新执行即从失败的批次重试
+    :return: 本次导入的记忆数
+    """
+    from models.embedding_model import EmbeddingModel
+
+    source = os.path.abspath(path)
+    checkpoint_path = args.checkpoint or source + ".import-state.json"
+    done = 0 if args.restart else load_checkpoint(checkpoint_path)
+    if done:
+        print(f"Resuming {path} after {done} records")
+
+    embedding_model = EmbeddingModel()
+    numbered = ((number, raw) for number, raw in enumerate(read_source(path, args.format)) if number >= done)
+
+    started = time.time()
+    imported = 0
+    pending = deque()
+
+    def commit():
+        """等待最早提交的批次向量化完成，写入存储并推进断点"""
+        nonlocal imported
+        end, memories, future = pending.popleft()
+        if memories:
+            imported += write_batch(memories, future.result())
+        save_checkpoint(checkpoint_path, source, end)
+        elapsed = max(time.time() - started, 1e-9)
+        print(f"{end} records processed, {imported} imported, {imported / elapsed:.1f} records/s")
+
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="bulk-embed") as pool:
+        for batch in chunk_list(numbered, args.batch_size):
+            memories = [build_memory(raw, source, number, args) for number, raw in batch]
+            memories = [memory for memory in memories if memory["content"]]
+            future = pool.submit(embedding_model.embed_batch, [memory["content"] for memory in memories], strict=True)
+            pending.append((batch[-1][0] + 1, memories, future))
+            # 在途批次数不超过线程数的两倍，内存占用与文件大小无关
+            while len(pending) >= 2 * args.workers:
+                commit()
+        while pending:
+            commit()
+
+    elapsed = max(time.time() - started, 1e-9)
+    print(f"Imported {imported} memories from {path} in {elapsed:.1f}s ({imported / elapsed:.1f} records/s)")
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量导入历史故障复盘、运行手册等文档到记忆库")
+    parser.add_argument("paths", nargs="+", help="JSONL 或 CSV 文件")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="文件格式，默认按扩展名判断")
+    parser.add_argument("--content-field", default="content", help="作为记忆内容的字段")
+    parser.add_argument("--id-field", default="id", help="作为记忆ID的字段，缺失时按文件路径和序号生成")
+    parser.add_argument("--type", default="incident", help="记录中没有 type 字段时使用的记忆类型")
+    parser.add_argument("--user-id", default=None, help="记录中没有 user_id 字段时使用的用户ID（默认不设归属，所有用户可见）")
+    parser.add_argument("--batch-size", type=int, default=256, help="每批向量化和写入的记录数")
+    parser.add_argument("--workers", type=int, default=4, help="并发向量化的线程数")
+    parser.add_argument("--checkpoint", help="断点文件路径，默认 <文件>.import-state.json（仅导入单个文件时使用）")
+    parser.add_argument("--restart", action="store_true", help="忽略断点，从头导入")
+    args = parser.parse_args()
+    if args.checkpoint and len(args.paths) > 1:
+        parser.error("--checkpoint can only be used with a single input file")
+    for path in args.paths:
+        bulk_import(path, args)
@@ -0,0 +1,70 @@
+"""
+情景记忆日志压缩工具
+1. 把旧版 episodic_memory.json（{"memories": [...]}）中的记忆导入 JSONL 日志（已存在的ID跳过，可重复执行）
+   记录中内嵌的 embedding 列表移到FAISS原始向量文件，记录只保留行号 embedding_row，同时写入内容库供检索取回
+2. 重写日志，只保留每条记忆的最新版本并清理删除标记，同时重建偏移索引
+"""
+import argparse
+import os
+import sys
+from typing import Any, Dict, List
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import Config
+from core.memory.episodic_log import EpisodicLog
+
+
+def move_embeddings_to_vector_file(memories: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """把内嵌的 embedding 列表换成向量文件行号，尚未写入向量库的记忆批量写入，所有记忆写入内容库"""
+    from core.memory.content_store import get_content_store
+    from core.memory.faiss_vector_store import get_vector_store
+
+    vector_store = get_vector_store()
+    embedded = [memory for memory in memories if memory.get("embedding")]
+    rows = vector_store.get_rows([memory["id"] for memory in embedded])
+    missing = [memory for memory in embedded if memory["id"] not in rows]
+    # 维度与向量库不一致的向量（例如换过嵌入模型）跳过，只导入记录本身，不让整批写入失败
+    mismatched = [memory["id"] for memory in missing if len(memory["embedding"]) != vector_store.dimension]
+    if mismatched:
+        print(
+            f"Skipped {len(mismatched)} embeddings with dimension != {vector_store.dimension}: "
+            f"{', '.join(mismatched[:10])}{' ...' if len(mismatched) > 10 else ''}"
+        )
+        missing = [memory for memory in missing if len(memory["embedding"]) == vector_store.dimension]
+    if missing:
+        added = vector_store.add_vectors(
+            [memory["id"] for memory in missing], [memory["embedding"] for memory in missing], missing
+        )
+        if len(added) != len(missing):
+            raise RuntimeError("Failed to add legacy embeddings to FAISS index")
+        rows.update(zip([memory["id"] for memory in missing], added))
+    prepared = []
+    for memory in memories:
+        memory = {key: value for key, value in memory.items() if key != "embedding"}
+        if memory["id"] in rows:
+            memory["embedding_row"] = rows[memory["id"]]
+        prepared.append(memory)
+    # 检索命中后从内容库取回记忆，只写日志的话旧记忆永远不会出现在检索结果中
+    if get_content_store().put_many(prepared) != len(prepared):
+        raise RuntimeError("Failed to write legacy memories to content store")
+    return prepared
+
+
+def compact_episodic_log(log_path: str, legacy_path: str = None):
+    """导入旧版JSON文件（如果存在）并压缩日志"""
+    log = EpisodicLog(log_path)
+    if legacy_path and os.path.exists(legacy_path):
+        imported = log.import_legacy_json(legacy_path, prepare=move_embeddings_to_vector_file)
+        print(f"Imported {imported} memories from {legacy_path}")
+    kept = log.compact()
+    print(f"Compacted {log_path}: {kept} memories")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导入旧版 episodic_memory.json 并压缩情景记忆日志")
+    parser.add_argument("--log", default=Config.EPISODIC_LOG_PATH, help="JSONL 日志路径")
+    parser.add_argument("--legacy", default="data/episodic_memory.json", help="旧版 JSON 记忆文件路径")
+    args = parser.parse_args()
+    compact_episodic_log(args.log, args.legacy)
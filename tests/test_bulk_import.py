@@ -0,0 +1,83 @@
+# test_bulk_import.py
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from scripts.bulk_import import build_memory, bulk_import, load_checkpoint, read_source
+
+class FakeEmbeddingModel:
+    """内容中含 fail_on 的批次请求失败（strict 模式下抛异常）"""
+    fail_on = None
+
+    def embed_batch(self, texts, strict=False):
+        if self.fail_on and any(self.fail_on in text for text in texts):
+            raise RuntimeError("embedding request failed")
+        return [[float(len(text)), 1.0] for text in texts]
+
+class TestBulkImport(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.args = argparse.Namespace(
+            format=None, content_field="content", id_field="id", type="incident", user_id=None,
+            batch_size=2, workers=1, checkpoint=None, restart=False,
+        )
+
+    def tearDown(self):
+        FakeEmbeddingModel.fail_on = None
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _write_jsonl(self, records):
+        path = os.path.join(self.tmp_dir, "incidents.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return path
+
+    def test_read_jsonl_and_csv(self):
+        jsonl_path = self._write_jsonl([{"id": "inc-1", "content": "磁盘满", "tags": ["disk"], "service": "api"}])
+        csv_path = os.path.join(self.tmp_dir, "runbooks.csv")
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            f.write("content,tags,score\n重启服务,\"restart, api\",0.8\n")
+
+        memory = build_memory(next(read_source(jsonl_path)), jsonl_path, 0, self.args)
+        self.assertEqual(memory["id"], "inc-1")
+        self.assertEqual(memory["tags"], ["disk"])
+        self.assertEqual(memory["metadata"], {"service": "api", "source": jsonl_path})
+
+        rows = list(read_source(csv_path))
+        memory = build_memory(rows[0], csv_path, 0, self.args)
+        self.assertEqual(memory["content"], "重启服务")
+        self.assertEqual(memory["tags"], ["restart", "api"])
+        self.assertEqual(memory["score"], 0.8)
+        # 没有ID字段时按文件路径和序号生成确定的ID
+        self.assertEqual(memory["id"], build_memory(rows[0], csv_path, 0, self.args)["id"])
+
+    def test_failed_batch_resumes_from_checkpoint(self):
+        path = self._write_jsonl([{"id": f"inc-{i}", "content": f"record {i}"} for i in range(6)])
+        checkpoint_path = os.path.abspath(path) + ".import-state.json"
+        written = []
+
+        def write_batch(memories, embeddings):
+            written.extend(memory["id"] for memory in memories)
+            return len(memories)
+
+        with mock.patch("models.embedding_model.EmbeddingModel", FakeEmbeddingModel), \
+                mock.patch("scripts.bulk_import.write_batch", side_effect=write_batch):
+            FakeEmbeddingModel.fail_on = "record 3"
+            with self.assertRaises(RuntimeError):
+                bulk_import(path, self.args)
+            # 失败批次之前的记录已写入，断点停在失败批次的起点
+            self.assertEqual(written, ["inc-0", "inc-1"])
+            self.assertEqual(load_checkpoint(checkpoint_path), 2)
+
+            FakeEmbeddingModel.fail_on = None
+            self.assertEqual(bulk_import(path, self.args), 4)
+        self.assertEqual(written, [f"inc-{i}" for i in range(6)])
+        self.assertEqual(load_checkpoint(checkpoint_path), 6)
+
+if __name__ == "__main__":
+    unittest.main()
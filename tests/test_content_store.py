@@ -0,0 +1,60 @@
+# test_content_store.py
+import os
+import shutil
+import tempfile
+import unittest
+
+from core.memory.content_store import ContentStore
+
+class TestContentStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, "memory.db")
+        self.store = ContentStore(self.db_path)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_put_and_get_many(self):
+        entries = [
+            {"id": f"mem-{i}", "content": f"内容 {i}", "type": "query", "user_id": "alice",
+             "tags": ["disk"], "metadata": {"trace_id": "t-1"}, "timestamp": "2024-01-01T00:00:00"}
+            for i in range(5)
+        ]
+        self.assertEqual(self.store.put_many(entries), 5)
+
+        memories = self.store.get_many(["mem-3", "mem-missing", "mem-1"])
+        self.assertEqual(set(memories), {"mem-1", "mem-3"})
+        self.assertEqual(memories["mem-3"]["content"], "内容 3")
+        self.assertEqual(memories["mem-3"]["metadata"], {"trace_id": "t-1"})
+        self.assertEqual(memories["mem-3"]["tags"], ["disk"])
+
+        self.assertEqual(self.store.delete_many(["mem-3", "mem-missing"]), 1)
+        self.assertIsNone(self.store.get("mem-3"))
+        self.assertEqual(self.store.count(), 4)
+
+    def test_upsert_keeps_access_stats(self):
+        entry = {"id": "mem-1", "content": "旧内容", "type": "query", "user_id": "alice"}
+        self.store.put(entry)
+        self.store.touch_many(["mem-1"], accessed_at=1000.0)
+        self.store.touch_many(["mem-1"], accessed_at=2000.0)
+
+        self.store.put({**entry, "content": "新内容"})
+        self.assertEqual(self.store.get("mem-1")["content"], "新内容")
+        self.assertEqual(self.store.get_access_stats(["mem-1"]), {"mem-1": (2, 2000.0)})
+
+    def test_wal_mode_and_placeholder_file(self):
+        placeholder_path = os.path.join(self.tmp_dir, "placeholder.db")
+        with open(placeholder_path, "w") as f:
+            f.write("# 占位文件\n")
+        store = ContentStore(placeholder_path)
+        try:
+            self.assertTrue(os.path.exists(placeholder_path + ".bak"))
+            mode = store._connection().execute("PRAGMA journal_mode").fetchone()[0]
+            self.assertEqual(mode, "wal")
+        finally:
+            store.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+# test_embedding_model.py
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from config.vector_db_config import FAISSConfig
+from models.embedding_cache import EmbeddingCache
+from models.embedding_model import EmbeddingModel
+from models.local_embedder import LocalEmbedder
+
+class FakeEmbeddings:
+    """记录每次请求的输入，结果按 index 倒序返回以检验顺序还原"""
+    def __init__(self):
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def _response(self, texts):
+        data = [SimpleNamespace(index=i, embedding=[float(len(text)), float(i)]) for i, text in enumerate(texts)]
+        return SimpleNamespace(data=list(reversed(data)))
+
+    def create(self, model, input):
+        with self.lock:
+            self.calls.append(list(input))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        with self.lock:
+            self.active -= 1
+        return self._response(input)
+
+class FakeAsyncEmbeddings(FakeEmbeddings):
+    async def create(self, model, input):
+        self.calls.append(list(input))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.02)
+        self.active -= 1
+        return self._response(input)
+
+class TestEmbeddingBatching(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = EmbeddingCache(os.path.join(self.tmp_dir, "embedding_cache.db"))
+        self.model = EmbeddingModel(cache=self.cache)
+        self.model.sync_client = SimpleNamespace(embeddings=FakeEmbeddings())
+        self.model.client = SimpleNamespace(embeddings=FakeAsyncEmbeddings())
+        self.model.local_embedder = None
+        self.model.batch_size = 3
+        self.model.batch_tokens = 1000
+        self.model.concurrency = 2
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_packs_by_count_and_skips_cached(self):
+        texts = [f"text-{i}" for i in range(7)] + ["text-0"]
+        embeddings = self.model.embed_batch(texts)
+        calls = self.model.sync_client.embeddings.calls
+        self.assertEqual(sorted(len(call) for call in calls), [1, 3, 3])
+        self.assertLessEqual(self.model.sync_client.embeddings.max_active, 2)
+        # 结果按输入顺序返回，重复的文本只请求一次
+        self.assertEqual(embeddings[0], embeddings[7])
+        self.assertEqual([e[0] for e in embeddings], [float(len(t)) for t in texts])
+
+        calls.clear()
+        self.model.embed_batch(["text-1", "new"])
+        self.assertEqual(calls, [["new"]])
+
+    def test_token_budget_and_async(self):
+        self.model.batch_tokens = 7  # "a" * 20 估算为 7 个token
+        texts = ["a" * 20, "b", "c", "d" * 20]
+        embeddings = asyncio.run(self.model.embed_batch_async(texts))
+        calls = self.model.client.embeddings.calls
+        self.assertEqual(sorted(map(tuple, calls)), sorted([("a" * 20,), ("b", "c"), ("d" * 20,)]))
+        self.assertLessEqual(self.model.client.embeddings.max_active, 2)
+        self.assertEqual([e[0] for e in embeddings], [20.0, 1.0, 1.0, 20.0])
+
+    def test_failed_request_falls_back_without_caching(self):
+        def fail(model, input):
+            raise RuntimeError("rate limited")
+        self.model.sync_client = SimpleNamespace(embeddings=SimpleNamespace(create=fail))
+        embedding = self.model.embed_text("磁盘满了")
+        self.assertEqual(embedding, self.model._simple_hash_embedding("磁盘满了"))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(EmbeddingCache(self.cache.db_path).get(self.model._get_cache_key("磁盘满了")), None)
+        with self.assertRaises(RuntimeError):
+            self.model.embed_batch(["磁盘满了"], strict=True)
+
+    def test_persistent_cache_shared_across_instances(self):
+        self.model.embed_batch(["disk full", "cpu high"])
+        calls = self.model.sync_client.embeddings.calls
+        self.assertEqual(len(calls), 1)
+
+        # 另一个进程（新的缓存实例，LRU 为空）从磁盘命中，不再请求
+        other = EmbeddingModel(cache=EmbeddingCache(self.cache.db_path, capacity=1))
+        other.sync_client = self.model.sync_client
+        other.local_embedder = None
+        first = other.embed_batch(["disk full", "cpu high"])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(first, self.model.embed_batch(["disk full", "cpu high"]))
+        # LRU 超出容量时淘汰最久未使用的向量
+        self.assertEqual(len(other.cache), 1)
+        other.cache.close()
+
+class TestLocalEmbedder(unittest.TestCase):
+    def test_ngram_embeddings_are_normalized_and_semantic(self):
+        embedder = LocalEmbedder(dimension=256)
+        texts = ["Disk full on db-01", "disk is full on db-02", "CPU high after deploy",
+                 "数据库连接池耗尽", "数据库连接数耗尽", ""]
+        vectors = embedder.embed(texts)
+        self.assertEqual(vectors.shape, (6, 256))
+        self.assertEqual(vectors.dtype, np.float32)
+        np.testing.assert_allclose(np.linalg.norm(vectors[:5], axis=1), 1.0, rtol=1e-5)
+        self.assertFalse(vectors[5].any())
+
+        similarity = vectors @ vectors.T
+        self.assertGreater(similarity[0, 1], similarity[0, 2] + 0.2)
+        self.assertGreater(similarity[3, 4], similarity[3, 0] + 0.1)
+        # 结果与批次划分和实例无关
+        np.testing.assert_allclose(LocalEmbedder(dimension=256).embed(texts[3:4]), vectors[3:4], atol=1e-6)
+        # 文本中的 NUL 不会被当作文本分隔符
+        with_nul = embedder.embed(["disk\x00full", "cpu high"])
+        np.testing.assert_allclose(with_nul, embedder.embed(["disk full", "cpu high"]), atol=1e-6)
+
+    def test_model_uses_local_engine_without_api_key(self):
+        model = EmbeddingModel(cache=EmbeddingCache(os.path.join(tempfile.gettempdir(), "unused.db")))
+        if model.client:
+            self.skipTest("OPENAI_API_KEY is set")
+        vectors = model.embed_batch(["disk full", "disk full", "cpu high"])
+        self.assertEqual(vectors[0], vectors[1])
+        self.assertEqual(len(vectors[0]), model.local_embedder.dimension)
+        self.assertEqual(model.local_embedder.dimension, FAISSConfig.DIMENSION)
+        self.assertEqual(model.embed_text("cpu high"), vectors[2])
+
+class TestEmbeddingCache(unittest.TestCase):
+    def test_lru_eviction_and_disk_fallback(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            cache = EmbeddingCache(os.path.join(tmp_dir, "cache.db"), capacity=2)
+            cache.put_many([("a", [1.0, 2.0]), ("b", [3.0, 4.0])])
+            cache.get("a")
+            cache.put("c", np.ones(2))
+            self.assertEqual(list(cache._lru), ["a", "c"])
+            # 被 LRU 淘汰的向量仍可从磁盘读取
+            self.assertEqual(cache.get("b").tolist(), [3.0, 4.0])
+            self.assertEqual(cache.get("b").dtype, np.float32)
+            self.assertIsNone(cache.get("missing"))
+            cache.close()
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    unittest.main()
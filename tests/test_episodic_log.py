@@ -0,0 +1,80 @@
+# test_episodic_log.py
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from core.memory.episodic_log import EpisodicLog
+
+class TestEpisodicLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "episodic_memory.jsonl")
+        self.log = EpisodicLog(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_append_and_random_access(self):
+        self.log.append_many([{"id": f"mem-{i}", "content": f"内容 {i}"} for i in range(5)])
+        self.log.append({"id": "mem-2", "content": "更新后的内容"})
+        self.assertEqual(self.log.delete_many(["mem-4", "mem-missing"]), 1)
+
+        memories = self.log.get_many(["mem-2", "mem-3", "mem-4"])
+        self.assertEqual(memories["mem-2"]["content"], "更新后的内容")
+        self.assertEqual(memories["mem-3"]["content"], "内容 3")
+        self.assertNotIn("mem-4", memories)
+        self.assertEqual([e["id"] for e in self.log.iter_entries()], ["mem-0", "mem-1", "mem-3", "mem-2"])
+
+        # 压缩后只保留最新版本，另一个实例可直接按索引读取
+        self.assertEqual(self.log.compact(), 4)
+        with open(self.path, "rb") as f:
+            self.assertEqual(len(f.readlines()), 4)
+        self.assertEqual(EpisodicLog(self.path).get("mem-2")["content"], "更新后的内容")
+
+    def test_sees_updates_from_other_instances(self):
+        self.log.append_many([{"id": f"mem-{i}", "content": f"内容 {i}"} for i in range(5)])
+        self.assertEqual(len(self.log.get_many([f"mem-{i}" for i in range(5)])), 5)
+
+        # 另一个进程更新已有记忆、追加新记忆，同一批内同一ID以最后一条为准
+        other = EpisodicLog(self.path)
+        other.append_many([
+            {"id": "mem-1", "content": "v2"}, {"id": "mem-9", "content": "新"}, {"id": "mem-1", "content": "v3"},
+        ])
+        other.delete_many(["mem-0"])
+        memories = self.log.get_many(["mem-0", "mem-1", "mem-9"])
+        self.assertEqual({k: v["content"] for k, v in memories.items()}, {"mem-1": "v3", "mem-9": "新"})
+        self.assertEqual([e["id"] for e in self.log.iter_entries()], ["mem-2", "mem-3", "mem-4", "mem-9", "mem-1"])
+
+    def test_recovers_unindexed_and_torn_records(self):
+        self.log.append({"id": "mem-0", "content": "a"})
+        # 模拟崩溃：一行已写入日志但未写入索引，另一行只写了一半
+        with open(self.path, "ab") as f:
+            f.write(json.dumps({"id": "mem-1", "content": "b"}).encode("utf-8") + b"\n")
+            f.write(b'{"id": "mem-2", "con')
+
+        recovered = EpisodicLog(self.path)
+        self.assertEqual(recovered.get("mem-1")["content"], "b")
+        self.assertIsNone(recovered.get("mem-2"))
+        recovered.append({"id": "mem-3", "content": "c"})
+        self.assertEqual([e["id"] for e in recovered.iter_entries()], ["mem-0", "mem-1", "mem-3"])
+
+    def test_iter_memories_batches_and_projection(self):
+        self.log.append_many([{"id": f"mem-{i}", "content": f"内容 {i}", "type": "query"} for i in range(5)])
+
+        batches = list(self.log.iter_memories(batch_size=2, fields=["id", "content"]))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(batches[2], [{"id": "mem-4", "content": "内容 4"}])
+        self.assertEqual([m["id"] for m in self.log.iter_memories()], [f"mem-{i}" for i in range(5)])
+
+    def test_import_legacy_json(self):
+        legacy_path = os.path.join(self.tmp_dir, "episodic_memory.json")
+        with open(legacy_path, "w", encoding="utf-8") as f:
+            json.dump({"memories": [{"id": "old-1", "content": "旧记忆"}], "metadata": {}}, f)
+        self.assertEqual(self.log.import_legacy_json(legacy_path), 1)
+        self.assertEqual(self.log.import_legacy_json(legacy_path), 0)
+        self.assertEqual(self.log.get("old-1")["content"], "旧记忆")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,13 @@
 # test_memory.py
+import os
+import shutil
+import tempfile
 import unittest
+from core.memory.consolidation_worker import ConsolidationWorker
+from core.memory.content_store import ContentStore
+from core.memory.episodic_log import EpisodicLog
 from core.memory.episodic_memory import EpisodicMemory
+from core.memory.faiss_vector_store import FAISSConfig, FAISSVectorStore
 
 class TestEpisodicMemory(unittest.TestCase):
     def setUp(self):
@@ -11,5 +18,50 @@ class TestEpisodicMemory(unittest.TestCase):
         self.memory.add_episode(episode)
         self.assertEqual(len(self.memory.short_term), 1)
 
+    def test_consolidates_in_batches_when_full(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            long_term = EpisodicLog(os.path.join(tmp_dir, "episodic_memory.jsonl"))
+            content_store = ContentStore(os.path.join(tmp_dir, "memory.db"))
+            vector_store = FAISSVectorStore(os.path.join(tmp_dir, "faiss_index"), dimension=FAISSConfig.DIMENSION)
+            worker = ConsolidationWorker(
+                vector_store=vector_store, content_store=content_store, long_term=long_term
+            )
+            memory = EpisodicMemory(capacity=4, batch_size=3, worker=worker)
+            memory.add_episode({"action": "step-0", "user_id": "alice"})
+            for i in range(1, 5):
+                memory.add_episode({"action": f"step-{i}"})
+            self.assertEqual(len(memory.short_term), 2)
+            self.assertEqual([e.data["action"] for e in memory.short_term], ["step-3", "step-4"])
+
+            # 整合在后台线程中完成，flush 后三个存储中都能读到
+            worker.flush()
+            entries = list(long_term.iter_entries())
+            self.assertEqual([m["metadata"]["action"] for m in entries], ["step-0", "step-1", "step-2"])
+            self.assertEqual(entries[0]["content"], "action: step-0; user_id: alice")
+            self.assertEqual(content_store.count(), 3)
+            self.assertEqual(len(vector_store.get_rows([m["id"] for m in entries])), 3)
+
+            # 情景的归属随记录写入内容库和向量元数据，其他用户检索不到
+            self.assertEqual(content_store.get(entries[0]["id"])["user_id"], "alice")
+            row = vector_store.get_rows([entries[0]["id"]])[entries[0]["id"]]
+            query = vector_store.read_rows([row])[0].tolist()
+            visible = [r["id"] for r in vector_store.search(query, k=10, filters={"user_id": "bob"})]
+            self.assertNotIn(entries[0]["id"], visible)
+            self.assertIn(entries[1]["id"], visible)
+
+            # 超龄的记录在下次写入时转移
+            memory.max_age = 0
+            memory.add_episode({"action": "step-5"})
+            self.assertEqual(len(memory.short_term), 1)
+            memory.flush()
+            self.assertEqual(len(memory.short_term), 0)
+            self.assertEqual(content_store.count(), 6)
+            worker.close()
+            content_store.close()
+            vector_store.close()
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file
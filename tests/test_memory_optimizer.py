@@ -0,0 +1,101 @@
+# test_memory_optimizer.py
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from core.memory.content_store import ContentStore
+from core.memory.episodic_log import EpisodicLog
+from core.memory.faiss_vector_store import FAISSVectorStore
+from core.memory.memory_optimizer import MemoryOptimizer
+
+class TestMemoryOptimizer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.vector_store = FAISSVectorStore(os.path.join(self.tmp_dir, "faiss_index"), dimension=16)
+        self.content_store = ContentStore(os.path.join(self.tmp_dir, "memory.db"))
+        self.log = EpisodicLog(os.path.join(self.tmp_dir, "episodic_memory.jsonl"))
+        self.optimizer = MemoryOptimizer(self.vector_store, self.content_store, self.log)
+
+    def tearDown(self):
+        self.vector_store.close()
+        self.content_store.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _store(self, memories, vectors):
+        rows = self.vector_store.add_vectors([m["id"] for m in memories], vectors, memories)
+        for memory, row in zip(memories, rows):
+            memory["embedding_row"] = row
+        self.content_store.put_many(memories)
+        self.log.append_many(memories)
+
+    def test_merges_near_duplicates_per_user(self):
+        rng = np.random.default_rng(1)
+        base, other = rng.standard_normal((2, 16)).astype(np.float32)
+        vectors = [base, base + 0.01, base * 2, base, other, -base]
+        memories = [
+            {"id": f"mem-{i}", "user_id": user, "type": "query", "content": f"磁盘满了 {i}",
+             "tags": [f"t{i}"], "score": score, "timestamp": f"2024-01-0{i + 1}T00:00:00"}
+            for i, (user, score) in enumerate([("u1", 0.5), ("u1", 0.9), ("u1", None),
+                                               ("u2", None), ("u1", None), ("u1", None)])
+        ]
+        self._store(memories, vectors)
+
+        stats = self.optimizer.optimize_memory()
+        self.assertEqual(stats, {"scanned": 6, "clusters": 1, "merged": 2})
+
+        # 分数最高的记忆保留为规范记忆，元数据聚合整个簇
+        canonical = self.log.get("mem-1")
+        self.assertEqual(canonical["metadata"]["duplicate_count"], 3)
+        self.assertEqual(canonical["metadata"]["first_seen"], "2024-01-01T00:00:00")
+        self.assertEqual(canonical["metadata"]["last_seen"], "2024-01-03T00:00:00")
+        self.assertEqual(sorted(canonical["metadata"]["merged_ids"]), ["mem-0", "mem-2"])
+        self.assertEqual(canonical["tags"], ["t0", "t1", "t2"])
+        self.assertEqual(self.content_store.get("mem-1")["metadata"]["duplicate_count"], 3)
+
+        # 其余重复记忆从三个存储中删除，其他用户的相同内容不合并
+        for store in (self.log, self.content_store):
+            self.assertEqual(sorted(store.get_many([m["id"] for m in memories])),
+                             ["mem-1", "mem-3", "mem-4", "mem-5"])
+        self.assertEqual(sorted(self.vector_store.get_rows([m["id"] for m in memories])),
+                         ["mem-1", "mem-3", "mem-4", "mem-5"])
+
+        # 再次执行时不再有重复
+        self.assertEqual(self.optimizer.optimize_memory()["merged"], 0)
+
+    def test_evicts_by_ttl_capacity_and_decay(self):
+        now = datetime(2024, 2, 1).timestamp()
+        day = 86400
+        memories = [
+            {"id": f"mem-{i}", "user_id": user, "type": memory_type, "content": f"记忆 {i}", "score": 0.5,
+             "timestamp": datetime.fromtimestamp(now - age * day).isoformat()}
+            for i, (user, memory_type, age) in enumerate([
+                ("u1", "query", 20), ("u1", "answer", 10), ("u1", "answer", 1),
+                ("u1", "answer", 30), ("u2", "answer", 5), ("u2", "answer", 6),
+            ])
+        ]
+        self._store(memories, np.eye(16, dtype=np.float32)[:len(memories)])
+        # 最旧的回答被频繁访问，衰减变慢
+        self.content_store.touch_many(["mem-3"], accessed_at=now - day)
+        self.content_store.touch_many(["mem-3"], accessed_at=now - day)
+
+        optimizer = MemoryOptimizer(
+            self.vector_store, self.content_store, self.log,
+            max_per_user=2, max_entries=3, ttl_by_type={"query": 7 * day}, half_life=7 * day
+        )
+        stats = optimizer.clean_memory(now=now)
+        self.assertEqual(stats, {"scanned": 6, "expired": 1, "evicted": 2})
+
+        kept = ["mem-2", "mem-3", "mem-4"]
+        ids = [m["id"] for m in memories]
+        self.assertEqual(sorted(self.log.get_many(ids)), kept)
+        self.assertEqual(sorted(self.content_store.get_many(ids)), kept)
+        self.assertEqual(sorted(self.vector_store.get_rows(ids)), kept)
+        with open(self.log.path, "rb") as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+if __name__ == "__main__":
+    unittest.main()
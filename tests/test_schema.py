@@ -0,0 +1,35 @@
+# test_schema.py
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from utils.schema import MemoryEntry, MemoryRecord
+
+class TestMemoryRecord(unittest.TestCase):
+    def test_float32_embedding_and_dict_compat(self):
+        embedding = np.arange(4, dtype=np.float32)
+        record = MemoryRecord("mem-1", "磁盘满了", embedding=embedding, type="query", distance=0.3)
+        self.assertFalse(hasattr(record, "__dict__"))
+        self.assertTrue(np.shares_memory(record.embedding, embedding))
+        self.assertEqual(MemoryRecord("mem-2", embedding=[1, 2]).embedding.dtype, np.float32)
+
+        self.assertEqual(record.get("content"), "磁盘满了")
+        self.assertEqual(record["distance"], 0.3)
+        self.assertEqual(record.get("relevance_score", 0.0), 0.0)
+        self.assertEqual(record.get("missing", "x"), "x")
+
+        # 落盘字典不含向量和为空的检索字段
+        data = record.to_dict()
+        self.assertNotIn("embedding", data)
+        self.assertNotIn("relevance_score", data)
+        self.assertEqual(MemoryRecord.from_dict({**data, "unknown": 1}).content, "磁盘满了")
+
+    def test_memory_entry_round_trip(self):
+        entry = MemoryEntry(id="mem-1", content="c", timestamp=datetime(2024, 1, 1), metadata={"a": 1})
+        record = MemoryRecord.from_entry(entry, user_id="u1")
+        self.assertEqual(record.timestamp, "2024-01-01T00:00:00")
+        self.assertEqual(record.to_entry(), entry)
+
+if __name__ == "__main__":
+    unittest.main()
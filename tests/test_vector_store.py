@@ -0,0 +1,437 @@
+# test_vector_store.py
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import faiss
+import numpy as np
+
+from core.memory import id_map
+from core.memory.faiss_vector_store import FAISSConfig, FAISSVectorStore, get_vector_store
+from core.memory.write_ahead_log import WriteAheadLog
+from utils.helpers import SharedInstance
+
+class TestFAISSVectorStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.tmp_dir, "faiss_index")
+        self.dimension = 8
+        self.store = FAISSVectorStore(index_path=self.index_path, dimension=self.dimension)
+    
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+    
+    def _vectors(self, n, seed=0):
+        return np.random.RandomState(seed).rand(n, self.dimension).astype('float32')
+    
+    @staticmethod
+    def _crash(store):
+        """模拟进程崩溃：停止后台线程、关闭转发套接字并释放写入锁，不写快照"""
+        store._stop_event.set()
+        store._stop_write_server()
+        store._snapshot_event.set()
+        store._snapshot_thread.join()
+        store._wal.close()
+        store._release_writer_lock()
+    
+    def test_add_and_search(self):
+        vectors = self._vectors(10)
+        ids = [f"mem-{i}" for i in range(10)]
+        self.store.add_vectors(ids, vectors.tolist())
+        results = self.store.search(vectors[3].tolist(), k=3)
+        self.assertEqual(results[0]["id"], "mem-3")
+    
+    def test_search_batch(self):
+        vectors = self._vectors(20)
+        self.store.add_vectors([f"mem-{i}" for i in range(20)], vectors)
+        results = self.store.search_batch(vectors[[5, 7, 11]], k=2)
+        self.assertEqual([r[0]["id"] for r in results], ["mem-5", "mem-7", "mem-11"])
+        self.assertTrue(all(len(r) == 2 for r in results))
+    
+    def test_filtered_search(self):
+        vectors = self._vectors(6)
+        metadatas = [
+            {"user_id": "alice", "type": "query", "timestamp": "2024-01-01T00:00:00"},
+            {"user_id": "bob", "type": "query", "timestamp": "2024-01-02T00:00:00"},
+            {"user_id": "alice", "type": "final_answer", "timestamp": "2024-01-03T00:00:00"},
+            {"user_id": "bob", "type": "final_answer", "timestamp": "2024-01-04T00:00:00"},
+            {"user_id": "alice", "type": "plan", "timestamp": "2024-01-05T00:00:00"},
+            None,
+        ]
+        self.store.add_vectors([f"mem-{i}" for i in range(6)], vectors, metadatas)
+        
+        def ids(filters):
+            return {r["id"] for r in self.store.search(vectors[1].tolist(), k=6, filters=filters)}
+        
+        # 无归属的记录对所有用户可见
+        self.assertEqual(ids({"user_id": "alice"}), {"mem-0", "mem-2", "mem-4", "mem-5"})
+        self.assertEqual(ids({"user_id": "bob", "type": "final_answer"}), {"mem-3"})
+        self.assertEqual(ids({"start_time": "2024-01-02T00:00:00", "end_time": "2024-01-03T00:00:00"}),
+                         {"mem-1", "mem-2"})
+        self.assertEqual(ids({"user_id": "nobody", "type": "query"}), set())
+    
+    def test_remove_and_compaction(self):
+        vectors = self._vectors(10)
+        self.store.add_vectors([f"mem-{i}" for i in range(10)], vectors)
+        
+        # 删除后检索立即跳过
+        self.assertEqual(self.store.remove(["mem-3", "mem-missing"]), 1)
+        self.assertNotEqual(self.store.search(vectors[3].tolist(), k=1)[0]["id"], "mem-3")
+        self.assertEqual(self.store.remove(["mem-3"]), 0)
+        
+        with mock.patch.object(FAISSConfig, "COMPACTION_MIN_TOMBSTONES", 1), \
+                mock.patch.object(FAISSConfig, "COMPACTION_THRESHOLD", 0.2):
+            self.store.remove(["mem-4"])
+            self.store._rebuild_thread.join()
+        
+        self.assertEqual(self.store.index.ntotal, 8)
+        self.assertEqual(self.store._tombstones_in_index, 0)
+        ids = {r["id"] for r in self.store.search(vectors[4].tolist(), k=10)}
+        self.assertEqual(ids, {f"mem-{i}" for i in range(10)} - {"mem-3", "mem-4"})
+    
+    def test_rows_address_raw_vector_file(self):
+        vectors = self._vectors(4)
+        rows = self.store.add_vectors([f"mem-{i}" for i in range(4)], vectors)
+        self.assertEqual(rows, [0, 1, 2, 3])
+        self.store.remove(["mem-1"])
+        self.assertEqual(self.store.get_rows(["mem-2", "mem-1", "mem-missing"]), {"mem-2": 2})
+        np.testing.assert_array_equal(self.store.read_rows([3, 0]), vectors[[3, 0]])
+        np.testing.assert_array_equal(self.store.embedding_matrix()[2], vectors[2])
+    
+    def test_cosine_metric(self):
+        store = FAISSVectorStore(
+            index_path=os.path.join(self.tmp_dir, "cosine_index"), dimension=self.dimension, metric="cosine"
+        )
+        try:
+            vectors = self._vectors(10)
+            original = vectors.copy()
+            store.add_vectors([f"mem-{i}" for i in range(10)], vectors)
+            np.testing.assert_array_equal(vectors, original)
+            
+            # 缩放查询向量不影响余弦相似度
+            hit = store.search((vectors[6] * 5).tolist(), k=1)[0]
+            self.assertEqual(hit["id"], "mem-6")
+            self.assertAlmostEqual(hit["score"], 1.0, places=5)
+        finally:
+            store.close()
+    
+    def test_add_appends_to_wal_without_rewriting_index(self):
+        self.store.add_vectors(["mem-0"], self._vectors(1).tolist())
+        self.assertEqual(self.store._list_generations(), [])
+        self.assertGreater(os.path.getsize(self.index_path + ".wal"), 0)
+    
+    def test_rejects_wrong_dimension_before_wal(self):
+        wal_size = os.path.getsize(self.index_path + ".wal")
+        with self.assertRaises(ValueError):
+            self.store.add_vectors(["mem-0"], np.ones((1, 2 * self.dimension)))
+        with self.assertRaises(ValueError):
+            self.store.search_batch(np.ones((1, self.dimension + 1)))
+        self.assertEqual(os.path.getsize(self.index_path + ".wal"), wal_size)
+        self.assertEqual(len(self.store.id_map), 0)
+    
+    def test_replay_skips_invalid_wal_record(self):
+        # 校验之前写入日志的维度不符记录：回放时跳过，之后的记录照常回放
+        path = os.path.join(self.tmp_dir, "bad_wal_index")
+        wal = WriteAheadLog(path + ".wal")
+        wal.append({"lsn": 1, "op": "add", "ids": ["bad"]}, np.ones(2 * self.dimension, dtype='float32').tobytes())
+        wal.append({"lsn": 2, "op": "add", "ids": ["mem-0", "mem-1"]}, self._vectors(2).tobytes())
+        wal.close()
+        store = FAISSVectorStore(index_path=path, dimension=self.dimension)
+        try:
+            self.assertEqual(store.get_rows(["bad", "mem-0", "mem-1"]), {"mem-0": 0, "mem-1": 1})
+            self.assertEqual(store._lsn, 2)
+        finally:
+            store.close()
+    
+    def test_reload_replays_wal_after_snapshot(self):
+        vectors = self._vectors(6)
+        self.store.add_vectors(["mem-0", "mem-1", "mem-2"], vectors[:3].tolist())
+        self.store._save_index()
+        self.store.add_vectors(["mem-3", "mem-4", "mem-5"], vectors[3:].tolist())
+        
+        # 未写快照即重新加载，模拟进程崩溃
+        self._crash(self.store)
+        reloaded = FAISSVectorStore(index_path=self.index_path, dimension=self.dimension)
+        try:
+            self.assertFalse(reloaded.read_only)
+            self.assertEqual(reloaded.index.ntotal, 6)
+            self.assertEqual(reloaded.search(vectors[4].tolist(), k=1)[0]["id"], "mem-4")
+        finally:
+            reloaded.close()
+    
+    def test_upgrades_to_ivf_after_threshold(self):
+        vectors = self._vectors(400)
+        with mock.patch.object(FAISSConfig, "UPGRADE_INDEX_TYPE", "ivf"), \
+                mock.patch.object(FAISSConfig, "UPGRADE_THRESHOLD", 300), \
+                mock.patch("core.memory.faiss_vector_store._BUILD_BLOCK_ROWS", 128), \
+                mock.patch.object(self.store.vector_file, "read", wraps=self.store.vector_file.read) as read:
+            self.store.add_vectors([f"mem-{i}" for i in range(400)], vectors.tolist())
+            self.store._rebuild_thread.join()
+        
+        # 重建从向量文件的内存映射抽样训练、按块写入，不一次读出全部向量
+        self.assertFalse(any(len(call.args[0]) >= 400 for call in read.call_args_list))
+        self.assertEqual(self.store.index_type, "ivf")
+        self.assertEqual(self.store.index.ntotal, 400)
+        self.store.set_search_params(nprobe=faiss.downcast_index(self.store.index.index).nlist)
+        self.assertEqual(self.store.search(vectors[123].tolist(), k=1)[0]["id"], "mem-123")
+    
+    def test_compressed_index_reranks_with_raw_vectors(self):
+        vectors = self._vectors(400)
+        for index_type in ("sq8", "pq", "ivfpq"):
+            store = FAISSVectorStore(index_path=os.path.join(self.tmp_dir, index_type), dimension=self.dimension)
+            try:
+                with mock.patch.object(FAISSConfig, "UPGRADE_INDEX_TYPE", index_type), \
+                        mock.patch.object(FAISSConfig, "UPGRADE_THRESHOLD", 300), \
+                        mock.patch.object(FAISSConfig, "PQ_NBITS", 4):
+                    store.add_vectors([f"mem-{i}" for i in range(400)], vectors)
+                    store._rebuild_thread.join()
+                
+                self.assertEqual(store.index_type, index_type)
+                store.set_search_params(nprobe=64)
+                hit = store.search(vectors[42].tolist(), k=1)[0]
+                self.assertEqual(hit["id"], "mem-42")
+                self.assertAlmostEqual(hit["distance"], 0.0, places=5)
+            finally:
+                store.close()
+    
+    def test_mmap_load_mode(self):
+        vectors = self._vectors(5)
+        self.store.add_vectors([f"mem-{i}" for i in range(5)], vectors.tolist())
+        self.store.close()
+        
+        mapped = FAISSVectorStore(index_path=self.index_path, dimension=self.dimension, load_mode="mmap")
+        try:
+            self.assertTrue(mapped._mapped_files)
+            # 编码直接引用映射的文件页，没有拷贝到私有内存
+            self.assertFalse(faiss.downcast_index(mapped.index.index).codes.is_owned)
+            self.assertEqual(mapped.search(vectors[2].tolist(), k=1)[0]["id"], "mem-2")
+            
+            # 写入进程有未快照的写入时，只读进程仍然共享映射
+            reader = FAISSVectorStore(index_path=self.index_path, dimension=self.dimension, load_mode="mmap")
+            try:
+                mapped.add_vectors(["mem-new"], [vectors[0].tolist()])
+                self.assertTrue(reader.read_only)
+                self.assertFalse(faiss.downcast_index(reader.index.index).codes.is_owned)
+            finally:
+                reader.close()
+            
+            # 首次写入时转为私有内存
+            self.assertFalse(mapped._mapped_files)
+            self.assertTrue(faiss.downcast_index(mapped.index.index).codes.is_owned)
+            self.assertEqual(mapped.index.ntotal, 6)
+        finally:
+            mapped.close()
+    
+    def test_int64_labels_and_legacy_migration(self):
+        # 旧版快照：按位置编号的 IndexFlatL2 + JSON ID映射
+        vectors = self._vectors(4)
+        legacy_path = os.path.join(self.tmp_dir, "legacy_index")
+        legacy = faiss.IndexFlatL2(self.dimension)
+        legacy.add(vectors)
+        faiss.write_index(legacy, legacy_path)
+        with open(legacy_path + ".ids", "w") as f:
+            json.dump({str(i): f"mem-{i}" for i in range(4)}, f)
+        
+        store = FAISSVectorStore(index_path=legacy_path, dimension=self.dimension)
+        try:
+            self.assertIsInstance(faiss.downcast_index(store.index), faiss.IndexIDMap2)
+            store.add_vectors(["mem-4"], self._vectors(1, seed=1).tolist())
+            self.assertEqual(list(store.id_map.find(["mem-2", "mem-4"])), [2, 4])
+            self.assertEqual(store.search(vectors[1].tolist(), k=1)[0]["id"], "mem-1")
+        finally:
+            store.close()
+        self.assertTrue(os.path.exists(os.path.join(store._generation_dir(store._generation), "ids.npy")))
+        self.assertFalse(os.path.exists(legacy_path))
+        self.assertFalse(os.path.exists(legacy_path + ".ids"))
+    
+    def test_id_map_find_sorted_and_unsorted_tail(self):
+        ids = id_map.IdMap()
+        ids.extend([f"mem-{i}" for i in range(10)])
+        self.assertEqual(list(ids.find(["mem-7", "mem-2", "missing", "mem-7"])), [2, 7])
+        # 排序之后写入的标签（含同一ID的新标签）线性扫描，超过上限后归并进排序数组
+        with mock.patch.object(id_map, "_MAX_UNSORTED", 3):
+            ids.extend(["mem-2", "new-0"])
+            self.assertEqual(list(ids.find(["mem-2", "new-0"])), [2, 10, 11])
+            ids.extend([f"new-{i}" for i in range(1, 5)])
+            self.assertEqual(list(ids.find(["mem-2", "new-4"])), [2, 10, 15])
+            self.assertEqual(len(ids._order), 16)
+    
+    def test_shared_store_is_singleton(self):
+        # 共享实例指向临时目录，测试不在 data/ 下生成索引文件
+        shared_path = os.path.join(self.tmp_dir, "shared_index")
+        with mock.patch.object(FAISSConfig, "INDEX_PATH", shared_path), \
+                mock.patch("core.memory.faiss_vector_store._shared_store", SharedInstance(FAISSVectorStore)):
+            store = get_vector_store()
+            try:
+                self.assertIs(get_vector_store(), store)
+                self.assertEqual(store.index_path, shared_path)
+            finally:
+                store.close()
+    
+    def test_concurrent_search_and_add(self):
+        vectors = self._vectors(50)
+        self.store.add_vectors([f"mem-{i}" for i in range(10)], vectors[:10].tolist())
+        errors = []
+        
+        def reader():
+            for _ in range(20):
+                if not self.store.search(vectors[0].tolist(), k=1):
+                    errors.append("empty result")
+        
+        def writer():
+            for i in range(10, 50):
+                self.store.add_vectors([f"mem-{i}"], [vectors[i].tolist()])
+        
+        threads = [threading.Thread(target=reader) for _ in range(4)] + [threading.Thread(target=writer)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        self.assertEqual(errors, [])
+        self.assertEqual(self.store.index.ntotal, 50)
+
+    def test_sharded_store(self):
+        vectors = self._vectors(30)
+        ids = [f"mem-{i}" for i in range(30)]
+        metadatas = [{"user_id": "alice" if i % 2 else "bob"} for i in range(30)]
+        self.store.add_vectors(ids, vectors, metadatas)
+
+        sharded_path = os.path.join(self.tmp_dir, "sharded_index")
+        sharded = FAISSVectorStore(index_path=sharded_path, dimension=self.dimension, num_shards=3)
+        sharded.add_vectors(ids, vectors, metadatas)
+        try:
+            self.assertEqual([s.ntotal for s in sharded._sub_indexes()], [10, 10, 10])
+            # 分片并行检索合并后的结果与单索引一致
+            expected = self.store.search_batch(vectors[:5], k=4)
+            self.assertEqual(
+                [[hit["id"] for hit in row] for row in sharded.search_batch(vectors[:5], k=4)],
+                [[hit["id"] for hit in row] for row in expected]
+            )
+            hits = sharded.search(vectors[0].tolist(), k=30, filters={"user_id": "alice"})
+            self.assertEqual({hit["id"] for hit in hits}, {f"mem-{i}" for i in range(1, 30, 2)})
+            sharded.remove(["mem-1"])
+            self.assertNotIn("mem-1", [hit["id"] for hit in sharded.search(vectors[1].tolist(), k=3)])
+        finally:
+            sharded.close()
+        self.assertIn("index.shard2", os.listdir(sharded._generation_dir(sharded._generation)))
+
+        # 分片数与快照不同时在后台重新分片
+        resharded = FAISSVectorStore(index_path=sharded_path, dimension=self.dimension, num_shards=1)
+        try:
+            resharded._rebuild_thread.join()
+            self.assertEqual(len(resharded._sub_indexes()), 1)
+            self.assertEqual(resharded.search(vectors[4].tolist(), k=1)[0]["id"], "mem-4")
+        finally:
+            resharded.close()
+        self.assertIn("index", os.listdir(resharded._generation_dir(resharded._generation)))
+        self.assertNotIn("index.shard0", os.listdir(resharded._generation_dir(resharded._generation)))
+
+    def test_corrupt_generation_falls_back_to_previous(self):
+        vectors = self._vectors(6)
+        self.store.add_vectors(["mem-0", "mem-1", "mem-2"], vectors[:3])
+        self.store._save_index()
+        self.store.add_vectors(["mem-3", "mem-4", "mem-5"], vectors[3:])
+        self.store._save_index()
+        self.store.close()
+        self.assertEqual(self.store._list_generations(), [2, 1])
+
+        # 最新一代的ID映射损坏：回退到第1代，并用归档日志补回之后的写入
+        ids_path = os.path.join(self.store._generation_dir(2), "ids.npy")
+        with open(ids_path, "r+b") as f:
+            f.seek(-4, os.SEEK_END)
+            f.write(b"XXXX")
+        store = FAISSVectorStore(index_path=self.index_path, dimension=self.dimension)
+        try:
+            self.assertEqual(store.index.ntotal, 6)
+            self.assertEqual(store.search(vectors[5].tolist(), k=1)[0]["id"], "mem-5")
+            self.assertTrue(os.path.isdir(store._generation_dir(2) + ".corrupt"))
+        finally:
+            store.close()
+        self.assertEqual(store._list_generations()[0], 3)
+
+    def test_second_writer_opens_read_only(self):
+        vectors = self._vectors(4)
+        self.store.add_vectors(["mem-0", "mem-1"], vectors[:2])
+        self.store._save_index()
+        
+        # 写入锁被占用：只读打开，写入转发给写入进程执行，本进程不追加日志也不写快照
+        other = FAISSVectorStore(index_path=self.index_path, dimension=self.dimension)
+        try:
+            self.assertTrue(other.read_only)
+            self.assertIsNone(other._wal)
+            self.assertEqual(other.add_vectors(["other-0"], vectors[2:3]), [2])
+            self.assertEqual(other.remove(["mem-0"]), 1)
+            self.assertEqual(other.get_rows(["mem-0", "other-0"]), {"other-0": 2})
+            self.assertEqual(self.store.get_rows(["mem-0", "mem-1", "other-0"]), {"mem-1": 1, "other-0": 2})
+            np.testing.assert_allclose(other.read_rows([2])[0], vectors[2])
+            with self.assertRaises(ValueError):
+                other.add_vectors(["bad"], vectors[:1, :4])
+            
+            # 写入进程不热加载，不会被其他代覆盖本进程的写入
+            self.store.add_vectors(["mem-2"], vectors[3:4])
+            self.assertFalse(self.store.reload())
+            self.assertEqual(self.store.get_rows(["mem-2"]), {"mem-2": 3})
+            self.assertEqual(self.store._list_generations(), [1])
+            
+            # 写入进程退出后写入不再被静默丢弃
+            self.store.close()
+            self.assertFalse(os.path.exists(self.index_path + ".sock"))
+            with self.assertRaises(RuntimeError):
+                other.add_vectors(["other-1"], vectors[:1])
+        finally:
+            other.close()
+        reopened = FAISSVectorStore(index_path=self.index_path, dimension=self.dimension)
+        try:
+            self.assertEqual(reopened.get_rows(["mem-0", "other-0", "mem-2"]), {"other-0": 2, "mem-2": 3})
+        finally:
+            reopened.close()
+    
+    @unittest.skipUnless(hasattr(os, "fork"), "requires fork")
+    def test_forked_child_forwards_writes_to_parent(self):
+        # 模拟 gunicorn --preload：父进程加载共享实例后 fork，子进程不能沿用继承的写入锁
+        shared_path = os.path.join(self.tmp_dir, "shared_index")
+        with mock.patch.object(FAISSConfig, "INDEX_PATH", shared_path), \
+                mock.patch.object(FAISSConfig, "DIMENSION", self.dimension), \
+                mock.patch("core.memory.faiss_vector_store._shared_store", SharedInstance(FAISSVectorStore)):
+            parent = get_vector_store()
+            try:
+                parent.add_vectors(["parent-0"], self._vectors(1))
+                pid = os.fork()
+                if pid == 0:
+                    status = 1
+                    try:
+                        child = get_vector_store()
+                        if child is not parent and child.read_only and \
+                                child.add_vectors(["child-0"], self._vectors(1, seed=1)) == [1]:
+                            status = 0
+                    finally:
+                        os._exit(status)
+                _, status = os.waitpid(pid, 0)
+                self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+                self.assertEqual(parent.get_rows(["parent-0", "child-0"]), {"parent-0": 0, "child-0": 1})
+            finally:
+                parent.close()
+    
+    def test_hot_reload_picks_up_new_generation(self):
+        vectors = self._vectors(4)
+        self.store.add_vectors(["mem-0", "mem-1"], vectors[:2])
+        self.store._save_index()
+        reader = FAISSVectorStore(index_path=self.index_path, dimension=self.dimension, load_mode="mmap")
+        try:
+            self.store.add_vectors(["mem-2", "mem-3"], vectors[2:])
+            self.store._save_index()
+            self.assertTrue(reader.read_only)
+            self.assertTrue(reader.reload())
+            self.assertEqual(reader._generation, self.store._generation)
+            self.assertEqual(reader.search(vectors[3].tolist(), k=1)[0]["id"], "mem-3")
+        finally:
+            reader.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,13 @@
 # 通用辅助函数
+import atexit
+import importlib
 import json
-from typing import Dict, Any, List
+import threading
+from contextlib import contextmanager
+from itertools import islice
+from typing import Dict, Any, Callable, Generic, Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar("T")
 
 def load_json_file(file_path: str) -> Dict[str, Any]:
     """加载 JSON 文件"""
@@ -12,6 +19,101 @@ def save_json_file(data: Dict[str, Any], file_path: str):
     with open(file_path, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
-def chunk_list(lst: List[Any], chunk_size: int) -> List[List[Any]]:
-    """将列表分块"""
-    return [lst[i:i + chunk_size] for i in range(0, len(lst), chunk_size)] 
\ No newline at end of file
+def chunk_list(lst: Iterable[Any], chunk_size: int) -> Iterator[List[Any]]:
+    """将列表（或任意可迭代对象，如生成器）按固定大小分块，逐块生成，不会一次性展开输入"""
+    iterator = iter(lst)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+class ReadWriteLock:
+    """读写锁：允许多个读者并发，写者独占（写者优先，避免写饥饿）"""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read_lock(self):
+        """获取读锁"""
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write_lock(self):
+        """获取写锁"""
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+class SharedInstance(Generic[T]):
+    """进程内共享实例：首次 get() 时创建（双重检查加锁，只创建一次），实例有 close 方法时在进程退出时关闭"""
+
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._instance: Optional[T] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> T:
+        """获取共享实例，不存在时创建"""
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    instance = self._factory()
+                    if callable(getattr(instance, "close", None)):
+                        atexit.register(instance.close)
+                    self._instance = instance
+        return self._instance
+
+    def reset(self) -> Optional[T]:
+        """
+        丢弃当前实例（不关闭）并换一把新锁，下次 get() 重新创建，返回被丢弃的实例
+        用于 fork 出的子进程：父进程的其他线程可能在 fork 时正持有锁
+        """
+        instance, self._instance = self._instance, None
+        self._lock = threading.Lock()
+        return instance
+
+class SharedDependency:
+    """
+    延迟获取依赖的属性：对象的 _<属性名> 为 None（构造时未传入）时，首次访问调用 getter 取得实例并缓存
+    getter 写作 "模块:函数"，首次访问时才导入，模块之间不会循环导入
+    """
+
+    def __init__(self, getter: str):
+        self._module, self._function = getter.split(":")
+        self._attr = None
+
+    def __set_name__(self, owner, name):
+        self._attr = "_" + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self._attr, None)
+        if value is None:
+            value = getattr(importlib.import_module(self._module), self._function)()
+            setattr(obj, self._attr, value)
+        return value
@@ -1,8 +1,11 @@
 # 通用数据结构定义（pydantic）
+from dataclasses import dataclass, field, fields
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 
+import numpy as np
+
 class QueryRequest(BaseModel):
     question: str
     context: Optional[str] = None
@@ -18,6 +21,83 @@ class MemoryEntry(BaseModel):
     timestamp: datetime
     metadata: Dict[str, Any]
 
+def as_float32(embedding: Any) -> Optional[np.ndarray]:
+    """向量转换为一维 float32 数组；已是 float32 数组时直接返回视图，不复制"""
+    if embedding is None:
+        return None
+    return np.asarray(embedding, dtype=np.float32).reshape(-1)
+
+@dataclass(slots=True)
+class MemoryRecord:
+    """
+    检索/写入链路中的记忆记录，字段与 MemoryEntry 对应
+    使用 __slots__ 不为每条记录创建 __dict__，向量以 float32 数组保存（列表中的每个元素都是一个 Python float 对象）
+    打分等步骤直接修改字段，不再复制整个字典；get/[] 兼容原先按字典读取的调用方
+    """
+    id: str
+    content: str = ""
+    timestamp: Optional[str] = None
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    type: str = ""
+    user_id: Optional[str] = None
+    tags: List[str] = field(default_factory=list)
+    score: Optional[float] = None
+    storage_type: Optional[str] = None
+    embedding: Optional[np.ndarray] = None
+    embedding_row: Optional[int] = None
+    distance: Optional[float] = None
+    relevance_score: Optional[float] = None
+
+    def __post_init__(self):
+        self.embedding = as_float32(self.embedding)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], **overrides) -> "MemoryRecord":
+        """由记忆字典（内容库/日志中的记录）构造，未知字段忽略"""
+        values = {name: data[name] for name in _MEMORY_RECORD_FIELDS if name in data}
+        values.update(overrides)
+        return cls(**values)
+
+    @classmethod
+    def from_entry(cls, entry: MemoryEntry, **overrides) -> "MemoryRecord":
+        """由 MemoryEntry 构造"""
+        return cls(entry.id, entry.content, entry.timestamp.isoformat(), dict(entry.metadata), **overrides)
+
+    def to_entry(self) -> MemoryEntry:
+        """转换为 MemoryEntry（接口层的校验模型）"""
+        return MemoryEntry(
+            id=self.id,
+            content=self.content,
+            timestamp=datetime.fromisoformat(self.timestamp) if self.timestamp else datetime.now(),
+            metadata=self.metadata
+        )
+
+    def to_dict(self, include_embedding: bool = False) -> Dict[str, Any]:
+        """转换为可 JSON 序列化的字典（落盘时不含向量本身，向量按 embedding_row 读取），值为空的检索字段省略"""
+        data = {}
+        for name in _MEMORY_RECORD_FIELDS:
+            value = getattr(self, name)
+            if name == "embedding":
+                if include_embedding and value is not None:
+                    data[name] = value.tolist()
+            elif value is not None or name not in _OPTIONAL_RESULT_FIELDS:
+                data[name] = value
+        return data
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """按字段名读取，兼容字典接口"""
+        value = getattr(self, key, None) if key in _MEMORY_RECORD_FIELDS else None
+        return default if value is None else value
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in _MEMORY_RECORD_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+_MEMORY_RECORD_FIELDS = tuple(f.name for f in fields(MemoryRecord))
+# 只在检索结果中出现的字段，为空时不写入字典
+_OPTIONAL_RESULT_FIELDS = ("embedding_row", "distance", "relevance_score")
+
 class TrainingData(BaseModel):
     input: str
     output: str